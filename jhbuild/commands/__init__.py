@@ -173,7 +173,7 @@ def run(command, config, args, help):
     # if the command hasn't been registered, load a module by the same name
     if command not in _commands:
         try:
-            __import__('jhbuild.commands.%s' % command)
+            __import__('jhbuild.commands.%s' % command.replace('-', ''))
         except ImportError:
             pass
     if command not in _commands:
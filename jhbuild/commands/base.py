@@ -224,6 +224,14 @@ class cmd_build(BuildCommand):
             make_option('--min-age', metavar='TIME-SPEC',
                         action='store', dest='min_age', default=None,
                         help=_('skip modules installed less than the given time ago')),
+            make_option('--jobs-modules', metavar='N',
+                        action='store', type='int', dest='jobs_modules',
+                        default=None,
+                        help=_('build up to N independent modules in parallel')),
+            make_option('--prefetch', metavar='N',
+                        action='store', type='int', dest='prefetch_modules',
+                        default=None,
+                        help=_('check out the next N modules in the background')),
             make_option('--nodeps',
                         action='store_false', dest='check_sysdeps', default=None,
                         help=_('ignore missing system dependencies')),
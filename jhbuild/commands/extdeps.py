@@ -159,11 +159,9 @@ class cmd_extdeps(Command):
 
 
     def compute_rdeps(self, module):
-        rdeps = []
-        for mod in self.module_set.modules.values():
-            if mod.type == 'meta': continue
-            if module.name in mod.dependencies:
-                rdeps.append(mod.name)
+        rdeps = [name for name in
+                 self.module_set.get_reverse_dependencies(module.name)
+                 if self.module_set.modules[name].type != 'meta']
         rdeps.sort(lambda x,y: cmp(x.lower(), y.lower()))
         return rdeps
 
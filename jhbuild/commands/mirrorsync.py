@@ -0,0 +1,80 @@
+# jhbuild - a tool to ease building collections of source packages
+#
+#   mirrorsync.py: refresh the Git mirrors of dvcs_mirror_dir
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import time
+from optparse import make_option
+
+import jhbuild.moduleset
+from jhbuild.commands import Command, register_command
+from jhbuild.errors import FatalError
+from jhbuild.versioncontrol import git
+
+class cmd_mirror_sync(Command):
+    doc = N_('Refresh the Git mirrors in the mirror directory in parallel')
+
+    name = 'mirror-sync'
+    usage_args = N_('[ options ... ] [ modules ... ]')
+
+    def __init__(self):
+        Command.__init__(self, [
+            make_option('-j', '--jobs', metavar='N',
+                        action='store', type='int', dest='jobs', default=None,
+                        help=_('refresh up to N mirrors at the same time')),
+            make_option('--timeout', metavar='SECONDS',
+                        action='store', type='int', dest='timeout',
+                        default=None,
+                        help=_('abandon the refresh of a mirror after the '
+                               'given time')),
+            make_option('-f', '--force',
+                        action='store_true', dest='force', default=False,
+                        help=_('also refresh the mirrors that are up to date')),
+            ])
+
+    def run(self, config, options, args, help=None):
+        if not config.dvcs_mirror_dir:
+            raise FatalError(_('dvcs_mirror_dir is not set'))
+        if options.jobs is not None:
+            if options.jobs < 1:
+                raise FatalError(_('\'jobs\' must be at least 1'))
+            config.dvcs_mirror_jobs = options.jobs
+        if options.timeout is not None:
+            config.dvcs_mirror_timeout = options.timeout
+        if options.force:
+            config.dvcs_mirror_max_age = 0
+
+        module_set = jhbuild.moduleset.load(config)
+        module_list = module_set.get_full_module_list(args or config.modules,
+                                                      config.skip)
+        branches = [module.branch for module in module_list
+                    if isinstance(getattr(module, 'branch', None),
+                                  git.GitBranch)]
+        mirrors = git.find_git_mirrors(config, branches)
+
+        start = time.time()
+        failures = git.sync_git_mirrors(config, mirrors)
+        uprint(_('%(num)d mirrors up to date after %(time)d seconds') % {
+                'num': len(mirrors) - len(failures),
+                'time': time.time() - start})
+        for mirror_dir, message in failures:
+            uprint(_('%(mirror)s: %(message)s') % {'mirror': mirror_dir,
+                                                   'message': message})
+        if failures:
+            return 1
+        return 0
+
+register_command(cmd_mirror_sync)
@@ -58,23 +58,30 @@ class cmd_rdepends(Command):
         modules = module_set.get_full_module_list(skip=dependencies_list)
         modules = modules[[x.name for x in modules].index(modname)+1:]
 
-        # iterate over remaining modules, and print those with modname as dep;
-        # this is totally inefficient as a complete dependency list is computed
-        # for each module.
+        if options.direct:
+            rdeps = module_set.get_reverse_dependencies(modname)
+        elif module_set.remove_system_modules([module_set.modules[modname]]):
+            rdeps = module_set.get_reverse_dependencies(modname,
+                    transitive=True, include_suggests=True)
+        else:
+            # system module already available; it is not part of the module
+            # list of any module
+            rdeps = set()
+
+        # iterate over remaining modules, and print those depending on modname
         seen_modules = []
         for module in modules:
+            if module.name not in rdeps:
+                continue
             if options.direct:
-                if modname in module.dependencies:
-                    uprint(module.name)
+                uprint(module.name)
             else:
-                module_list = module_set.get_module_list([module.name])
-                if modname in [x.name for x in module_list]:
-                    seen_modules.append(module.name)
-                    deps = ''
-                    if options.dependencies:
-                        dependencies = [x for x in module.dependencies if x in seen_modules]
-                        if dependencies:
-                            deps = '[' + ','.join(dependencies) + ']'
-                    uprint(module.name, deps)
+                seen_modules.append(module.name)
+                deps = ''
+                if options.dependencies:
+                    dependencies = [x for x in module.dependencies if x in seen_modules]
+                    if dependencies:
+                        deps = '[' + ','.join(dependencies) + ']'
+                uprint(module.name, deps)
 
 register_command(cmd_rdepends)
@@ -26,6 +26,7 @@ from optparse import make_option
 
 import jhbuild.moduleset
 from jhbuild.commands import Command, register_command
+from jhbuild.versioncontrol import get_tree_ids
 
 from jhbuild.utils.sxml import sxml, sxml_to_string
 
@@ -42,8 +43,10 @@ class cmd_snapshot(Command):
         module_list = module_set.get_module_list(args or config.modules,
                                                  config.skip)
         meta = [m for m in module_list if m.type == 'meta']
+        tree_ids = get_tree_ids([m.branch for m in module_list
+                                 if getattr(m, 'branch', None)], config.jobs)
         checked_out_mods = [m for m in module_list
-                            if getattr(m, 'branch', None) and m.branch.tree_id()]
+                            if getattr(m, 'branch', None) and tree_ids[m.branch]]
         checked_out_repos = []
 
         for mod in checked_out_mods:
@@ -19,7 +19,6 @@
 
 from optparse import make_option
 import logging
-import subprocess
 import sys
 
 import jhbuild.moduleset
@@ -30,6 +29,7 @@ from jhbuild.utils.systeminstall import SystemInstall
 from jhbuild.modtypes.systemmodule import SystemModule
 from jhbuild.versioncontrol.tarball import TarballBranch
 from jhbuild.utils import cmds
+from jhbuild.utils import dpkg
 
 class cmd_sysdeps(cmd_build):
     doc = N_('Check and install tarball dependencies using system packages')
@@ -50,16 +50,20 @@ class cmd_sysdeps(cmd_build):
             make_option('--install',
                         action='store_true', default=False,
                         help=_('Install pkg-config modules via system'))])
+        self._dpkg_index = None
+
+    def _get_dpkg_index(self):
+        if self._dpkg_index is None:
+            self._dpkg_index = dpkg.DpkgIndex(
+                    filename=dpkg.get_cache_filename())
+        return self._dpkg_index
 
     def _get_all_system_packages(self):
-        """ get all pkgs from `dpkg -l` command. return a dict
+        """ get all installed pkgs, as listed by `dpkg -l`. return a dict
         """
-        results = {}
-        for line in subprocess.check_output(['dpkg', '-l']).splitlines():
-            if not line.startswith('ii'):
-                continue
-            parts = line.split()
-            results[parts[1]] = parts[2]
+        index = self._get_dpkg_index()
+        results = index.get_installed_packages()
+        index.save()
         return results
 
     def _find_system_packages(self, systemdependencies):
@@ -74,12 +78,11 @@ class cmd_sysdeps(cmd_build):
         if not patterns:
             return {}, []
 
-        stdout, stderr = subprocess.Popen(['dpkg', '-S'] + list(patterns), stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-        found = {}
-        for line in stdout.splitlines():
-            parts = line.strip().split(': ')
-            if len(parts) == 2:
-                found[parts[1]] = parts[0].split(', ')
+        # the owners are looked up in an index of the dpkg file lists,
+        # rather than with dpkg -S which reads all of them again
+        index = self._get_dpkg_index()
+        found = index.search(patterns)
+        index.save()
 
         # figure out what is not found
         notfound = []
@@ -55,7 +55,7 @@ _known_keys = [ 'moduleset', 'modules', 'skip', 'tags', 'prefix',
                 'copy_dir', 'module_checkout_mode', 'build_policy',
                 'trycheckout', 'min_age', 'nopoison', 'module_nopoison',
                 'forcecheck', 'makecheck_advisory', 'quiet_mode',
-                'progress_bar', 'module_extra_env', 'jhbuildbot_master',
+                'quiet_mode_lines', 'progress_bar', 'module_extra_env', 'jhbuildbot_master',
                 'jhbuildbot_slavename', 'jhbuildbot_password',
                 'jhbuildbot_svn_commits_box', 'jhbuildbot_slaves_dir',
                 'jhbuildbot_dir', 'jhbuildbot_mastercfg',
@@ -68,6 +68,10 @@ _known_keys = [ 'moduleset', 'modules', 'skip', 'tags', 'prefix',
                 'static_analyzer_outputdir', 'check_sysdeps', 'system_prefix',
                 'help_website', 'conditions', 'extra_prefixes',
                 'disable_Werror', 'xdg_cache_home', 'exit_on_error',
+                'jobs_modules', 'prefetch_modules', 'packagedb_backend',
+                'artifact_cache_dir', 'artifact_cache_size', 'debug_store',
+                'incremental_install', 'dvcs_mirror_sync', 'dvcs_mirror_jobs',
+                'dvcs_mirror_timeout', 'dvcs_mirror_max_age',
                 'jhhome', # liuhuan: custom path under which we put modulesets, build, install
                 'modulecmakeargs', # liuhuan: custom package specific cmakeargs
                 'appendmodulecmakeargs' # woody: custom package specific appendcmakeargs
@@ -252,7 +256,7 @@ class Config:
                          'jhbuildbot_slaves_dir', 'jhbuildbot_dir',
                          'jhbuildbot_mastercfg', 'modulesets_dir',
                          'dvcs_mirror_dir', 'static_analyzer_outputdir',
-                         'prefix'):
+                         'artifact_cache_dir', 'prefix'):
             if config.get(path_key):
                 config[path_key] = os.path.expanduser(config[path_key])
 
@@ -279,6 +283,15 @@ class Config:
         if seen_copy_mode and not self.copy_dir:
             raise FatalError(_('copy mode requires copy_dir to be set'))
 
+        if self.packagedb_backend not in ('files', 'sqlite'):
+            raise FatalError(_('invalid package database backend'))
+        if self.dvcs_mirror_jobs < 1:
+            raise FatalError(_('\'dvcs_mirror_jobs\' must be at least 1'))
+        if self.quiet_mode_lines is not None and self.quiet_mode_lines < 1:
+            raise FatalError(_('\'quiet_mode_lines\' must be at least 1'))
+        if self.debug_store not in ('path', 'build-id'):
+            raise FatalError(_('invalid debug symbols store'))
+
         if not os.path.exists(self.modulesets_dir):
             if self.use_local_modulesets:
                 logging.warning(
@@ -392,6 +405,13 @@ class Config:
             self.quiet_mode = True
         if hasattr(options, 'force_policy') and options.force_policy:
             self.build_policy = 'all'
+        if hasattr(options, 'jobs_modules') and options.jobs_modules:
+            if options.jobs_modules < 1:
+                raise FatalError(_('\'jobs_modules\' must be at least 1'))
+            self.jobs_modules = options.jobs_modules
+        if hasattr(options, 'prefetch_modules') and (
+                options.prefetch_modules is not None):
+            self.prefetch_modules = options.prefetch_modules
         if hasattr(options, 'min_age') and options.min_age:
             try:
                 self.min_age = time.time() - parse_relative_time(options.min_age)
@@ -80,6 +80,8 @@ class ServerProxy(xmlrpclib.ServerProxy):
 class AutobuildBuildScript(buildscript.BuildScript, TerminalBuildScript):
     xmlrpc_report_url = None
     verbose = False
+    # modulefp and phasefp are shared by all the modules
+    supports_parallel_modules = False
 
     def __init__(self, config, module_list, module_set=None):
         buildscript.BuildScript.__init__(self, config, module_list, module_set=module_set)
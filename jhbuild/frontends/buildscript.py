@@ -22,12 +22,34 @@ import os
 import logging
 import subprocess
 import sys
+import threading
 
 from jhbuild.utils import trigger
 from jhbuild.utils import cmds
+from jhbuild.utils import fileutils
 from jhbuild.errors import FatalError, CommandError, SkipToPhase, SkipToEnd
 
+# seconds between checks for interruptions while waiting for modules
+WAIT_TIMEOUT = 0.5
+
 class BuildScript:
+    # phases that modify the prefix or the package database; when building
+    # modules in parallel these only run for one module at a time.
+    serialized_phases = ('install', 'uninstall')
+
+    # whether the frontend keeps the state of the module being built per
+    # thread, so that several modules can be built at the same time
+    supports_parallel_modules = False
+
+    # per-thread state of parallel builds
+    _module_logs = threading.local()
+
+    # trigger.TriggerMatcher of the trigger scripts, loaded once
+    _triggers = None
+    # during a build of several modules, the triggers waiting to be run,
+    # mapped to the modules whose installation matched them
+    _pending_triggers = None
+
     def __init__(self, config, module_list=None, module_set=None):
         if self.__class__ is BuildScript:
             raise NotImplementedError('BuildScript is an abstract base class')
@@ -35,6 +57,9 @@ class BuildScript:
         self.modulelist = module_list
         self.moduleset = module_set
         self.module_num = 0
+        self._prefetches = {}
+        self._prefetched = set()
+        self._failures = []
 
         self.config = config
 
@@ -97,145 +122,429 @@ class BuildScript:
 
     def build(self, phases=None):
         '''start the build of the current configuration'''
+        if self.config.jobs_modules > 1 and not self.supports_parallel_modules:
+            raise FatalError(_('this frontend cannot build modules in '
+                               'parallel, set jobs_modules to 1'))
         self.start_build()
         
         failures = [] # list of modules that couldn't be built
-        successes = []
         self.module_num = 0
-        for module in self.modulelist:
-            self.module_num = self.module_num + 1
-
-            if self.config.min_age is not None:
-                installdate = self.moduleset.packagedb.installdate(module.name)
-                if installdate > self.config.min_age:
-                    self.message(_('Skipping %s (installed recently)') % module.name)
-                    continue
+        self._install_lock = threading.Lock()
+        self._interaction_lock = threading.RLock()
+        self._prefetches = {}
+        self._prefetched = set()
+        self._failures = failures
+        if phases is None or 'checkout' in phases:
+            self._sync_mirrors()
+        if self.config.build_policy in ('updated', 'updated-deps'):
+            self._query_revisions()
+        if len(self.modulelist) > 1:
+            self._pending_triggers = {}
+            self._build_dependencies = self._get_build_dependencies()
+        completed = False
+        try:
+            try:
+                if self.config.jobs_modules > 1 and len(self.modulelist) > 1:
+                    self._build_parallel(phases, failures)
+                else:
+                    for i, module in enumerate(self.modulelist):
+                        self.module_num = self.module_num + 1
+                        self._prefetch(i, phases)
+                        self._build_module(module, phases, failures)
+                completed = True
+            finally:
+                if completed:
+                    self._run_pending_triggers()
+                else:
+                    # the build stopped early, on exit_on_error or an
+                    # interruption: the installed modules still get their
+                    # triggers, without hiding the error that stopped it
+                    try:
+                        self._run_pending_triggers()
+                    except Exception as e:
+                        logging.error(_('Failed to run post-installation '
+                                        'triggers: %s') % e)
+        finally:
+            self._pending_triggers = None
+            # do not leave fetches running behind the end of the build
+            for thread in self._prefetches.values():
+                if thread is not None:
+                    thread.join()
 
-            self.start_module(module.name)
-            failed = False
-            for dep in module.dependencies:
-                if dep in failures:
-                    if self.config.module_nopoison.get(dep,
-                                                       self.config.nopoison):
-                        self.message(_('module %(mod)s will be built even though %(dep)s failed')
-                                     % { 'mod':module.name, 'dep':dep })
-                    else:
-                        self.message(_('module %(mod)s not built due to non buildable %(dep)s')
-                                     % { 'mod':module.name, 'dep':dep })
-                        failed = True
-            if failed:
-                failures.append(module.name)
-                self.end_module(module.name, failed)
-                continue
+        self.end_build(failures)
+        if failures:
+            return 1
+        return 0
 
-            if not phases:
-                build_phases = self.get_build_phases(module)
-            else:
-                build_phases = phases
-            phase = None
-            num_phase = 0
-
-            # if there is an error and a new phase is selected (be it by the
-            # user or an automatic system), the chosen phase must absolutely
-            # be executed, it should in no condition be skipped automatically.
-            # The force_phase variable flags that condition.
-            force_phase = False
-
-            while num_phase < len(build_phases):
-                last_phase, phase = phase, build_phases[num_phase]
-                try:
-                    if not force_phase and module.skip_phase(self, phase, last_phase):
-                        num_phase += 1
-                        continue
-                except SkipToEnd:
-                    break
+    def _build_module(self, module, phases, failures):
+        '''build a single module, adding it to failures if it could not
+        be built'''
+        if self.config.min_age is not None:
+            installdate = self.moduleset.packagedb.installdate(module.name)
+            if installdate > self.config.min_age:
+                self.message(_('Skipping %s (installed recently)') % module.name)
+                return
+
+        if self._pending_triggers:
+            # the triggers of the modules this one needs must have run
+            # before it is built
+            self._install_lock.acquire()
+            try:
+                self._run_pending_triggers(module)
+            finally:
+                self._install_lock.release()
+
+        self.start_module(module.name)
+        failed = False
+        for dep in module.dependencies:
+            if dep in failures:
+                if self.config.module_nopoison.get(dep,
+                                                   self.config.nopoison):
+                    self.message(_('module %(mod)s will be built even though %(dep)s failed')
+                                 % { 'mod':module.name, 'dep':dep })
+                else:
+                    self.message(_('module %(mod)s not built due to non buildable %(dep)s')
+                                 % { 'mod':module.name, 'dep':dep })
+                    failed = True
+        if failed:
+            failures.append(module.name)
+            self.end_module(module.name, failed)
+            return
 
-                if not module.has_phase(phase):
-                    # skip phases that do not exist, this can happen when
-                    # phases were explicitely passed to this method.
+        if not phases:
+            build_phases = self.get_build_phases(module)
+        else:
+            build_phases = phases
+        phase = None
+        num_phase = 0
+
+        # if there is an error and a new phase is selected (be it by the
+        # user or an automatic system), the chosen phase must absolutely
+        # be executed, it should in no condition be skipped automatically.
+        # The force_phase variable flags that condition.
+        force_phase = False
+
+        while num_phase < len(build_phases):
+            last_phase, phase = phase, build_phases[num_phase]
+            try:
+                if not force_phase and module.skip_phase(self, phase, last_phase):
                     num_phase += 1
                     continue
+            except SkipToEnd:
+                break
+
+            if not module.has_phase(phase):
+                # skip phases that do not exist, this can happen when
+                # phases were explicitely passed to this method.
+                num_phase += 1
+                continue
 
-                self.start_phase(module.name, phase)
-                error = None
+            self.start_phase(module.name, phase)
+            error = None
+            serialized = phase in self.serialized_phases
+            if serialized:
+                self._install_lock.acquire()
+            try:
                 try:
+                    error, altphases = module.run_phase(self, phase)
+                except SkipToPhase as e:
                     try:
-                        error, altphases = module.run_phase(self, phase)
-                    except SkipToPhase as e:
-                        try:
-                            num_phase = build_phases.index(e.phase)
-                        except ValueError:
-                            break
-                        continue
-                    except SkipToEnd:
+                        num_phase = build_phases.index(e.phase)
+                    except ValueError:
                         break
-                finally:
+                    continue
+                except SkipToEnd:
+                    break
+            finally:
+                try:
                     self._end_phase_internal(module.name, phase, error)
+                finally:
+                    if serialized:
+                        self._install_lock.release()
 
-                if error:
-                    if self.config.exit_on_error:
-                        sys.exit(1)
+            if error:
+                if self.config.exit_on_error:
+                    sys.exit(1)
 
-                    try:
-                        nextphase = build_phases[num_phase+1]
-                    except IndexError:
-                        nextphase = None
+                try:
+                    nextphase = build_phases[num_phase+1]
+                except IndexError:
+                    nextphase = None
+                self._interaction_lock.acquire()
+                try:
                     newphase = self.handle_error(module, phase,
                                                  nextphase, error,
                                                  altphases)
-                    force_phase = True
-                    if newphase == 'fail':
-                        failures.append(module.name)
-                        failed = True
-                        break
-                    if newphase is None:
-                        break
-                    if newphase in build_phases:
-                        num_phase = build_phases.index(newphase)
-                    else:
-                        # requested phase is not part of the plan, we insert
-                        # it, then fill with necessary phases to get back to
-                        # the current one.
-                        filling_phases = self.get_build_phases(module, targets=[phase])
-                        canonical_new_phase = newphase
-                        if canonical_new_phase.startswith('force_'):
-                            # the force_ phases won't appear in normal build
-                            # phases, so get the non-forced phase
-                            canonical_new_phase = canonical_new_phase[6:]
-
-                        if canonical_new_phase in filling_phases:
-                            filling_phases = filling_phases[
-                                    filling_phases.index(canonical_new_phase)+1:-1]
-                        build_phases[num_phase:num_phase] = [newphase] + filling_phases
-
-                        if build_phases[num_phase+1] == canonical_new_phase:
-                            # remove next phase if it would just be a repeat of
-                            # the inserted one
-                            del build_phases[num_phase+1]
+                finally:
+                    self._interaction_lock.release()
+                force_phase = True
+                if newphase == 'fail':
+                    failures.append(module.name)
+                    failed = True
+                    break
+                if newphase is None:
+                    break
+                if newphase in build_phases:
+                    num_phase = build_phases.index(newphase)
                 else:
-                    force_phase = False
-                    num_phase += 1
-
-            self.end_module(module.name, failed)
-
-        self.end_build(failures)
-        if failures:
-            return 1
-        return 0
-
-    def run_triggers(self, modules):
-        """See triggers/README."""
-        assert 'JHBUILD_PREFIX' in os.environ
-        if os.environ.get('JHBUILD_TRIGGERS') is not None:
-            trigger_path = os.environ.get('JHBUILD_TRIGGERS')
-        elif PKGDATADIR is not None:
-            trigger_path = os.path.join(PKGDATADIR, 'triggers')
-        else:
-            trigger_path = os.path.join(SRCDIR, 'triggers')
-        all_triggers = trigger.load_all(trigger_path)
-
+                    # requested phase is not part of the plan, we insert
+                    # it, then fill with necessary phases to get back to
+                    # the current one.
+                    filling_phases = self.get_build_phases(module, targets=[phase])
+                    canonical_new_phase = newphase
+                    if canonical_new_phase.startswith('force_'):
+                        # the force_ phases won't appear in normal build
+                        # phases, so get the non-forced phase
+                        canonical_new_phase = canonical_new_phase[6:]
+
+                    if canonical_new_phase in filling_phases:
+                        filling_phases = filling_phases[
+                                filling_phases.index(canonical_new_phase)+1:-1]
+                    build_phases[num_phase:num_phase] = [newphase] + filling_phases
+
+                    if build_phases[num_phase+1] == canonical_new_phase:
+                        # remove next phase if it would just be a repeat of
+                        # the inserted one
+                        del build_phases[num_phase+1]
+            else:
+                force_phase = False
+                num_phase += 1
+
+        self.end_module(module.name, failed)
+
+    def _build_parallel(self, phases, failures):
+        '''build independent modules concurrently, in up to jobs_modules
+        worker threads.
+
+        A module is started once every module it depends on (including
+        <after> and <suggests> modules) that comes earlier in the module list
+        has finished, so the serial build order remains a valid
+        linearisation of the parallel one.  Phases listed in
+        serialized_phases are run one module at a time, as they modify the
+        prefix and the package database.'''
+        position = dict((module.name, i) for i, module in enumerate(self.modulelist))
+        blockers = {}
+        for i, module in enumerate(self.modulelist):
+            blockers[module.name] = set(
+                    [dep for dep in module.dependencies + module.after + module.suggests
+                     if position.get(dep, i) < i])
+
+        waiting = list(self.modulelist)
+        running = set()
+        exits = []
+        condition = threading.Condition()
+
+        def worker(module):
+            logfile = self._open_module_log(module)
+            self.message(_('Building %(module)s (output in %(log)s)')
+                         % {'module': module.name, 'log': logfile.name})
+            self._module_logs.fp = logfile
+            try:
+                try:
+                    self._build_module(module, phases, failures)
+                except SystemExit as e:
+                    # exit_on_error; stop scheduling and exit once the
+                    # running modules are done
+                    exits.append(e)
+                except Exception:
+                    logging.exception(_('Unexpected error building %s') % module.name)
+                    failures.append(module.name)
+            finally:
+                self._module_logs.fp = None
+                logfile.close()
+                condition.acquire()
+                try:
+                    running.discard(module.name)
+                    for deps in blockers.values():
+                        deps.discard(module.name)
+                    condition.notify()
+                finally:
+                    condition.release()
+
+        condition.acquire()
+        try:
+            while waiting or running:
+                if exits:
+                    del waiting[:]
+                for module in [x for x in waiting if not blockers[x.name]]:
+                    if len(running) >= self.config.jobs_modules:
+                        break
+                    waiting.remove(module)
+                    running.add(module.name)
+                    self.module_num = self.module_num + 1
+                    self._prefetch(position[module.name], phases)
+                    thread = threading.Thread(target=worker, args=(module,),
+                                              name='jhbuild-%s' % module.name)
+                    thread.daemon = True
+                    thread.start()
+                if running:
+                    # with a timeout, so that KeyboardInterrupt is not
+                    # held until a module finishes
+                    condition.wait(WAIT_TIMEOUT)
+        finally:
+            condition.release()
+
+        if exits:
+            raise exits[0]
+
+    def _get_build_dependencies(self):
+        '''Return a dictionary mapping the names of the modules of the
+        build to the sets of the modules of the build they need, directly
+        or not.'''
+        result = {}
+        for module in self.modulelist:
+            deps = set()
+            for dep in module.dependencies + module.after + module.suggests:
+                if dep in result:
+                    deps.add(dep)
+                    deps.update(result[dep])
+            result[module.name] = deps
+        return result
+
+    def _open_module_log(self, module, suffix=''):
+        logdir = os.path.join(self.config.top_builddir, 'logs')
+        fileutils.mkdir_with_parents(logdir)
+        return open(os.path.join(logdir, '%s%s.log' % (module.name, suffix)), 'w')
+
+    def _sync_mirrors(self):
+        '''refresh all the Git mirrors in dvcs_mirror_dir before the build,
+        when dvcs_mirror_sync is set, so that the checkouts of the modules
+        do not need to fetch them again.'''
+        if not (self.config.dvcs_mirror_sync and self.config.dvcs_mirror_dir):
+            return
+        if self.config.nonetwork:
+            return
+        from jhbuild.versioncontrol import git
+        branches = [module.branch for module in self.modulelist
+                    if isinstance(getattr(module, 'branch', None), git.GitBranch)]
+        mirrors = git.find_git_mirrors(self.config, branches)
+        self.message(_('Refreshing %d mirrors') % len(mirrors))
+        # mirrors that failed are fetched again by the checkouts, which
+        # report the errors
+        git.sync_git_mirrors(self.config, mirrors)
+
+    def _query_revisions(self):
+        '''query the revisions of the Git checkouts concurrently, for the
+        build policy.  They are cached until the repositories change, which
+        the checkouts of updated modules do.  Whether the checkouts have
+        local changes is still checked for each module, as building
+        changes the working trees.'''
+        from jhbuild.versioncontrol import git
+        branches = [module.branch for module in self.modulelist
+                    if isinstance(getattr(module, 'branch', None), git.GitBranch)]
+        git.query_revisions(branches, self.config.jobs)
+
+    def _prefetch(self, index, phases=None):
+        '''start checking out, in background threads, the modules following
+        position index in the module list.
+
+        At most prefetch_modules modules ahead are considered, and at most
+        that many fetches run at the same time.'''
+        window = self.config.prefetch_modules
+        if not window:
+            return
+        # never start fetching a module that is already being built
+        self._prefetches.setdefault(self.modulelist[index].name, None)
+        for module in self.modulelist[index+1:index+1+window]:
+            if module.name in self._prefetches:
+                continue
+            running = [x for x in self._prefetches.values() if x and x.is_alive()]
+            if len(running) >= window:
+                break
+            if not self._may_prefetch(module, phases):
+                continue
+            thread = threading.Thread(target=self._prefetch_module,
+                                      args=(module,),
+                                      name='jhbuild-prefetch-%s' % module.name)
+            thread.daemon = True
+            self._prefetches[module.name] = thread
+            thread.start()
+
+    def _may_prefetch(self, module, phases=None):
+        '''Return whether _build_module would check out module, as far as
+        can be known before its turn.'''
+        from jhbuild.versioncontrol.tarball import TarballBranch
+        branch = getattr(module, 'branch', None)
+        if branch is None or not branch.may_checkout(self):
+            return False
+        if self.config.min_age is not None:
+            installdate = self.moduleset.packagedb.installdate(module.name)
+            if installdate > self.config.min_age:
+                return False
+        for dep in module.dependencies:
+            if dep in self._failures and not self.config.module_nopoison.get(
+                    dep, self.config.nopoison):
+                return False
+        if 'checkout' not in (phases or self.get_build_phases(module)):
+            return False
+        try:
+            if module.skip_phase(self, 'checkout', None):
+                return False
+        except SkipToEnd:
+            return False
+        if isinstance(branch, TarballBranch) and not branch.quilt:
+            # the revision of a tarball is known before it is downloaded,
+            # so the build policy can be applied now; other branches are
+            # only known to be up to date once they are updated
+            if module.get_build_policy_skip(self) is not None:
+                return False
+        return True
+
+    def _prefetch_module(self, module):
+        logfile = self._open_module_log(module, '-checkout')
+        self._module_logs.fp = logfile
+        try:
+            try:
+                module.branch.checkout(_PrefetchBuildScript(self, logfile))
+            except Exception as e:
+                # the checkout phase will try again, and report the error
+                logfile.write('%s\n' % e)
+            else:
+                self._prefetched.add(module.name)
+        finally:
+            self._module_logs.fp = None
+            logfile.close()
+
+    def wait_for_prefetch(self, module):
+        '''Wait for the background checkout of module, if one was started.
+
+        Returns True if the sources of the module have been successfully
+        checked out or updated in the background, in which case there is no
+        need to check them out again.'''
+        thread = self._prefetches.get(module.name)
+        if thread is None:
+            return False
+        if thread.is_alive():
+            self.message(_('Waiting for checkout of %s') % module.name)
+            thread.join()
+        if module.name in self._prefetched:
+            self._prefetched.discard(module.name)
+            return True
+        return False
+
+    def get_module_log(self):
+        '''Return the file object receiving the command output of the
+        module built by the calling thread, or None when the output is not
+        redirected (serial builds).'''
+        return getattr(self._module_logs, 'fp', None)
+
+    def _get_triggers(self):
+        if self._triggers is None:
+            if os.environ.get('JHBUILD_TRIGGERS') is not None:
+                trigger_path = os.environ.get('JHBUILD_TRIGGERS')
+            elif PKGDATADIR is not None:
+                trigger_path = os.path.join(PKGDATADIR, 'triggers')
+            else:
+                trigger_path = os.path.join(SRCDIR, 'triggers')
+            self._triggers = trigger.TriggerMatcher(
+                    trigger.load_all(trigger_path))
+        return self._triggers
+
+    def _find_triggers(self, modules):
+        '''Return the triggers matching the manifests of modules, in the
+        order they are run.'''
+        triggers = self._get_triggers()
         triggers_to_run = set()
-
         for module_name in modules:
             # Skip if somehow the module isn't really installed
             if self.moduleset.packagedb.installdate(module_name) is None:
@@ -250,13 +559,42 @@ class BuildScript:
             if pkg.manifest is None:
                 continue
 
-            for trig in all_triggers:
-                if trig.matches(pkg.manifest):
-                    triggers_to_run.add(trig)
+            triggers_to_run.update(triggers.matches(pkg.manifest))
+        return [x for x in triggers.triggers if x in triggers_to_run]
 
+    def run_triggers(self, modules):
+        """See triggers/README."""
+        assert 'JHBUILD_PREFIX' in os.environ
         if not modules:
-            triggers_to_run = set(all_triggers)
+            self._execute_triggers(self._get_triggers().triggers)
+        else:
+            self._execute_triggers(self._find_triggers(modules))
 
+    def _defer_triggers(self, module_name):
+        '''Add the triggers matching the manifest of module_name to the
+        pending triggers, to be run once for all the modules that need
+        them.'''
+        assert 'JHBUILD_PREFIX' in os.environ
+        for trig in self._find_triggers([module_name]):
+            self._pending_triggers.setdefault(trig, set()).add(module_name)
+
+    def _run_pending_triggers(self, module=None):
+        '''Run the pending triggers matched by the modules that module
+        needs, or all of them if module is None.'''
+        if not self._pending_triggers:
+            return
+        if module is None:
+            triggers_to_run = list(self._pending_triggers)
+        else:
+            deps = self._build_dependencies.get(module.name, ())
+            triggers_to_run = [trig for trig, modules in self._pending_triggers.items()
+                               if not modules.isdisjoint(deps)]
+        for trig in triggers_to_run:
+            del self._pending_triggers[trig]
+        self._execute_triggers([x for x in self._get_triggers().triggers
+                                if x in triggers_to_run])
+
+    def _execute_triggers(self, triggers_to_run):
         for trig in triggers_to_run:
             logging.info(_('Running post-installation trigger script: %r') % (trig.name, ))
             try:
@@ -327,7 +665,10 @@ class BuildScript:
         pass
     def _end_phase_internal(self, module, phase, error):
         if error is None and phase == 'install':
-            self.run_triggers([module])
+            if self._pending_triggers is not None:
+                self._defer_triggers(module)
+            else:
+                self.run_triggers([module])
         self.end_phase(module, phase, error)
 
     def message(self, msg, module_num=-1):
@@ -341,3 +682,24 @@ class BuildScript:
     def handle_error(self, module, phase, nextphase, error, altphases):
         '''handle error during build'''
         raise NotImplementedError
+
+
+class _PrefetchBuildScript(object):
+    '''Build script handed to branches checked out in the background, so
+    their messages end up in the checkout log instead of the terminal.'''
+
+    def __init__(self, buildscript, logfile):
+        self._buildscript = buildscript
+        self._logfile = logfile
+
+    def __getattr__(self, attr):
+        return getattr(self._buildscript, attr)
+
+    def message(self, msg, module_num=-1):
+        self._logfile.write('%s\n' % msg)
+        self._logfile.flush()
+
+    def set_action(self, action, module, module_num=-1, action_target=None):
+        if not action_target:
+            action_target = module.name
+        self.message('%s %s' % (action, action_target))
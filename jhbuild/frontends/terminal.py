@@ -22,6 +22,7 @@ import sys
 import os
 import signal
 import subprocess
+import threading
 import unicodedata
 import locale
 
@@ -113,8 +114,12 @@ def teamcity_message(name, arg=None, **kwargs):
     sys.stdout.flush()
 
 class TerminalBuildScript(buildscript.BuildScript):
-    triedcheckout = None
     is_end_of_build = False
+    supports_parallel_modules = True
+
+    # per-thread state of the module being built: the automatic retries
+    # of handle_error
+    _module_state = threading.local()
 
     def __init__(self, config, module_list, module_set=None):
         buildscript.BuildScript.__init__(self, config, module_list, module_set=module_set)
@@ -208,10 +213,20 @@ class TerminalBuildScript(buildscript.BuildScript):
             # see https://bugzilla.gnome.org/show_bug.cgi?id=670349 
             hint = None
 
+        # output of modules built in parallel goes to their own log file
+        module_log = self.get_module_log()
+        if module_log is not None:
+            hint = None
+
         if not self.config.quiet_mode:
             if self.config.print_command_pattern:
                 try:
-                    print self.config.print_command_pattern % print_args
+                    if module_log is not None:
+                        module_log.write(self.config.print_command_pattern
+                                         % print_args + '\n')
+                        module_log.flush()
+                    else:
+                        print self.config.print_command_pattern % print_args
                 except TypeError as e:
                     raise FatalError('\'print_command_pattern\' %s' % e)
                 except KeyError as e:
@@ -232,6 +247,9 @@ class TerminalBuildScript(buildscript.BuildScript):
         if self.config.quiet_mode:
             kws['stdout'] = subprocess.PIPE
             kws['stderr'] = subprocess.STDOUT
+        elif module_log is not None:
+            kws['stdout'] = module_log
+            kws['stderr'] = subprocess.STDOUT
 
         if cwd is not None:
             kws['cwd'] = cwd
@@ -247,7 +265,10 @@ class TerminalBuildScript(buildscript.BuildScript):
         except OSError as e:
             raise CommandError(str(e))
 
-        output = []
+        # in quiet mode, the end of the output is kept to be shown if the
+        # command fails; modules built in parallel get all of it in their
+        # log file
+        output = cmds.OutputTail(self.config.quiet_mode_lines, module_log)
         if hint in ('cvs', 'svn', 'hg-update.py'):
             conflicts = []
             def format_line(line, error_output, conflicts = conflicts, output = output):
@@ -293,7 +314,12 @@ class TerminalBuildScript(buildscript.BuildScript):
         try:
             if p.wait() != 0:
                 if self.config.quiet_mode:
-                    print ''.join(output)
+                    if output.dropped and module_log is not None:
+                        uprint(_('(%(num)d earlier lines in %(file)s)') % {
+                                'num': output.dropped, 'file': module_log.name})
+                    elif output.dropped:
+                        uprint(_('(%d earlier lines not shown)') % output.dropped)
+                    print str(output)
                 raise CommandError(_('########## Error running %s')
                                    % print_args['command'], p.returncode)
         except OSError:
@@ -302,7 +328,7 @@ class TerminalBuildScript(buildscript.BuildScript):
                                % print_args['command'])
 
     def start_module(self, module):
-        self.triedcheckout = None
+        self._module_state.triedcheckout = None
         teamcity_message('compilationStarted', compiler='jhbuild.%s' % module)
 
     def end_module(self, module, failed):
@@ -355,15 +381,16 @@ class TerminalBuildScript(buildscript.BuildScript):
                 icon = 'dialog-error', expire = 20)
 
         if self.config.trycheckout:
-            if self.triedcheckout is None and altphases.count('configure'):
-                self.triedcheckout = 'configure'
+            triedcheckout = getattr(self._module_state, 'triedcheckout', None)
+            if triedcheckout is None and altphases.count('configure'):
+                self._module_state.triedcheckout = 'configure'
                 self.message(_('automatically retrying configure'))
                 return 'configure'
-            elif self.triedcheckout == 'configure' and altphases.count('force_checkout'):
-                self.triedcheckout = 'done'
+            elif triedcheckout == 'configure' and altphases.count('force_checkout'):
+                self._module_state.triedcheckout = 'done'
                 self.message(_('automatically forcing a fresh checkout'))
                 return 'force_checkout'
-        self.triedcheckout = None
+        self._module_state.triedcheckout = None
 
         if not self.config.interact:
             return 'fail'
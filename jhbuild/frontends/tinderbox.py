@@ -149,6 +149,8 @@ class LoggingFormatter(logging.Formatter):
 
 class TinderboxBuildScript(buildscript.BuildScript):
     triedcheckout = None
+    # modulefp is shared by all the modules
+    supports_parallel_modules = False
 
     def __init__(self, config, module_list, module_set=None):
         buildscript.BuildScript.__init__(self, config, module_list, module_set=module_set)
@@ -28,6 +28,7 @@ __all__ = [
     ]
 
 import os
+import platform
 import re
 import shutil
 import stat
@@ -36,12 +37,42 @@ import logging
 import collections
 import json
 import hashlib
+import errno
+import tempfile
+import threading
+import time
 
 from jhbuild.errors import FatalError, CommandError, BuildStateError, \
              SkipToEnd, UndefinedRepositoryError
 from jhbuild.utils.sxml import sxml
 from jhbuild.commands.sanitycheck import inpath
 import jhbuild.utils.fileutils as fileutils
+from jhbuild.utils import elf
+from jhbuild.utils import artifactcache
+from jhbuild.utils import debugstore
+from jhbuild.utils.inventory import Inventory
+
+# environment variables that change the result of building a module
+_build_environment = ('CC', 'CXX', 'CPP', 'LD', 'AR', 'CFLAGS', 'CXXFLAGS',
+                      'CPPFLAGS', 'LDFLAGS', 'LIBS', 'PKG_CONFIG_PATH',
+                      'PKG_CONFIG_LIBDIR', 'PKG_CONFIG_SYSROOT_DIR',
+                      'ACLOCAL_FLAGS', 'ACLOCAL_PATH', 'CMAKE_PREFIX_PATH',
+                      'PYTHON', 'PYTHONPATH', 'LD_LIBRARY_PATH', 'MAKE',
+                      'NINJA', 'XDG_DATA_DIRS', 'GI_TYPELIB_PATH')
+
+_host_identity = None
+def get_host_identity():
+    '''Return what identifies the system modules are built on.'''
+    global _host_identity
+    if _host_identity is None:
+        _host_identity = [platform.system(), platform.release(),
+                          platform.machine(), platform.libc_ver(),
+                          platform.linux_distribution()]
+    return _host_identity
+
+def strip_job_count(args):
+    '''Remove the -j arguments, which do not change the result of a build.'''
+    return ' '.join(re.sub(r'-j\s*\d*', '', args).split())
 
 _module_types = {}
 def register_module_type(name, parse_func):
@@ -194,6 +225,8 @@ class Package:
         self.supports_stripping_debug_symbols = True
         self.configure_cmd = None
         self.module_hash = None
+        self._artifact_key = None
+        self._artifact = None
 
     def __repr__(self):
         return "<%s '%s'>" % (self.__class__.__name__, self.name)
@@ -225,80 +258,108 @@ class Package:
         os.makedirs(destdir)
         return destdir
 
-    def _clean_la_files_in_dir(self, buildscript, path):
-        for name in os.listdir(path):
-            subpath = os.path.join(path, name)
-            if os.path.isdir(subpath) and not os.path.islink(subpath):
-                self._clean_la_files_in_dir(buildscript, subpath)
-            elif name.endswith('.la'):
-                    try:
-                        logging.info(_('Deleting .la file: %r') % (subpath, ))
-                        os.unlink(subpath)
-                    except OSError:
-                        pass
-
-    def _clean_la_files(self, buildscript, installroot):
+    def _clean_la_files(self, buildscript, installroot, inventory=None):
         """This method removes all .la files. See bug 654013."""
         assert os.path.isabs(installroot)
         assert os.path.isabs(buildscript.config.prefix)
         prefixdir = os.path.join(installroot, buildscript.config.prefix[1:])
-        if os.path.isdir(prefixdir) and not os.path.islink(prefixdir):
-            self._clean_la_files_in_dir(self, prefixdir)
+        if inventory is None:
+            inventory = Inventory(prefixdir)
+        for path, entry in inventory.entries.items():
+            if path.endswith('.la') and not entry.isdir:
+                try:
+                    logging.info(_('Deleting .la file: %r') % (
+                            os.path.join(prefixdir, path), ))
+                    inventory.remove(path)
+                except OSError:
+                    pass
 
-    def _clean_texinfo_dir_files(self, buildscript, installroot):
+    def _clean_texinfo_dir_files(self, buildscript, installroot, inventory=None):
         """This method removes GNU Texinfo dir files."""
         assert os.path.isabs(installroot)
         assert os.path.isabs(buildscript.config.prefix)
         prefixdir = os.path.join(installroot, buildscript.config.prefix[1:])
-        if os.path.isdir(prefixdir):
-            dirfile = os.path.join(prefixdir, 'share/info/dir')
-            if os.path.isfile(dirfile):
-                try:
-                    logging.info(_('Deleting dir file: %r') % (dirfile, ))
-                    os.unlink(dirfile)
-                except OSError:
-                    pass
+        if inventory is None:
+            inventory = Inventory(prefixdir)
+        path = os.path.join('share', 'info', 'dir')
+        entry = inventory.entries.get(path)
+        if entry is not None and entry.isfile:
+            try:
+                logging.info(_('Deleting dir file: %r') % (
+                        os.path.join(prefixdir, path), ))
+                inventory.remove(path)
+            except OSError:
+                pass
 
-    def _process_install_files(self, installroot, curdir, prefix, errors):
+    def _process_install_files(self, installroot, curdir, prefix, errors,
+                               inventory=None, unchanged=None):
         """Strip the prefix from all files in the install root, and move
-them into the prefix."""
+them into the prefix.
+
+With incremental_install, files and links identical to the installed ones
+are not replaced, so that they keep their modification time; their paths
+are added to the unchanged list."""
         assert os.path.isdir(installroot) and os.path.isabs(installroot)
         assert os.path.isdir(curdir) and os.path.isabs(curdir)
         assert os.path.isdir(prefix) and os.path.isabs(prefix)
 
-        if prefix.endswith('/'):
-            prefix = prefix[:-1]
+        if inventory is None:
+            inventory = Inventory(curdir)
 
         num_copied = 0
-        names = os.listdir(curdir)
-        for filename in names:
-            src_path = os.path.join(curdir, filename)
+        directories = []
+        # directories that could not be created, their contents are skipped
+        failed = set()
+        for path, entry in inventory.entries.iteritems():
+            if os.path.dirname(path) in failed:
+                failed.add(path)
+                continue
+            src_path = os.path.join(curdir, path)
             assert src_path.startswith(installroot)
             dest_path = src_path[len(installroot):]
             try:
-                if os.path.islink(src_path):
+                if entry.islink:
                     linkto = os.readlink(src_path)
-                    if os.path.islink(dest_path) or os.path.isfile(dest_path):
-                        os.unlink(dest_path)
-                    os.symlink(linkto, dest_path)
+                    try:
+                        dest_mode = os.lstat(dest_path).st_mode
+                    except OSError:
+                        os.symlink(linkto, dest_path)
+                    else:
+                        if not stat.S_ISLNK(dest_mode) and \
+                               not stat.S_ISREG(dest_mode):
+                            raise OSError(errno.EEXIST, os.strerror(errno.EEXIST),
+                                          dest_path)
+                        if self.config.incremental_install and \
+                               stat.S_ISLNK(dest_mode) and \
+                               os.readlink(dest_path) == linkto:
+                            os.unlink(src_path)
+                            if unchanged is not None:
+                                unchanged.append(path)
+                            continue
+                        # replace the file atomically
+                        tmp_path = '%s.jhbuild-%d' % (dest_path, os.getpid())
+                        fileutils.ensure_unlinked(tmp_path)
+                        os.symlink(linkto, tmp_path)
+                        fileutils.rename(tmp_path, dest_path)
                     os.unlink(src_path)
                     num_copied += 1
-                elif os.path.isdir(src_path):
-                    if os.path.exists(dest_path):
-                        if not os.path.isdir(dest_path):
-                            os.unlink(dest_path)
-                            os.mkdir(dest_path)
-                    else:
-                        os.mkdir(dest_path)
-                    num_copied += self._process_install_files(installroot,
-                                                              src_path, prefix,
-                                                              errors)
+                elif entry.isdir:
                     try:
-                        os.rmdir(src_path)
+                        dest_mode = os.stat(dest_path).st_mode
                     except OSError:
-                        # files remaining in buildroot, errors reported below
-                        pass
+                        os.mkdir(dest_path)
+                    else:
+                        if not stat.S_ISDIR(dest_mode):
+                            os.unlink(dest_path)
+                            os.mkdir(dest_path)
+                    directories.append(src_path)
                 else:
+                    if self.config.incremental_install and \
+                           self._is_installed(src_path, dest_path, entry):
+                        os.unlink(src_path)
+                        if unchanged is not None:
+                            unchanged.append(path)
+                        continue
                     try:
                         fileutils.rename(src_path, dest_path)
                         num_copied += 1
@@ -306,107 +367,198 @@ them into the prefix."""
                         errors.append("%s: '%s'" % (str(e), dest_path))
             except OSError as e:
                 errors.append(str(e))
+                if entry.isdir:
+                    failed.add(path)
+
+        for src_path in reversed(directories):
+            try:
+                os.rmdir(src_path)
+            except OSError:
+                # files remaining in buildroot, errors reported below
+                pass
         return num_copied
 
+    def _is_installed(self, src_path, dest_path, entry):
+        '''Return whether dest_path is a file identical to src_path, whose
+        inventory entry is entry.'''
+        try:
+            st = os.lstat(dest_path)
+        except OSError:
+            return False
+        if not stat.S_ISREG(st.st_mode) or st.st_size != entry.size or \
+               stat.S_IMODE(st.st_mode) != stat.S_IMODE(entry.mode):
+            return False
+        return fileutils.same_contents(src_path, dest_path)
 
-    def _strip_debug_symbols(self, destdir_prefix, installroot):
+    def _strip_debug_symbols(self, destdir_prefix, installroot, inventory=None):
         assert self.supports_stripping_debug_symbols
 
-        for filename in fileutils.accumulate_dirtree_contents(destdir_prefix):
-            dirname, basename = os.path.split(filename)
-            fullfilename = os.path.join(destdir_prefix, dirname, basename)
-            if not os.path.isfile(fullfilename) or os.path.islink(fullfilename):
-                continue
-            if not os.access(fullfilename, os.X_OK) and 'so' not in basename.split(os.path.extsep):
+        start_time = time.time()
+        if inventory is None:
+            inventory = Inventory(destdir_prefix)
+        files = []
+        for filename, entry in inventory.entries.iteritems():
+            if entry.elf is None or entry.elf.stripped:
                 continue
-            fileinfo = ''
-            try:
-                fileinfo = subprocess.check_output(['file', '-b', fullfilename]).strip()
-            except Exception:
-                pass
-            if not fileinfo.startswith('ELF ') or not fileinfo.endswith(', not stripped'):
+            if filename.endswith('.debug'):
+                # already split, from a restored artifact
                 continue
+            if self.config.debug_store == 'build-id':
+                files.append((filename, entry.elf.build_id))
+            else:
+                files.append((filename, None))
+        sizes = dict((filename, inventory.entries[filename].size)
+                     for filename, build_id in files)
+
+        # objcopy runs in a separate process, threads are enough to keep
+        # all processors busy
+        results = []
+        lock = threading.Lock()
+        def worker():
+            while True:
+                with lock:
+                    if not files:
+                        return
+                    args = files.pop()
+                try:
+                    created = self._strip_file(destdir_prefix, installroot,
+                                               *args)
+                except Exception as e:
+                    # the file is installed with its debug symbols
+                    logging.warn(_('Failed to strip %(file)r: %(msg)s') % {
+                            'file': args[0], 'msg': e})
+                    continue
+                with lock:
+                    results.append((args[0], created))
+
+        threads = []
+        for i in range(min(len(files), max(self.config.jobs, 1))):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        saved = 0
+        for filename, created in results:
+            saved += sizes[filename] - inventory.add(filename).size
+            for path in created:
+                inventory.add(path)
+        if results:
+            logging.info(_('Stripped %(num)d files in %(time).1fs, '
+                           'saving %(size)d KiB') % {
+                    'num': len(results),
+                    'time': time.time() - start_time,
+                    'size': saved / 1024})
+
+    def _strip_file(self, destdir_prefix, installroot, filename, build_id=None):
+        '''Move the debug symbols of filename, relative to destdir_prefix, to
+        a separate file, and return the list of the files it added to
+        destdir_prefix.  An exception is raised if it failed.
+
+        Without build_id, the debug file goes to debug/dirname, with a link
+        next to filename.  With build_id, it goes to the debug store, with
+        the link of the store to filename.
+
+        The files are written under temporary names, the original file is
+        only replaced once they are complete.'''
+        dirname, basename = os.path.split(filename)
+        fullfilename = os.path.join(destdir_prefix, filename)
+        if build_id:
+            fulldebugfilename = debugstore.get_debug_filename(destdir_prefix,
+                                                              build_id)
+        else:
+            fulldebugfilename = os.path.join(destdir_prefix, 'debug', dirname,
+                                             basename + '.debug')
 
+        strip_cmd = ['objcopy', '--remove-section', '.gnu_debuglink']
+        tmpdir = None
+        tmpfilename = None
+        try:
+            fd, tmpfilename = tempfile.mkstemp(prefix='.' + basename,
+                                               dir=os.path.dirname(fullfilename))
+            os.close(fd)
+            fileutils.mkdir_with_parents(os.path.dirname(fulldebugfilename))
+            # the debug file is created with its final name, which is the one
+            # recorded in the debug link
+            tmpdir = tempfile.mkdtemp(prefix='.strip-',
+                                      dir=os.path.dirname(fulldebugfilename))
+            tmpdebugfilename = os.path.join(
+                    tmpdir, os.path.basename(fulldebugfilename))
+            cmd = ['objcopy', '--only-keep-debug']
+            if build_id:
+                cmd.append('--compress-debug-sections')
+            subprocess.check_call(cmd + [fullfilename, tmpdebugfilename])
+            if not build_id:
+                strip_cmd += ['--add-gnu-debuglink', tmpdebugfilename]
+            subprocess.check_call(strip_cmd + [
+                    '--strip-all', '--discard-all', '--preserve-dates',
+                    fullfilename, tmpfilename])
             # make sure file is writable
-            os.chmod(fullfilename, os.stat(fullfilename).st_mode | stat.S_IWUSR)
-
-            # first create the /opt/debug/dirname
-            fulldebugdirname = os.path.join(destdir_prefix, 'debug', dirname)
-            if not os.path.exists(fulldebugdirname):
-                os.makedirs(fulldebugdirname)
-            fulldebugfilename = os.path.join(fulldebugdirname, basename + '.debug')
-
-            # strip
+            shutil.copymode(fullfilename, tmpfilename)
+            os.chmod(tmpfilename, os.stat(tmpfilename).st_mode | stat.S_IWUSR)
+            os.rename(tmpdebugfilename, fulldebugfilename)
+            os.rename(tmpfilename, fullfilename)
+        finally:
+            if tmpfilename is not None:
+                fileutils.ensure_unlinked(tmpfilename)
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+        if build_id:
+            # create a /opt/debug/.build-id/xx/yyyy link to /opt/dirname/basename;
+            # links are relative, so that the artifact cache keeps them
+            created = [debugstore.get_link_name(build_id),
+                       debugstore.get_link_name(build_id) + '.debug']
+            fulllinkname = os.path.join(destdir_prefix, created[0])
             try:
-                subprocess.check_call(['objcopy', '--only-keep-debug', fullfilename, fulldebugfilename])
-                subprocess.check_call(['objcopy', '--remove-section', '.gnu_debuglink', fullfilename])
-                subprocess.check_call(['objcopy', '--add-gnu-debuglink', fulldebugfilename, fullfilename])
-                subprocess.check_call(['objcopy', '--strip-all', '--discard-all', '--preserve-dates', fullfilename])
-            except Exception:
-                continue
-
+                os.symlink(os.path.relpath(filename, os.path.dirname(created[0])),
+                           fulllinkname)
+            except OSError as e:
+                # binaries with the same build ID in the module
+                if e.errno != errno.EEXIST:
+                    raise
+        else:
+            created = [os.path.join('debug', dirname, basename + '.debug'),
+                       filename + '.debug']
             # create a /opt/dirname/basename.debug link to /opt/debug/dirname/basename.debug
-            fulldebuglinkname = os.path.join(destdir_prefix, dirname, basename + '.debug')
-            if os.path.exists(fulldebuglinkname):
+            fulldebuglinkname = fullfilename + '.debug'
+            if os.path.lexists(fulldebuglinkname):
                 os.remove(fulldebuglinkname)
-            os.symlink(os.path.join(installroot, 'debug', dirname, basename + '.debug'), fulldebuglinkname)
+            os.symlink(os.path.relpath(created[0], dirname or os.curdir),
+                       fulldebuglinkname)
+        return created
 
-
-    def _find_executables(self, destdir_prefix):
+    def _find_executables(self, destdir_prefix, inventory=None):
+        if inventory is None:
+            inventory = Inventory(destdir_prefix)
         executables = []
         # filter out files to strip
-        for filename in fileutils.accumulate_dirtree_contents(destdir_prefix):
-            dirname, basename = os.path.split(filename)
-            fullfilename = os.path.join(destdir_prefix, dirname, basename)
-            if not os.path.isfile(fullfilename) or os.path.islink(fullfilename):
-                continue
-            if not os.access(fullfilename, os.X_OK) and 'so' not in basename.split(os.path.extsep):
-                continue
-            if filename.endswith('.debug'):
-                continue
-            fileinfo = ''
-            try:
-                fileinfo = subprocess.check_output(['file', '-b', fullfilename]).strip()
-            except Exception:
-                pass
-            if not fileinfo.startswith('ELF '):
+        for filename, entry in inventory.entries.iteritems():
+            if entry.elf is None or filename.endswith('.debug'):
                 continue
             executables.append(filename)
         return executables
 
-    def _find_executable_dependencies(self, fullfilename, destdir_prefix, installroot, librarypaths):
-        env = os.environ.copy()
-        env['LD_LIBRARY_PATH'] = ':'.join([
-            os.path.join(destdir_prefix, 'lib'),
-            os.path.join(os.path.join(installroot, 'lib')),
-        ] + librarypaths)
-        lines = []
-        try:
-            lines = subprocess.check_output(['ldd', fullfilename], env=env).splitlines()
-        except Exception:
-            pass
-
-        found = []
-        notfound = []
-        for line in lines:
-            if '=>' not in line:
-                continue
-            lib, rest = map(lambda x: x.strip(), line.split('=>'))
-            if 'not found' in rest:
-                notfound.append(lib)
-                continue
-            found.append(rest.split()[0])
-
-        return found, notfound
-
-    def _find_executable_system_dependencies(self, destdir_prefix, installroot):
+    def _find_executable_system_dependencies(self, destdir_prefix, installroot,
+                                             inventory=None):
+        if inventory is None:
+            inventory = Inventory(destdir_prefix)
         notfounds = {}
-        executables = self._find_executables(destdir_prefix)
+        executables = self._find_executables(destdir_prefix, inventory)
         fullexecutables = set(os.path.join(destdir_prefix, filename) for filename in executables)
         librarypaths = sorted(set(os.path.dirname(fullfilename) for fullfilename in fullexecutables))
 
         rdependencies = collections.defaultdict(set)
 
+        # libraries are looked up as ldd would with this LD_LIBRARY_PATH
+        resolver = elf.LibraryResolver([
+            os.path.join(destdir_prefix, 'lib'),
+            os.path.join(os.path.join(installroot, 'lib')),
+        ] + librarypaths)
+        for filename in executables:
+            resolver.add(inventory.entries[filename].elf)
+
         # first we queue all the exec we found
         executablequeue = set(fullexecutables)
         allexecutables = set(fullexecutables)
@@ -414,7 +566,7 @@ them into the prefix."""
         while executablequeue:
             # dequeue and find dependency
             fullfilename = executablequeue.pop()
-            found, notfound = self._find_executable_dependencies(fullfilename, destdir_prefix, installroot, librarypaths)
+            found, notfound = resolver.dependencies(fullfilename)
 
             if fullfilename in fullexecutables:
                 filename = fullfilename[len(destdir_prefix) + len(os.path.sep):]
@@ -455,8 +607,6 @@ them into the prefix."""
     def process_install(self, buildscript, revision):
         assert self.supports_install_destdir
         destdir = self.get_destdir(buildscript)
-        self._clean_la_files(buildscript, destdir)
-        self._clean_texinfo_dir_files(buildscript, destdir)
 
         prefix_without_drive = os.path.splitdrive(buildscript.config.prefix)[1]
         stripped_prefix = prefix_without_drive[1:]
@@ -466,9 +616,14 @@ them into the prefix."""
         broken_name = destdir + '-broken'
         destdir_prefix = os.path.join(destdir, stripped_prefix)
 
+        # the installed files, updated by each of the following steps
+        inventory = Inventory(destdir_prefix)
+        self._clean_la_files(buildscript, destdir, inventory)
+        self._clean_texinfo_dir_files(buildscript, destdir, inventory)
+
         # simon: dump sysdeps
         logging.info(_('Finding system dependencies ...'))
-        systemdependencies, notfounds, rdependencies = self._find_executable_system_dependencies(destdir_prefix, buildscript.config.prefix)
+        systemdependencies, notfounds, rdependencies = self._find_executable_system_dependencies(destdir_prefix, buildscript.config.prefix, inventory)
         if notfounds:
             broken = set()
             missing = set()
@@ -491,17 +646,32 @@ them into the prefix."""
         # simon: strip debug info before install
         if self.supports_stripping_debug_symbols:
             logging.info(_('Stripping debug symbols ...'))
-            self._strip_debug_symbols(destdir_prefix, buildscript.config.prefix)
+            self._strip_debug_symbols(destdir_prefix, buildscript.config.prefix, inventory)
 
-        new_contents = fileutils.accumulate_dirtree_contents(destdir_prefix)
+        if self._artifact is None:
+            artifactcache.save(buildscript.config,
+                               self.get_artifact_key(buildscript), destdir)
+
+        new_contents = inventory.contents()
         errors = []
 
+        for filename, owners in buildscript.moduleset.packagedb.collisions(
+                self.name, new_contents):
+            if self.config.debug_store == 'build-id' and \
+                    debugstore.is_store_file(filename):
+                # shared by the modules installing the same binaries
+                continue
+            logging.warn(_('%(file)r is also installed by %(modules)s') % {
+                    'file': filename, 'modules': ', '.join(owners)})
+
         if os.path.isdir(destdir_prefix):
             destdir_install = True
             logging.info(_('Moving temporary DESTDIR %r into build prefix') % (destdir, ))
+            unchanged = []
             num_copied = self._process_install_files(destdir, destdir_prefix,
                                                      buildscript.config.prefix,
-                                                     errors)
+                                                     errors, inventory,
+                                                     unchanged)
             # Now the destdir should have a series of empty directories:
             # $JHBUILD_PREFIX/_jhbuild/root-foo/$JHBUILD_PREFIX
             # Remove them one by one to clean the tree to the state we expect,
@@ -550,6 +720,9 @@ them into the prefix."""
 
             for filename in new_contents:
                 to_delete.discard (os.path.join(self.config.prefix, filename))
+            if self.config.debug_store == 'build-id':
+                to_delete = set(debugstore.filter_shared(
+                        buildscript.moduleset.packagedb, self.name, to_delete))
 
             if to_delete:
                 # paranoid double-check
@@ -586,6 +759,10 @@ them into the prefix."""
                                {'num'   : len(errors),
                                 'files' : num_copied,
                                 'err'   : '\n  '.join(errors)})
+        elif self.config.incremental_install:
+            logging.info(_('Install complete: %(files)d files copied, '
+                           '%(unchanged)d unchanged') % {
+                    'files': num_copied, 'unchanged': len(unchanged)})
         else:
             logging.info(_('Install complete: %d files copied') %
                          (num_copied, ))
@@ -593,7 +770,81 @@ them into the prefix."""
     def get_revision(self):
         return self.branch.tree_id()
 
+    def get_build_options(self, buildscript):
+        '''Return what, besides the sources and the dependencies, changes
+        the result of building the module.'''
+        environment = dict((key, os.environ[key]) for key in _build_environment
+                           if key in os.environ)
+        options = [buildscript.config.prefix, self.extra_env, environment,
+                   get_host_identity()]
+        if hasattr(self.branch, 'get_source_options'):
+            options.append(self.branch.get_source_options())
+        return options
+
+    def get_artifact_key(self, buildscript):
+        '''Return the key of the module in the artifact cache, or None if
+        the module cannot be cached.
+
+        The key is computed once the module has been checked out, from its
+        revision, its module_hash, its build options and the keys of its
+        dependencies.'''
+        if self._artifact_key is not None:
+            return self._artifact_key
+        revision = self.get_revision()
+        if revision is None and self.branch is not None:
+            # sources of unknown revision
+            return None
+        if hasattr(self.branch, 'is_dirty') and self.branch.is_dirty():
+            # the revision does not tell which local changes were built
+            return None
+        dependencies = []
+        for dep in self.dependencies:
+            module = buildscript.moduleset.modules.get(dep)
+            if module is None:
+                # provided by the system
+                dependencies.append((dep, None))
+                continue
+            key = module.get_artifact_key(buildscript)
+            if key is None:
+                return None
+            dependencies.append((dep, key))
+        self._artifact_key = hashlib.sha1(json.dumps(
+                [self.name, self.type, revision, self.module_hash,
+                 self.get_build_options(buildscript), dependencies],
+                sort_keys=True)).hexdigest()
+        return self._artifact_key
+
+    def find_artifact(self, buildscript):
+        '''Look for the module in the artifact cache, once it has been
+        checked out.  If it is found, the phases up to install are skipped
+        and the install phase installs the cached files.'''
+        self._artifact_key = None
+        self._artifact = None
+        if not buildscript.config.artifact_cache_dir or \
+               not self.supports_install_destdir or \
+               'install' not in buildscript.config.build_targets:
+            return
+        self._artifact = artifactcache.lookup(buildscript.config,
+                                              self.get_artifact_key(buildscript))
+        if self._artifact is not None:
+            buildscript.message(_('Installing %s from artifact cache') % self.name)
+
+    def install_artifact(self, buildscript):
+        buildscript.set_action(_('Installing from artifact cache'), self)
+        try:
+            destdir = self.prepare_installroot(buildscript)
+            try:
+                artifactcache.restore(self._artifact, destdir)
+            except Exception as e:
+                raise CommandError(_('Failed to extract %(file)r: %(msg)s') % {
+                        'file': self._artifact, 'msg': e})
+            self.process_install(buildscript, self.get_revision())
+        finally:
+            self._artifact = None
+
     def skip_phase(self, buildscript, phase, last_phase):
+        if self._artifact is not None and phase != 'install':
+            return True
         try:
             skip_phase_method = getattr(self, 'skip_' + phase)
         except AttributeError:
@@ -607,6 +858,8 @@ them into the prefix."""
           (error-flag, [other-phases])
         """
         method = getattr(self, 'do_' + phase)
+        if phase == 'install' and self._artifact is not None:
+            method = self.install_artifact
         try:
             method(buildscript)
         except (CommandError, BuildStateError) as e:
@@ -621,22 +874,30 @@ them into the prefix."""
         return hasattr(self, 'do_' + phase)
 
     def check_build_policy(self, buildscript):
-        if not buildscript.config.build_policy in ('updated', 'updated-deps'):
+        message = self.get_build_policy_skip(buildscript)
+        if message is None:
             return
+        buildscript.message(message)
+        return self.PHASE_DONE
+
+    def get_build_policy_skip(self, buildscript):
+        '''Return the message explaining why the build policy skips the
+        module, or None if it has to be built.'''
+        if not buildscript.config.build_policy in ('updated', 'updated-deps'):
+            return None
 
         # Always trigger a build for dirty branches if supported by the version
         # control module.
         if hasattr(self.branch, 'is_dirty') and self.branch.is_dirty():
-            return
+            return None
 
         if not buildscript.moduleset.packagedb.check(self.name, version=self.get_revision() or '', module_hash=self.module_hash):
             # package has not been updated
-            return
+            return None
 
         # module has not been updated
         if buildscript.config.build_policy == 'updated':
-            buildscript.message(_('Skipping %s (not updated)') % self.name)
-            return self.PHASE_DONE
+            return _('Skipping %s (not updated)') % self.name
 
         if buildscript.config.build_policy == 'updated-deps':
             install_date = buildscript.moduleset.packagedb.installdate(self.name)
@@ -646,9 +907,7 @@ them into the prefix."""
                     # a dependency has been updated
                     return None
             else:
-                buildscript.message(
-                        _('Skipping %s (package and dependencies not updated)') % self.name)
-                return self.PHASE_DONE
+                return _('Skipping %s (package and dependencies not updated)') % self.name
 
     def xml_tag_and_attrs(self):
         """Return a (tag, attrs) pair, describing how to serialize this
@@ -728,6 +987,11 @@ class NinjaModule(Package):
             ninjaargs = re.sub(r'-j\w*\d+', '', ninjaargs) + ' -j 1'
         return self.eval_args(ninjaargs).strip()
 
+    def get_build_options(self, buildscript):
+        return Package.get_build_options(self, buildscript) + [
+                strip_job_count(self.get_ninjaargs(buildscript)),
+                self.ninjainstallargs]
+
     def get_ninjacmd(self, config):
         if self.ninjacmd:
             return self.ninjacmd
@@ -778,6 +1042,12 @@ class MakeModule(Package):
             makeargs = re.sub(r'-j\w*\d+', '', makeargs) + ' -j 1'
         return self.eval_args(makeargs).strip()
 
+    def get_build_options(self, buildscript):
+        return Package.get_build_options(self, buildscript) + [
+                strip_job_count(self.get_makeargs(buildscript,
+                                                  add_parallel=False)),
+                self.makeinstallargs, self.makefile]
+
     def get_makecmd(self, config):
         if self.needs_gmake and 'gmake' in config.conditions:
             return 'gmake'
@@ -807,19 +1077,22 @@ class DownloadableModule:
     def checkout(self, buildscript):
         srcdir = self.get_srcdir(buildscript)
         buildscript.set_action(_('Checking out'), self)
-        self.branch.checkout(buildscript)
+        if not buildscript.wait_for_prefetch(self):
+            self.branch.checkout(buildscript)
         # did the checkout succeed?
         if not os.path.exists(srcdir):
             raise BuildStateError(_('source directory %s was not created') % srcdir)
 
         if self.check_build_policy(buildscript) == self.PHASE_DONE:
             raise SkipToEnd()
+        self.find_artifact(buildscript)
 
     def skip_checkout(self, buildscript, last_phase):
         # skip the checkout stage if the nonetwork flag is set
         if not self.branch.may_checkout(buildscript):
             if self.check_build_policy(buildscript) == self.PHASE_DONE:
                 raise SkipToEnd()
+            self.find_artifact(buildscript)
             return True
         return False
 
@@ -159,6 +159,10 @@ class AutogenModule(MakeModule, DownloadableModule):
         self.configure_cmd = cmd
         return cmd
 
+    def get_build_options(self, buildscript):
+        return MakeModule.get_build_options(self, buildscript) + [
+                self._get_configure_cmd(buildscript)]
+
     def skip_configure(self, buildscript, last_phase):
         # skip if manually instructed to do so
         if self.skip_autogen is True:
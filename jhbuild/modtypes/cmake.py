@@ -80,6 +80,10 @@ class CMakeModule(MakeModule, NinjaModule, DownloadableModule):
                               self.name, self.config.cmakeargs))
         return self.eval_args(args)
 
+    def get_build_options(self, buildscript):
+        return MakeModule.get_build_options(self, buildscript) + [
+                self.get_cmakeargs()]
+
     def do_configure(self, buildscript):
         buildscript.set_action(_('Configuring'), self)
         srcdir = self.get_srcdir(buildscript)
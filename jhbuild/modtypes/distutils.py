@@ -91,6 +91,9 @@ class DistutilsModule(Package, DownloadableModule):
         self.process_install(buildscript, self.get_revision())
     do_install.depends = [PHASE_BUILD]
 
+    def get_build_options(self, buildscript):
+        return Package.get_build_options(self, buildscript) + [self.pythons]
+
     def xml_tag_and_attrs(self):
         return 'distutils', [('id', 'name', None),
                              ('supports-non-srcdir-builds',
@@ -23,6 +23,7 @@ __metaclass__ = type
 import os
 import shutil
 import errno
+import hashlib
 
 from jhbuild.errors import FatalError, BuildStateError
 from jhbuild.modtypes import \
@@ -44,6 +45,13 @@ class LinuxConfig:
             if not os.path.exists(self.path):
                 raise BuildStateError(_('kconfig file %s was not created') % self.path)
 
+    def get_hash(self):
+        '''Return the SHA-1 of the kconfig file, if there is one.'''
+        if not self.path or not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
 
 class LinuxModule(MakeModule):
     '''For modules that are built with the linux kernel method of
@@ -218,6 +226,11 @@ class LinuxModule(MakeModule):
         pass
     do_install.depends = [PHASE_KERNEL_INSTALL, PHASE_MODULES_INSTALL, PHASE_HEADERS_INSTALL]
 
+    def get_build_options(self, buildscript):
+        return MakeModule.get_build_options(self, buildscript) + [
+                [(kconfig.version, kconfig.get_hash())
+                 for kconfig in self.kconfigs]]
+
     def xml_tag_and_attrs(self):
         return 'linux', [('id', 'name', None),
                          ('makeargs', 'makeargs', '')]
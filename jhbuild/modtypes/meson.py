@@ -81,6 +81,10 @@ class MesonModule(NinjaModule, DownloadableModule):
                               self.name, self.config.mesonargs))
         return self.eval_args(args)
 
+    def get_build_options(self, buildscript):
+        return NinjaModule.get_build_options(self, buildscript) + [
+                self.get_mesonargs()]
+
     def do_configure(self, buildscript):
         buildscript.set_action(_('Configuring'), self)
         srcdir = self.get_srcdir(buildscript)
@@ -88,6 +88,10 @@ class NodeModule(Package, DownloadableModule):
     def get_builddir(self, buildscript):
         return os.path.join(buildscript.config.buildroot, self.name)
 
+    def get_build_options(self, buildscript):
+        return Package.get_build_options(self, buildscript) + [
+                self.nodescript]
+
     def xml_tag_and_attrs(self):
         return 'node', [
             ('id', 'name', None),
@@ -74,6 +74,12 @@ class PerlModule(Package, DownloadableModule):
                                             self.get_destdir(buildscript))
     do_install.depends = [PHASE_BUILD]
 
+    def get_build_options(self, buildscript):
+        return Package.get_build_options(self, buildscript) + [
+                os.environ.get('PERL', 'perl'),
+                self.makeargs, self.config.module_makeargs.get(
+                    self.name, self.config.makeargs)]
+
     def xml_tag_and_attrs(self):
         return 'perl', [('id', 'name', None),
                          ('makeargs', 'makeargs', '')]
@@ -62,6 +62,9 @@ class PipModule(Package):
 
         shutil.rmtree(tempdir)
 
+    def get_build_options(self, buildscript):
+        return Package.get_build_options(self, buildscript) + [self.python]
+
     def xml_tag_and_attrs(self):
         return 'pip', [
             ('id', 'name', None),
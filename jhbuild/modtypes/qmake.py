@@ -90,6 +90,10 @@ class QMakeModule(MakeModule, DownloadableModule):
         self.process_install(buildscript, self.get_revision())
     do_install.depends = [PHASE_BUILD]
 
+    def get_build_options(self, buildscript):
+        return MakeModule.get_build_options(self, buildscript) + [
+                self.qmakeargs]
+
     def xml_tag_and_attrs(self):
         return 'qmake', [('id', 'name', None)]
 
@@ -139,6 +139,10 @@ class WafModule(Package, DownloadableModule):
         self.process_install(buildscript, self.get_revision())
     do_install.depends = [PHASE_BUILD]
 
+    def get_build_options(self, buildscript):
+        return Package.get_build_options(self, buildscript) + [
+                self.waf_cmd, self.python_cmd]
+
     def xml_tag_and_attrs(self):
         return 'waf', [('id', 'name', None),
                        ('waf-command', 'waf_cmd', 'waf')]
@@ -28,7 +28,6 @@ from jhbuild.errors import UsageError, FatalError, DependencyCycleError, \
              CommandError, UndefinedRepositoryError
 
 try:
-    import xml.dom.minidom
     import xml.parsers.expat
 except ImportError:
     raise FatalError(_('Python XML packages are required but could not be found'))
@@ -43,6 +42,8 @@ from jhbuild.modtypes.systemmodule import SystemModule
 from jhbuild.versioncontrol.tarball import TarballBranch
 from jhbuild.utils import systeminstall
 from jhbuild.utils import fileutils
+from jhbuild.utils import modulesetcache
+from jhbuild.utils import xmlstream
 
 __all__ = ['load', 'load_tests', 'get_default_repo']
 
@@ -69,18 +70,27 @@ def get_default_repo():
     return _default_repo
 
 class ModuleSet:
-    def __init__(self, config = None, db=None, included_moduleset_uris=set()):
+    def __init__(self, config = None, db=None, included_moduleset_uris=None):
         self.config = config
         self.modules = {}
+        if included_moduleset_uris is None:
+            included_moduleset_uris = set()
         self.included_moduleset_uris = included_moduleset_uris
         self.raise_exception_on_warning=False
+        self._edges = {}
+        self._reverse_edges = None
 
         if db is None:
             legacy_pkgdb_path = os.path.join(self.config.prefix, 'share', 'jhbuild', 'packagedb.xml')
             new_pkgdb_path = os.path.join(self.config.top_builddir, 'packagedb.xml')
             if os.path.isfile(legacy_pkgdb_path):
                 fileutils.rename(legacy_pkgdb_path, new_pkgdb_path)
-            self.packagedb = packagedb.PackageDB(new_pkgdb_path, config)
+            if self.config.packagedb_backend == 'sqlite':
+                self.packagedb = packagedb.SQLitePackageDB(
+                        os.path.join(self.config.top_builddir,
+                                     'packagedb.sqlite'), config)
+            else:
+                self.packagedb = packagedb.PackageDB(new_pkgdb_path, config)
         else:
             self.packagedb = db
 
@@ -101,6 +111,82 @@ class ModuleSet:
                 return self.modules[module]
         raise KeyError(module_name)
 
+    def get_edges(self, module):
+        '''Return the outgoing dependency edges of module, as a list of
+        (name, kind, suggested) tuples in the order of dependencies, suggests
+        and after.  kind is one of 'after', 'suggests' or 'dependencies',
+        suggested tells whether the edge comes from the suggests list.
+
+        The result is cached, and computed again when the dependency lists of
+        the module are replaced or change size.'''
+        dependencies, suggests, after = \
+                module.dependencies, module.suggests, module.after
+        sizes = (len(dependencies), len(suggests), len(after))
+        cached = self._edges.get(module.name)
+        if (cached is not None and cached[0] is module and
+                cached[1] is dependencies and cached[2] is suggests and
+                cached[3] is after and cached[4] == sizes):
+            return cached[5]
+        after_set = set(after)
+        suggests_set = set(suggests)
+        edges = []
+        for edge_list, suggested in ((dependencies, False),
+                                     (suggests, True),
+                                     (after, False)):
+            for name in edge_list:
+                if name in after_set:
+                    kind = 'after'
+                elif name in suggests_set:
+                    kind = 'suggests'
+                else:
+                    kind = 'dependencies'
+                edges.append((name, kind, suggested))
+        self._edges[module.name] = (module, dependencies, suggests, after,
+                                    sizes, edges)
+        return edges
+
+    def _get_reverse_edges(self):
+        '''Return a dict mapping module names to the list of (name, kind)
+        tuples of the modules having a dependency edge to them.'''
+        edges = dict([(name, self.get_edges(module))
+                      for name, module in self.modules.iteritems()])
+        if self._reverse_edges is not None:
+            cached_edges, reverse_edges = self._reverse_edges
+            if len(cached_edges) == len(edges) and not [
+                    name for name in edges
+                    if cached_edges.get(name) is not edges[name]]:
+                return reverse_edges
+        reverse_edges = {}
+        for name, module_edges in edges.iteritems():
+            for edge_name, kind, suggested in module_edges:
+                reverse_edges.setdefault(edge_name, []).append((name, kind))
+        self._reverse_edges = (edges, reverse_edges)
+        return reverse_edges
+
+    def get_reverse_dependencies(self, module_name, transitive=False,
+                                 include_suggests=False):
+        '''Return the set of names of the modules depending on module_name.
+
+        If transitive is True, modules depending on it through other modules
+        are included as well.  <after> relations are never followed,
+        <suggests> ones only if include_suggests is True.'''
+        reverse_edges = self._get_reverse_edges()
+        if include_suggests:
+            kinds = ('dependencies', 'suggests')
+        else:
+            kinds = ('dependencies',)
+        rdeps = set()
+        queue = [module_name]
+        while queue:
+            name = queue.pop()
+            for rdep, kind in reverse_edges.get(name, []):
+                if kind in kinds and rdep not in rdeps:
+                    rdeps.add(rdep)
+                    if transitive:
+                        queue.append(rdep)
+        rdeps.discard(module_name)
+        return rdeps
+
     def get_module_list(self, module_names, skip=[], tags=[],
                         include_suggests=True, include_afters=False):
         module_list = self.get_full_module_list(module_names, skip,
@@ -114,7 +200,27 @@ class ModuleSet:
                                 include_suggests=True, include_afters=False,
                                 warn_about_circular_dependencies=True):
 
-        def dep_resolve(node, resolved, seen, after):
+        # resolved holds (module, after) tuples in build order, position
+        # maps a module to its index in resolved.  hard maps the modules in
+        # resolved as real (not <after>) dependencies to the tick at which
+        # they became so, which allows to tell whether a module was already a
+        # real dependency when a given dep_resolve call started.
+        resolved = []
+        position = {}
+        hard = {}
+        tick = [0]
+        seen = []
+        seen_set = set()
+        skip_set = set(skip)
+
+        def add_resolved(module, after):
+            position[module] = len(resolved)
+            resolved.append((module, after))
+            if not after:
+                hard[module] = tick[0]
+                tick[0] += 1
+
+        def dep_resolve(node, after):
             ''' Recursive depth-first search of the dependency tree. Creates
             the build order into the list 'resolved'. <after/> modules are
             added to the dependency tree but flagged. When search finished
@@ -122,24 +228,22 @@ class ModuleSet:
             '''
             circular = False
             seen.append(node)
-            if include_suggests:
-                edges = node.dependencies + node.suggests + node.after
-            else:
-                edges = node.dependencies + node.after
+            seen_set.add(node)
             # do not include <after> modules because a previous visited <after>
             # module may later be a hard dependency
-            resolved_deps = [module for module, after_module in resolved \
-                             if not after_module]
-            for edge_name in edges:
+            start = tick[0]
+            for edge_name, kind, suggested in self.get_edges(node):
+                if suggested and not include_suggests:
+                    continue
                 edge = self.modules.get(edge_name)
                 if edge == None:
-                    if node not in [i[0] for i in resolved]:
+                    if node not in position:
                         self._warn(_('%(module)s has a dependency on unknown'
                                      ' "%(invalid)s" module') % \
                                          {'module'  : node.name,
                                           'invalid' : edge_name})
-                elif edge_name not in skip and edge not in resolved_deps:
-                    if edge in seen:
+                elif edge_name not in skip_set and hard.get(edge, start) >= start:
+                    if edge in seen_set:
                         # circular dependency detected
                         circular = True
                         if self.raise_exception_on_warning:
@@ -151,28 +255,28 @@ class ModuleSet:
                                        % ' -> '.join([i.name for i in seen] \
                                                      + [edge.name]))
                         break
+                    elif kind == 'after':
+                        dep_resolve(edge, True)
+                    elif kind == 'suggests':
+                        dep_resolve(edge, after)
                     else:
-                        if edge_name in node.after:
-                            dep_resolve(edge, resolved, seen, True)
-                        elif edge_name in node.suggests:
-                            dep_resolve(edge, resolved, seen, after)
-                        elif edge_name in node.dependencies:
-                            dep_resolve(edge, resolved, seen, after)
-                            # hard dependency may be missed if a cyclic
-                            # dependency. Add it:
-                            if edge not in [i[0] for i in resolved]:
-                                resolved.append((edge, after))
-
-            seen.remove(node)
+                        dep_resolve(edge, after)
+                        # hard dependency may be missed if a cyclic
+                        # dependency. Add it:
+                        if edge not in position:
+                            add_resolved(edge, after)
+
+            seen.pop()
+            seen_set.discard(node)
 
             if not circular:
-                if node not in [i[0] for i in resolved]:
-                    resolved.append((node, after))
-                elif not after:
+                if node not in position:
+                    add_resolved(node, after)
+                elif not after and resolved[position[node]][1]:
                     # a dependency exists for an after, flag to keep
-                    for index, item in enumerate(resolved):
-                        if item[1] == True and item[0] == node:
-                            resolved[index] = (node, False)
+                    resolved[position[node]] = (node, False)
+                    hard[node] = tick[0]
+                    tick[0] += 1
 
         if module_names == 'all':
             module_names = self.modules.keys()
@@ -183,9 +287,8 @@ class ModuleSet:
         except KeyError as e:
             raise UsageError(_("A module called '%s' could not be found.") % e)
 
-        resolved = []
         for module in modules:
-            dep_resolve(module, resolved, [], False)
+            dep_resolve(module, False)
 
         if include_afters:
             module_list = [module[0] for module in resolved]
@@ -211,7 +314,14 @@ class ModuleSet:
 
     def get_module_state(self, modules):
         installed_pkgconfig = systeminstall.get_installed_pkgconfigs(self.config)
-        
+        # the system dependencies of all the modules are checked at once,
+        # against directory listings shared by all of them
+        checker = systeminstall.SystemDependencyChecker(self.config)
+        sysdeps_met = checker.check_modules(
+                [module for module in modules
+                 if isinstance(module, SystemModule) and
+                 module.pkg_config is None])
+
         module_state = {}
         for module in modules:
             # only consider SystemModules or modules with <pkg-config>
@@ -233,9 +343,7 @@ class ModuleSet:
                             new_enough = compare_version(installed_version,
                                                          required_version)
                 elif systemmodule:
-                    new_enough = systeminstall.systemdependencies_met \
-                                     (module.name, module.systemdependencies,
-                                      self.config)
+                    new_enough = sysdeps_met[module]
                     if new_enough:
                         installed_version = 'unknown'
                 module_state[module] = (required_version, installed_version,
@@ -376,7 +484,7 @@ def load(config, uri=None):
         elif not urlparse.urlparse(uri)[0]:
             uri = 'https://gitlab.gnome.org/GNOME/jhbuild/raw/master/modulesets' \
                   '/%s.modules' % uri
-        ms.modules.update(_parse_module_set(config, uri).modules)
+        ms.modules.update(_load_module_set(config, uri))
 
     # create virtual sysdeps
     system_repo_class = get_repo_type('system')
@@ -452,30 +560,93 @@ def _handle_conditions(config, element):
     for c in _child_elements(element):
         _handle_conditions(config, c)
 
-def _parse_module_set(config, uri, included_moduleset_uris=set()):
+def _load_module_set(config, uri):
+    '''Return the modules defined in the moduleset at uri, from the cache of
+    parsed modulesets if none of the files involved changed.'''
+    global _default_repo
+    cached = modulesetcache.load(config, uri)
+    if cached is not None:
+        modules, default_repo = cached
+        if default_repo:
+            _default_repo = default_repo
+        return modules
+
+    # find out whether parsing sets the default repository, so that it can
+    # be set again when loading from the cache
+    previous_default_repo = _default_repo
+    _default_repo = None
     try:
-        filename = httpcache.load(uri, nonetwork=config.nonetwork, age=0)
-    except Exception as e:
-        raise FatalError(_('could not download %s: %s') % (uri, e))
-    filename = os.path.normpath(filename)
+        sources = []
+        modules = _parse_module_set(config, uri, sources=sources).modules
+        default_repo = _default_repo
+    finally:
+        if _default_repo is None:
+            _default_repo = previous_default_repo
+    modulesetcache.save(config, uri, sources, (modules, default_repo))
+    return modules
+
+_repository_tags = ['repository', 'cvsroot', 'svnroot', 'arch-archive']
+
+def _read_module_set(filename, uri, start, callback, wanted=None):
     try:
-        document = xml.dom.minidom.parse(filename)
+        xmlstream.parse(filename, start, callback, wanted)
     except IOError as e:
         raise FatalError(_('failed to parse %s: %s') % (filename, e))
     except xml.parsers.expat.ExpatError as e:
         raise FatalError(_('failed to parse %s: %s') % (uri, e))
 
-    assert document.documentElement.nodeName == 'moduleset'
-
-    for node in _child_elements_matching(document.documentElement, ['redirect']):
+def _parse_module_set(config, uri, included_moduleset_uris=None, sources=None):
+    # included_moduleset_uris is shared by all the modulesets included while
+    # parsing a moduleset, so each of them is only parsed once
+    if included_moduleset_uris is None:
+        included_moduleset_uris = set()
+    try:
+        filename = httpcache.load(uri, nonetwork=config.nonetwork, age=0)
+    except Exception as e:
+        raise FatalError(_('could not download %s: %s') % (uri, e))
+    filename = os.path.normpath(filename)
+    if sources is not None:
+        try:
+            sources.append((uri, modulesetcache.hash_file(filename)))
+        except IOError as e:
+            raise FatalError(_('failed to parse %s: %s') % (filename, e))
+
+    # The moduleset is read in two passes: the first one only reads the
+    # repositories, and looks for <redirect> and top level <if> elements, the
+    # second one handles the other elements one at a time, as they are read.
+    document = []
+    toplevel_nodes = []
+    _read_module_set(filename, uri, document.append, toplevel_nodes.append,
+                     wanted=_repository_tags + ['redirect', 'if'])
+    document_element = document[0]
+
+    assert document_element.nodeName == 'moduleset'
+
+    for node in toplevel_nodes:
+        if node.nodeName != 'redirect':
+            continue
         new_url = node.getAttribute('href')
         logging.info('moduleset is now located at %s', new_url)
-        return _parse_module_set(config, new_url)
-
-    _handle_conditions(config, document.documentElement)
+        return _parse_module_set(config, new_url, included_moduleset_uris,
+                                 sources=sources)
+
+    whole_document = bool([node for node in toplevel_nodes
+                           if node.nodeName == 'if'])
+    if whole_document:
+        # conditions at the top level move elements to the end of the
+        # moduleset, the whole document is needed.
+        _read_module_set(filename, uri, lambda x: None,
+                         document_element.childNodes.append)
+        _handle_conditions(config, document_element)
+        repository_nodes = list(_child_elements_matching(document_element,
+                                                         _repository_tags))
+    else:
+        repository_nodes = toplevel_nodes
+        for node in repository_nodes:
+            _handle_conditions(config, node)
 
     moduleset = ModuleSet(config = config, included_moduleset_uris = included_moduleset_uris)
-    moduleset_name = document.documentElement.getAttribute('name')
+    moduleset_name = document_element.getAttribute('name')
     if not moduleset_name:
         moduleset_name = os.path.basename(uri)
         if moduleset_name.endswith('.modules'):
@@ -484,9 +655,7 @@ def _parse_module_set(config, uri, included_moduleset_uris=set()):
     # load up list of repositories
     repositories = {}
     default_repo = None
-    for node in _child_elements_matching(
-            document.documentElement, ['repository', 'cvsroot', 'svnroot',
-                                       'arch-archive']):
+    for node in repository_nodes:
         name = node.getAttribute('name')
         if node.getAttribute('default') == 'yes':
             default_repo = name
@@ -532,16 +701,18 @@ def _parse_module_set(config, uri, included_moduleset_uris=set()):
                                            archive=name, href=archive_uri)
 
     # and now module definitions
-    for node in _child_elements(document.documentElement):
+    def add_node(node):
         if node.nodeName == 'include':
             href = node.getAttribute('href')
             inc_uri = urlparse.urljoin(uri, href)
 
             if inc_uri in moduleset.included_moduleset_uris:
-                continue
+                return
 
             try:
-                inc_moduleset = _parse_module_set(config, inc_uri)
+                inc_moduleset = _parse_module_set(config, inc_uri,
+                                                  included_moduleset_uris,
+                                                  sources=sources)
             except UndefinedRepositoryError:
                 raise
             except FatalError as e:
@@ -550,7 +721,9 @@ def _parse_module_set(config, uri, included_moduleset_uris=set()):
                 # look up in local modulesets
                 inc_uri = os.path.join(os.path.dirname(__file__), '..', 'modulesets',
                                    href)
-                inc_moduleset = _parse_module_set(config, inc_uri)
+                inc_moduleset = _parse_module_set(config, inc_uri,
+                                                  included_moduleset_uris,
+                                                  sources=sources)
 
             moduleset.modules.update(inc_moduleset.modules)
             moduleset.included_moduleset_uris |= inc_moduleset.included_moduleset_uris
@@ -566,6 +739,18 @@ def _parse_module_set(config, uri, included_moduleset_uris=set()):
             module.moduleset_name = moduleset_name
             moduleset.add(module)
 
+    def add_streamed_node(node):
+        if node.nodeName in _repository_tags:
+            return
+        _handle_conditions(config, node)
+        add_node(node)
+
+    if whole_document:
+        for node in _child_elements(document_element):
+            add_node(node)
+    else:
+        _read_module_set(filename, uri, lambda x: None, add_streamed_node)
+
     # keep default repository around, used when creating automatic modules
     global _default_repo
     if default_repo:
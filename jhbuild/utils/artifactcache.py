@@ -0,0 +1,182 @@
+# jhbuild - a tool to ease building collections of source packages
+#
+#   artifactcache.py: cache of installed module trees
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Cache of the DESTDIR trees produced by building modules.
+
+Each artifact is a compressed tarball of a DESTDIR, named after a key that
+identifies everything the build depended on (see Package.get_artifact_key).
+Artifacts are kept in artifact_cache_dir, which may be shared between
+machines; they are written under a temporary name and renamed, so that
+readers never see a partial artifact.  Once the cache is larger than
+artifact_cache_size, the artifacts that were least recently used are
+removed.
+'''
+
+import os
+import errno
+import posixpath
+import logging
+import tarfile
+import tempfile
+
+from jhbuild.utils import fileutils
+
+SUFFIX = '.tar.gz'
+
+
+def get_filename(config, key):
+    return os.path.join(config.artifact_cache_dir, key[:2], key + SUFFIX)
+
+
+def lookup(config, key):
+    '''Return the filename of the artifact saved for key, or None.'''
+    if not config.artifact_cache_dir or not key:
+        return None
+    filename = get_filename(config, key)
+    try:
+        # record the use, for eviction
+        os.utime(filename, None)
+    except OSError:
+        return None
+    return filename
+
+
+def _check_member(name, symlinks):
+    if os.path.isabs(name) or os.pardir in name.split('/'):
+        raise tarfile.TarError(_('invalid path %r in artifact') % name)
+    # a member below a symbolic link would be written where the link points
+    parent = posixpath.dirname(posixpath.normpath(name))
+    while parent:
+        if parent in symlinks:
+            raise tarfile.TarError(_('invalid path %r in artifact') % name)
+        parent = posixpath.dirname(parent)
+
+
+def _is_safe_link(name, linkname):
+    '''Return whether a symbolic link name to linkname, both relative to
+    the root of an artifact, points inside the artifact.'''
+    if posixpath.isabs(linkname):
+        return False
+    target = posixpath.normpath(posixpath.join(posixpath.dirname(name),
+                                               linkname))
+    return target != os.pardir and not target.startswith(os.pardir + '/')
+
+
+def restore(filename, destdir):
+    '''Extract the artifact filename into destdir.  Artifacts with members
+    that would be extracted outside of destdir, or symbolic links pointing
+    outside of it, are rejected.'''
+    archive = tarfile.open(filename, 'r:*')
+    try:
+        members = archive.getmembers()
+        symlinks = set()
+        for member in members:
+            _check_member(member.name, symlinks)
+            if member.islnk():
+                _check_member(member.linkname, symlinks)
+            elif member.issym():
+                if not _is_safe_link(member.name, member.linkname):
+                    raise tarfile.TarError(
+                            _('invalid link %(name)r to %(target)r in '
+                              'artifact') % {'name': member.name,
+                                             'target': member.linkname})
+                symlinks.add(posixpath.normpath(member.name))
+        archive.extractall(destdir, members)
+    finally:
+        archive.close()
+
+
+def save(config, key, destdir):
+    '''Save the contents of destdir as the artifact of key, and evict old
+    artifacts.  Errors are logged and otherwise ignored.'''
+    if not config.artifact_cache_dir or not key:
+        return
+    for dirpath, dirnames, filenames in os.walk(destdir):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path) and not _is_safe_link(
+                    os.path.relpath(path, destdir), os.readlink(path)):
+                # restore() would reject the artifact
+                logging.info(_('not saving %(dest)r to artifact cache: '
+                               '%(link)r points outside of it') % {
+                        'dest': destdir, 'link': path})
+                return
+    filename = get_filename(config, key)
+    tmpname = None
+    try:
+        fileutils.mkdir_with_parents(os.path.dirname(filename))
+        fd, tmpname = tempfile.mkstemp(prefix='.' + key,
+                                       dir=os.path.dirname(filename))
+        fp = os.fdopen(fd, 'wb')
+        try:
+            archive = tarfile.open(fileobj=fp, mode='w:gz', compresslevel=1)
+            try:
+                for name in sorted(os.listdir(destdir)):
+                    archive.add(os.path.join(destdir, name), name)
+            finally:
+                archive.close()
+        finally:
+            fp.close()
+        os.chmod(tmpname, 0644)
+        os.rename(tmpname, filename)
+    except (IOError, OSError, tarfile.TarError) as e:
+        logging.warn(_('cannot save %(dest)r to artifact cache: %(msg)s') % {
+                'dest': destdir, 'msg': e})
+        if tmpname is not None and os.path.exists(tmpname):
+            os.unlink(tmpname)
+        return
+    evict(config)
+
+
+def evict(config):
+    '''Remove the least recently used artifacts until the cache is not
+    larger than artifact_cache_size megabytes.'''
+    if not config.artifact_cache_dir or config.artifact_cache_size is None:
+        return
+    max_size = config.artifact_cache_size * 1024 * 1024
+    artifacts = []
+    total_size = 0
+    try:
+        subdirs = os.listdir(config.artifact_cache_dir)
+    except OSError:
+        return
+    for subdir in subdirs:
+        dirname = os.path.join(config.artifact_cache_dir, subdir)
+        if not os.path.isdir(dirname):
+            continue
+        for name in os.listdir(dirname):
+            if not name.endswith(SUFFIX) or name.startswith('.'):
+                continue
+            path = os.path.join(dirname, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            artifacts.append((st.st_mtime, path, st.st_size))
+            total_size += st.st_size
+    artifacts.sort()
+    while artifacts and total_size > max_size:
+        mtime, path, size = artifacts.pop(0)
+        try:
+            os.unlink(path)
+        except OSError as e:
+            # removed by another jhbuild sharing the cache
+            if e.errno != errno.ENOENT:
+                continue
+        logging.debug('evicted %s from artifact cache', path)
+        total_size -= size
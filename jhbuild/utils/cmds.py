@@ -19,19 +19,25 @@
 
 import os
 import re
+import collections
 import select
 import subprocess
 import sys
-from signal import SIGINT
+import threading
+from signal import SIGINT, SIGKILL
 from jhbuild.errors import CommandError
 
-def get_output(cmd, cwd=None, extra_env=None, get_stderr = True):
+def get_output(cmd, cwd=None, extra_env=None, get_stderr = True,
+               timeout=None):
     '''Return the output (stdout and stderr) from the command.
 
     If the extra_env dictionary is not empty, then it is used to
     update the environment in the child process.
 
     If the get_stderr parameter is set to False, then stderr output is ignored.
+
+    If timeout is not None, the command and its children are killed after
+    that many seconds.
     
     Raises CommandError if the command exited abnormally or had a non-zero
     error code.
@@ -47,6 +53,9 @@ def get_output(cmd, cwd=None, extra_env=None, get_stderr = True):
     if extra_env is not None:
         kws['env'] = os.environ.copy()
         kws['env'].update(extra_env)
+    if timeout is not None:
+        # own process group, so that the children can be killed too
+        kws['preexec_fn'] = os.setsid
 
     if get_stderr:
         stderr_output = subprocess.STDOUT
@@ -61,7 +70,24 @@ def get_output(cmd, cwd=None, extra_env=None, get_stderr = True):
                              **kws)
     except OSError as e:
         raise CommandError(str(e))
-    stdout, stderr = p.communicate()
+    timed_out = []
+    if timeout is not None:
+        def kill():
+            timed_out.append(True)
+            try:
+                os.killpg(p.pid, SIGKILL)
+            except OSError:
+                pass
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+    try:
+        stdout, stderr = p.communicate()
+    finally:
+        if timeout is not None:
+            timer.cancel()
+    if timed_out:
+        raise CommandError(_('%(cmd)s timed out after %(timeout)s seconds') % {
+                'cmd': cmd, 'timeout': timeout})
     if p.returncode != 0:
         raise CommandError(_('Error running %s') % cmd, p.returncode)
     return stdout
@@ -163,11 +189,55 @@ def spawn_child(command, use_pipe=False,
                              stdin=stdin, stdout=stdout, stderr=stderr)
     return p
 
+# size of the reads of command output, and length after which a line that
+# does not end is passed on in pieces, so that memory use stays bounded
+READ_SIZE = 65536
+MAX_LINE_LENGTH = 1048576
+
+class _LineSplitter(object):
+    '''Splits the data read from a stream into lines, passed to
+    format_line.  Each chunk is only scanned once, and the start of a line
+    is kept in pieces until its end is read.'''
+
+    def __init__(self, format_line, error_output):
+        self.format_line = format_line
+        self.error_output = error_output
+        self.pending = []
+        self.pending_length = 0
+
+    def feed(self, chunk):
+        start = 0
+        end = chunk.find('\n')
+        while end != -1:
+            line = chunk[start:end+1]
+            if self.pending:
+                self.pending.append(line)
+                line = ''.join(self.pending)
+                self.pending = []
+                self.pending_length = 0
+            self.format_line(line, self.error_output)
+            start = end + 1
+            end = chunk.find('\n', start)
+        if start < len(chunk):
+            self.pending.append(chunk[start:])
+            self.pending_length += len(chunk) - start
+            if self.pending_length >= MAX_LINE_LENGTH:
+                self.flush()
+
+    def flush(self):
+        if self.pending:
+            line = ''.join(self.pending)
+            self.pending = []
+            self.pending_length = 0
+            self.format_line(line, self.error_output)
+
 def pprint_output(pipe, format_line):
     '''Process the output of the subprocess and pass lines to the
     format_line function for formatting.  The first argument passed to
     the format_line function is the line of text.  The second argument
-    is True if the line was read from the stderr stream.'''
+    is True if the line was read from the stderr stream.
+
+    Lines longer than MAX_LINE_LENGTH are passed in several pieces.'''
     read_set = []
     if pipe.stdout:
         read_set.append(pipe.stdout)
@@ -176,34 +246,26 @@ def pprint_output(pipe, format_line):
     if not sys.stdin.closed:
         read_set.append(sys.stdin)
 
-    out_data = err_data = ''
+    splitters = {}
+    if pipe.stdout:
+        splitters[pipe.stdout] = _LineSplitter(format_line, False)
+    if pipe.stderr:
+        splitters[pipe.stderr] = _LineSplitter(format_line, True)
     try:
         while read_set:
             rlist, wlist, xlist = select.select(read_set, [], [])
 
-            if pipe.stdout in rlist:
-                out_chunk = os.read(pipe.stdout.fileno(), 10000)
-                if out_chunk == '':
-                    pipe.stdout.close()
-                    read_set.remove(pipe.stdout)
-                    if sys.stdin in read_set:
+            for stream in (pipe.stdout, pipe.stderr):
+                if stream is None or stream not in rlist:
+                    continue
+                chunk = os.read(stream.fileno(), READ_SIZE)
+                if chunk == '':
+                    stream.close()
+                    read_set.remove(stream)
+                    if stream is pipe.stdout and sys.stdin in read_set:
                         read_set.remove(sys.stdin)
-                out_data += out_chunk
-                while '\n' in out_data:
-                    pos = out_data.find('\n')
-                    format_line(out_data[:pos+1], False)
-                    out_data = out_data[pos+1:]
-
-            if pipe.stderr in rlist:
-                err_chunk = os.read(pipe.stderr.fileno(), 10000)
-                if err_chunk == '':
-                    pipe.stderr.close()
-                    read_set.remove(pipe.stderr)
-                err_data += err_chunk
-                while '\n' in err_data:
-                    pos = err_data.find('\n')
-                    format_line(err_data[:pos+1], True)
-                    err_data = err_data[pos+1:]
+                else:
+                    splitters[stream].feed(chunk)
 
             # safeguard against tinderbox that close stdin
             if sys.stdin in rlist and sys.stdin.isatty():
@@ -212,10 +274,9 @@ def pprint_output(pipe, format_line):
                     os.write(pipe.stdin.fileno(), in_chunk)
 
         # flush the remainder of stdout/stderr data lacking newlines
-        if out_data:
-            format_line(out_data, False)
-        if err_data:
-            format_line(err_data, True)
+        for stream in (pipe.stdout, pipe.stderr):
+            if stream is not None:
+                splitters[stream].flush()
 
     except KeyboardInterrupt:
         # interrupt received.  Send SIGINT to child process.
@@ -227,6 +288,27 @@ def pprint_output(pipe, format_line):
 
     return pipe.wait()
 
+class OutputTail(object):
+    '''The last maxlines lines of the output of a command, kept to be
+    shown if it fails, or all of them if maxlines is None.  Every line is
+    also written to spill, a file object, if given.'''
+
+    def __init__(self, maxlines=None, spill=None):
+        self.lines = collections.deque(maxlen=maxlines)
+        self.spill = spill
+        # number of lines that were dropped from the start of the output
+        self.dropped = 0
+
+    def append(self, line):
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(line)
+        if self.spill is not None:
+            self.spill.write(line)
+
+    def __str__(self):
+        return ''.join(self.lines)
+
 def has_command(cmd):
     for path in os.environ['PATH'].split(os.pathsep):
         prog = os.path.abspath(os.path.join(path, cmd))
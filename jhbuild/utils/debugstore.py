@@ -0,0 +1,60 @@
+# jhbuild - a tool to ease building collections of source packages
+#
+#   debugstore.py: debug symbols kept by build ID
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Store of debug symbols keyed by GNU build ID.
+
+When debug_store is 'build-id', the debug symbols stripped from installed
+binaries are kept, with compressed sections, in
+prefix/debug/.build-id/xx/yyyy.debug, where xxyyyy is the build ID of the
+binary; this is where gdb looks for them when its debug-file-directory is
+prefix/debug.  They are installed by modules like their other files, next
+to a prefix/debug/.build-id/xx/yyyy symbolic link to the binary, so rebuilds
+and modules producing identical binaries install the same debug file.  A
+debug file and its link are only removed once no installed module uses
+them.
+'''
+
+import os
+import re
+
+STORE_DIR = os.path.join('debug', '.build-id')
+
+_store_re = re.compile(r'(^|/)debug/\.build-id/[0-9a-f]{2}/[0-9a-f]+(\.debug)?/?$')
+
+
+def get_link_name(build_id):
+    '''Return the path of the link of build_id, relative to the prefix.'''
+    return os.path.join(STORE_DIR, build_id[:2], build_id[2:])
+
+
+def get_debug_filename(prefix, build_id):
+    return os.path.join(prefix, get_link_name(build_id) + '.debug')
+
+
+def is_store_file(path):
+    '''Return whether path is a debug file or a link of the store.'''
+    return _store_re.search(path) is not None
+
+
+def filter_shared(packagedb, package, paths):
+    '''Return the list of paths, the files package no longer installs,
+    without the debug files and links that other packages still
+    install.'''
+    return [path for path in paths
+            if not is_store_file(path) or
+               not [x for x in packagedb.owners(path) if x != package]]
@@ -0,0 +1,282 @@
+# jhbuild - a tool to ease building collections of source packages
+#
+#   download.py: in-process download of files
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Download of files over HTTP, HTTPS and the other protocols of urllib2.
+
+Files are written to filename.part and renamed once complete.  An
+interrupted HTTP download is resumed from the .part file the next time.
+The data is hashed while it is received, so that the file does not have
+to be read again to be verified, and can be given to a sink, such as the
+extraction of an archive, at the same time.  HTTP connections are kept open and
+reused for the following downloads from the same server.
+'''
+
+import os
+import base64
+import socket
+import hashlib
+import httplib
+import urllib
+import urllib2
+import urlparse
+import threading
+
+from jhbuild.errors import CommandError
+
+__all__ = ['download', 'close_connections']
+
+CHUNK_SIZE = 65536
+MAX_REDIRECTS = 10
+TIMEOUT = 60
+
+# idle connections, by (scheme, netloc)
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+class _Connection(object):
+    '''A connection to a server, directly or through a proxy.  proxied is
+    True when requests go to an HTTP proxy, with the whole URL, and headers
+    are the headers they need.'''
+
+    def __init__(self, conn, proxied=False, headers={}):
+        self.conn = conn
+        self.proxied = proxied
+        self.headers = headers
+
+
+def _open_connection(scheme, netloc):
+    '''Return a new connection to netloc, through the proxy configured for
+    scheme if any.'''
+    host = urlparse.urlsplit('//' + netloc).hostname
+    proxy = urllib.getproxies().get(scheme)
+    if not proxy or urllib.proxy_bypass(host):
+        if scheme == 'https':
+            return _Connection(httplib.HTTPSConnection(netloc, timeout=TIMEOUT))
+        return _Connection(httplib.HTTPConnection(netloc, timeout=TIMEOUT))
+
+    parts = urlparse.urlsplit(proxy)
+    proxy_netloc = parts.hostname
+    if parts.port:
+        proxy_netloc = '%s:%d' % (proxy_netloc, parts.port)
+    headers = {}
+    if parts.username:
+        credentials = '%s:%s' % (urllib.unquote(parts.username),
+                                 urllib.unquote(parts.password or ''))
+        headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(credentials)
+    if scheme == 'https':
+        conn = httplib.HTTPSConnection(proxy_netloc, timeout=TIMEOUT)
+        conn.set_tunnel(netloc, headers=headers)
+        return _Connection(conn)
+    return _Connection(httplib.HTTPConnection(proxy_netloc, timeout=TIMEOUT),
+                       True, headers)
+
+
+def _get_connection(scheme, netloc):
+    '''Return a connection to netloc, and whether it was already used.'''
+    with _connections_lock:
+        idle = _connections.get((scheme, netloc))
+        if idle:
+            return idle.pop(), True
+    return _open_connection(scheme, netloc), False
+
+
+def _release_connection(scheme, netloc, connection):
+    with _connections_lock:
+        _connections.setdefault((scheme, netloc), []).append(connection)
+
+
+def close_connections():
+    '''Close the connections kept open for the next downloads.'''
+    with _connections_lock:
+        for idle in _connections.values():
+            for connection in idle:
+                connection.conn.close()
+        _connections.clear()
+
+
+def _request(url, headers):
+    '''Send a GET request for url, and return the connection and the
+    response.'''
+    parts = urlparse.urlsplit(url)
+    if parts.path:
+        path = parts.path
+    else:
+        path = '/'
+    if parts.query:
+        path += '?' + parts.query
+    while True:
+        connection, reused = _get_connection(parts.scheme, parts.netloc)
+        request_headers = dict(connection.headers)
+        request_headers.update(headers)
+        try:
+            connection.conn.request('GET', connection.proxied and url or path,
+                                    headers=request_headers)
+            return connection, connection.conn.getresponse()
+        except (httplib.HTTPException, socket.error) as e:
+            connection.conn.close()
+            if not reused:
+                raise CommandError(_('failed to download %(url)s: %(msg)s') % {
+                        'url': url, 'msg': e})
+            # the server closed the idle connection, try a new one
+
+
+def _finish(url, connection, response):
+    '''Read what remains of response, and keep the connection for the next
+    requests if possible.'''
+    response.read()
+    if response.will_close:
+        connection.conn.close()
+    else:
+        parts = urlparse.urlsplit(url)
+        _release_connection(parts.scheme, parts.netloc, connection)
+
+
+def _new_hash(hash_algo):
+    if hash_algo is None:
+        return None
+    return hashlib.new(hash_algo)
+
+
+def _read_file(filename, hasher, sink):
+    fp = open(filename, 'rb')
+    try:
+        data = fp.read(CHUNK_SIZE)
+        while data:
+            if hasher is not None:
+                hasher.update(data)
+            if sink is not None:
+                sink.write(data)
+            data = fp.read(CHUNK_SIZE)
+    finally:
+        fp.close()
+
+
+def _copy_stream(url, response, partname, mode, hasher, sink, length=None):
+    '''Write the data read from response to partname, opened with mode,
+    updating hasher and sink.  length is the expected number of bytes, or
+    None.'''
+    received = 0
+    fp = open(partname, mode)
+    try:
+        while True:
+            try:
+                data = response.read(CHUNK_SIZE)
+            except (httplib.HTTPException, socket.error) as e:
+                raise CommandError(_('failed to download %(url)s: %(msg)s') % {
+                        'url': url, 'msg': e})
+            if not data:
+                break
+            fp.write(data)
+            if hasher is not None:
+                hasher.update(data)
+            if sink is not None:
+                sink.write(data)
+            received += len(data)
+    finally:
+        fp.close()
+    if length is not None and received < length:
+        raise CommandError(_('failed to download %(url)s: connection closed '
+                             'after %(size)d of %(total)d bytes') % {
+                'url': url, 'size': received, 'total': length})
+
+
+def _http_download(url, partname, hash_algo, sink):
+    for i in range(MAX_REDIRECTS):
+        try:
+            offset = os.stat(partname).st_size
+        except OSError:
+            offset = 0
+        headers = {'User-Agent': 'jhbuild', 'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        connection, response = _request(url, headers)
+
+        if response.status in (301, 302, 303, 307, 308):
+            location = response.getheader('location')
+            _finish(url, connection, response)
+            if not location:
+                break
+            url = urlparse.urljoin(url, location)
+            continue
+
+        content_range = response.getheader('content-range', '')
+        if response.status == 206 and content_range.startswith(
+                'bytes %d-' % offset):
+            hasher = _new_hash(hash_algo)
+            if hasher is not None or sink is not None:
+                _read_file(partname, hasher, sink)
+            mode = 'ab'
+        elif response.status == 200:
+            hasher = _new_hash(hash_algo)
+            mode = 'wb'
+        elif offset and response.status in (206, 416):
+            # the partial file does not match the resource, start again
+            _finish(url, connection, response)
+            os.remove(partname)
+            continue
+        else:
+            _finish(url, connection, response)
+            raise CommandError(_('failed to download %(url)s: %(status)d %(reason)s')
+                    % {'url': url, 'status': response.status,
+                       'reason': response.reason}, response.status)
+
+        length = response.getheader('content-length')
+        if length is not None:
+            length = int(length)
+        try:
+            _copy_stream(url, response, partname, mode, hasher, sink, length)
+        except CommandError:
+            connection.conn.close()
+            raise
+        _finish(url, connection, response)
+        return hasher
+    raise CommandError(_('failed to download %s: too many redirects') % url)
+
+
+def _urllib_download(url, partname, hash_algo, sink):
+    try:
+        response = urllib2.urlopen(url, timeout=TIMEOUT)
+    except (urllib2.URLError, httplib.HTTPException, socket.error) as e:
+        raise CommandError(_('failed to download %(url)s: %(msg)s') % {
+                'url': url, 'msg': e})
+    try:
+        hasher = _new_hash(hash_algo)
+        _copy_stream(url, response, partname, 'wb', hasher, sink)
+    finally:
+        response.close()
+    return hasher
+
+
+def download(url, filename, hash_algo=None, sink=None):
+    '''Download url to filename, and return the hexadecimal digest of the
+    file computed with hash_algo, the name of a hashlib algorithm, or None.
+    The content of the file is also given, in order, to the write() method
+    of sink, if any.
+
+    Raises CommandError if the download fails, keeping what was received
+    in filename.part, to be resumed by the next call.'''
+    partname = filename + '.part'
+    if urlparse.urlsplit(url).scheme in ('http', 'https'):
+        hasher = _http_download(url, partname, hash_algo, sink)
+    else:
+        hasher = _urllib_download(url, partname, hash_algo, sink)
+    os.rename(partname, filename)
+    if hasher is None:
+        return None
+    return hasher.hexdigest()
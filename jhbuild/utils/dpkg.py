@@ -0,0 +1,286 @@
+# jhbuild - a tool to ease building collections of source packages
+#
+#   dpkg.py: index of the files installed by dpkg
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Reading of the dpkg database, to know which packages own installed
+files and which packages are installed without running dpkg -S and
+dpkg -l.
+
+dpkg -S reads the file lists of all the packages each time it is run.
+Here the lists of /var/lib/dpkg/info/*.list are read once and saved, with
+the modification time of each of them, so that only the lists of the
+packages installed, upgraded or removed since the last run are read
+again.
+'''
+
+import os
+import re
+import errno
+import fnmatch
+import logging
+import cPickle
+
+from jhbuild.utils import fileutils
+
+__all__ = ['DpkgIndex', 'get_cache_filename']
+
+# increase when the format of the index changes
+INDEX_VERSION = 1
+
+DEFAULT_ADMINDIR = '/var/lib/dpkg'
+
+
+def _has_wildcards(pattern):
+    for c in '*?[\\':
+        if c in pattern:
+            return True
+    return False
+
+
+def get_cache_filename():
+    '''Return the file where the index of the system dpkg database is
+    kept between runs.'''
+    try:
+        cachedir = os.path.join(os.environ['XDG_CACHE_HOME'], 'jhbuild')
+    except KeyError:
+        cachedir = os.path.join(os.environ['HOME'], '.cache', 'jhbuild')
+    return os.path.join(cachedir, 'dpkg.pickle')
+
+
+def _stat_key(st):
+    return (st.st_mtime, st.st_size, st.st_ino, st.st_dev)
+
+
+def _read_list(filename):
+    try:
+        fp = open(filename)
+    except IOError:
+        return None
+    try:
+        return fp.read()
+    finally:
+        fp.close()
+
+
+def _read_status(filename):
+    '''Return a dictionary mapping the names of the packages installed
+    according to the dpkg status file filename to their versions.  The
+    names of Multi-Arch: same packages include their architecture, as
+    with dpkg -l.'''
+    installed = {}
+    try:
+        fp = open(filename)
+    except IOError:
+        return installed
+    try:
+        fields = {}
+        for line in fp:
+            if line[:1] in (' ', '\t'):
+                continue
+            line = line.rstrip('\n')
+            if line:
+                key, sep, value = line.partition(':')
+                if sep and key in ('Package', 'Status', 'Version',
+                                   'Architecture', 'Multi-Arch'):
+                    fields[key] = value.strip()
+                continue
+            _add_package(installed, fields)
+            fields = {}
+        _add_package(installed, fields)
+    finally:
+        fp.close()
+    return installed
+
+
+def _add_package(installed, fields):
+    # only the packages selected for installation and fully installed,
+    # not the held ones nor the ones to be removed
+    if fields.get('Status', '').split() != ['install', 'ok', 'installed']:
+        return
+    name = fields.get('Package')
+    if not name:
+        return
+    if fields.get('Multi-Arch') == 'same' and fields.get('Architecture'):
+        name = '%s:%s' % (name, fields['Architecture'])
+    installed[name] = fields.get('Version', '')
+
+
+class DpkgIndex(object):
+    '''The files installed by the packages of the dpkg database in
+    admindir, and the packages that own them.  The index is saved to
+    filename, if given, by save().'''
+
+    def __init__(self, admindir=DEFAULT_ADMINDIR, filename=None):
+        self.admindir = admindir
+        self.filename = filename
+        # package -> (stat key, content of its file list), kept as a
+        # single string as that is much faster to load than a list
+        self._lists = {}
+        # (stat key, {package: version}) of the status file
+        self._status = None
+        # path -> packages owning it, built from _lists on the first lookup
+        self._owners = None
+        self._changed = False
+        if filename is not None:
+            self._load()
+        self.update()
+
+    def _load(self):
+        try:
+            fp = open(self.filename, 'rb')
+            try:
+                version, admindir, lists, status = cPickle.load(fp)
+            finally:
+                fp.close()
+        except Exception as e:
+            if not isinstance(e, EnvironmentError) or e.errno != errno.ENOENT:
+                logging.debug('ignoring dpkg index %s: %s', self.filename, e)
+            return
+        if version == INDEX_VERSION and admindir == self.admindir:
+            self._lists = lists
+            self._status = status
+
+    def save(self):
+        '''Write the index to its file, if it changed.'''
+        if self.filename is None or not self._changed:
+            return
+        try:
+            fileutils.mkdir_with_parents(os.path.dirname(self.filename))
+            writer = fileutils.SafeWriter(self.filename)
+            cPickle.dump((INDEX_VERSION, self.admindir, self._lists,
+                          self._status), writer.fp, cPickle.HIGHEST_PROTOCOL)
+            writer.commit()
+        except EnvironmentError as e:
+            logging.debug('cannot write dpkg index %s: %s', self.filename, e)
+            return
+        self._changed = False
+
+    def update(self):
+        '''Read again the file lists that changed since the index was
+        built, and forget the packages that were removed.'''
+        infodir = os.path.join(self.admindir, 'info')
+        try:
+            names = os.listdir(infodir)
+        except OSError:
+            names = []
+        seen = set()
+        for name in names:
+            if not name.endswith('.list'):
+                continue
+            package = name[:-len('.list')]
+            filename = os.path.join(infodir, name)
+            try:
+                key = _stat_key(os.stat(filename))
+            except OSError:
+                continue
+            seen.add(package)
+            entry = self._lists.get(package)
+            if entry is not None and entry[0] == key:
+                continue
+            data = _read_list(filename)
+            if data is None:
+                seen.discard(package)
+                continue
+            self._lists[package] = (key, data)
+            self._changed = True
+            self._owners = None
+        for package in set(self._lists) - seen:
+            del self._lists[package]
+            self._changed = True
+            self._owners = None
+
+    def _get_owners_index(self):
+        if self._owners is None:
+            owners = {}
+            for package in sorted(self._lists):
+                for path in self._lists[package][1].split('\n'):
+                    if path:
+                        owners.setdefault(path, []).append(package)
+            self._owners = owners
+        return self._owners
+
+    def get_owners(self, path):
+        '''Return the list of the packages owning path, empty if none
+        does.'''
+        if path != '/':
+            path = path.rstrip('/')
+        return list(self._get_owners_index().get(path, []))
+
+    def search(self, patterns):
+        '''Return a dictionary mapping the installed paths matching any of
+        patterns to the lists of the packages owning them, as dpkg -S does:
+        a pattern not starting with a slash or a wildcard matches the paths
+        containing it, other patterns are shell wildcards matching the
+        whole path.
+
+        Paths without wildcards, such as the libraries found by ldd, are
+        looked up in an index of the owners of every path, built once.  The
+        lists of all the packages are only scanned for the other patterns,
+        once for all of them.'''
+        literals = set()
+        substrings = []
+        globs = []
+        for pattern in patterns:
+            if pattern[:1] not in ('/', '*', '?', '['):
+                pattern = '*%s*' % pattern
+            middle = pattern.strip('*')
+            if not _has_wildcards(pattern):
+                literals.add(pattern.rstrip('/') or '/')
+            elif pattern.startswith('*') and pattern.endswith('*') and \
+                    not _has_wildcards(middle):
+                substrings.append(middle)
+            else:
+                globs.append(re.compile(fnmatch.translate(pattern)).match)
+
+        found = {}
+        if literals:
+            owners = self._get_owners_index()
+            for path in literals:
+                if path in owners:
+                    found[path] = list(owners[path])
+        if not substrings and not globs:
+            return found
+        for package in sorted(self._lists):
+            data = self._lists[package][1]
+            if not globs and not [x for x in substrings if x in data]:
+                continue
+            paths = data.split('\n')
+            matched = set()
+            for substring in substrings:
+                if substring in data:
+                    matched.update(x for x in paths if substring in x)
+            for match in globs:
+                matched.update(x for x in paths if match(x))
+            # the owners of literal paths are already known
+            matched.difference_update(literals)
+            matched.discard('')
+            for path in matched:
+                found.setdefault(path, []).append(package)
+        return found
+
+    def get_installed_packages(self):
+        '''Return a dictionary mapping the names of the installed packages
+        to their versions, as listed by dpkg -l.'''
+        filename = os.path.join(self.admindir, 'status')
+        try:
+            key = _stat_key(os.stat(filename))
+        except OSError:
+            return {}
+        if self._status is None or self._status[0] != key:
+            self._status = (key, _read_status(filename))
+            self._changed = True
+        return dict(self._status[1])
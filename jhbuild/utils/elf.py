@@ -0,0 +1,360 @@
+# jhbuild - a tool to ease building collections of source packages
+#
+#   elf.py: reading of ELF headers and resolution of shared libraries
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Reading of ELF files, as needed to find the shared libraries used by
+installed binaries without running file(1) and ldd(1) on each of them.'''
+
+import os
+import re
+import glob
+import struct
+
+__all__ = ['ElfFile', 'read', 'LibraryResolver']
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_NOTE = 4
+
+SHT_SYMTAB = 2
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+NT_GNU_BUILD_ID = 3
+
+# formats of the header (after e_ident), program headers, section headers
+# and dynamic entries, for each class
+_formats = {
+    ELFCLASS32: ('HHIIIIIHHHHHH', 'IIIIIIII', 'IIIIIIIIII', 'iI'),
+    ELFCLASS64: ('HHIQQQIHHHHHH', 'IIQQQQQQ', 'IIQQQQIIQQ', 'qQ'),
+}
+
+
+class ElfFile(object):
+    '''Headers of an ELF file.
+
+    needed, soname, rpath and runpath come from the dynamic section; they
+    are empty for files that are not dynamically linked.  stripped is True
+    when the file has no symbol table, as reported by file(1).  build_id is
+    the GNU build ID, as a hexadecimal string, or None.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.elfclass = None
+        self.byteorder = None
+        self.machine = None
+        self.type = None
+        self.dynamic = False
+        self.interpreter = None
+        self.needed = []
+        self.soname = None
+        self.rpath = []
+        self.runpath = []
+        self.stripped = True
+        self.build_id = None
+
+    def is_compatible(self, other):
+        '''Return whether other can be loaded with self.'''
+        return (self.elfclass, self.byteorder, self.machine) == \
+               (other.elfclass, other.byteorder, other.machine)
+
+    def __repr__(self):
+        return '<ElfFile %s>' % self.filename
+
+
+def _read_at(fp, offset, size):
+    fp.seek(offset)
+    data = fp.read(size)
+    if len(data) != size:
+        raise ValueError('truncated file')
+    return data
+
+
+def _parse(fp, filename):
+    ident = fp.read(16)
+    if len(ident) != 16 or ident[:4] != '\x7fELF':
+        return None
+    info = ElfFile(filename)
+    info.elfclass = ord(ident[4])
+    info.byteorder = ord(ident[5])
+    if info.elfclass not in _formats:
+        return None
+    prefix = info.byteorder == ELFDATA2LSB and '<' or '>'
+    header_fmt, phdr_fmt, shdr_fmt, dyn_fmt = [
+            struct.Struct(prefix + x) for x in _formats[info.elfclass]]
+
+    (info.type, info.machine, version, entry, phoff, shoff, flags, ehsize,
+     phentsize, phnum, shentsize, shnum, shstrndx) = header_fmt.unpack(
+            _read_at(fp, 16, header_fmt.size))
+
+    # program headers: loadable segments, interpreter, notes and dynamic
+    # section
+    loads = []
+    notes = []
+    dynamic = None
+    for i in range(phnum):
+        fields = phdr_fmt.unpack(_read_at(fp, phoff + i * phentsize, phdr_fmt.size))
+        if info.elfclass == ELFCLASS32:
+            p_type, p_offset, p_vaddr, p_paddr, p_filesz = fields[:5]
+        else:
+            p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz = fields[:6]
+        if p_type == PT_LOAD:
+            loads.append((p_vaddr, p_offset, p_filesz))
+        elif p_type == PT_DYNAMIC:
+            dynamic = (p_offset, p_filesz)
+        elif p_type == PT_INTERP:
+            info.interpreter = _read_at(fp, p_offset, p_filesz).rstrip('\0')
+        elif p_type == PT_NOTE:
+            notes.append((p_offset, p_filesz))
+
+    note_fmt = struct.Struct(prefix + 'III')
+    for p_offset, p_filesz in notes:
+        data = _read_at(fp, p_offset, p_filesz)
+        offset = 0
+        while offset + note_fmt.size <= len(data):
+            namesz, descsz, note_type = note_fmt.unpack_from(data, offset)
+            offset += note_fmt.size
+            name = data[offset:offset + namesz]
+            offset += (namesz + 3) & ~3
+            desc = data[offset:offset + descsz]
+            offset += (descsz + 3) & ~3
+            if note_type == NT_GNU_BUILD_ID and name == 'GNU\0':
+                info.build_id = desc.encode('hex')
+
+    if dynamic is not None:
+        info.dynamic = True
+        entries = []
+        data = _read_at(fp, dynamic[0], dynamic[1])
+        for offset in range(0, len(data) - dyn_fmt.size + 1, dyn_fmt.size):
+            tag, value = dyn_fmt.unpack_from(data, offset)
+            if tag == DT_NULL:
+                break
+            entries.append((tag, value))
+        entries_dict = dict(entries)
+        strtab = entries_dict.get(DT_STRTAB)
+        strsz = entries_dict.get(DT_STRSZ)
+        if strtab is not None and strsz is not None:
+            # DT_STRTAB is an address, find where it is in the file
+            for vaddr, offset, filesz in loads:
+                if vaddr <= strtab < vaddr + filesz:
+                    strings = _read_at(fp, strtab - vaddr + offset, strsz)
+                    break
+            else:
+                raise ValueError('string table not found')
+
+            def string(index):
+                return strings[index:strings.index('\0', index)]
+
+            for tag, value in entries:
+                if tag == DT_NEEDED:
+                    info.needed.append(string(value))
+                elif tag == DT_SONAME:
+                    info.soname = string(value)
+                elif tag == DT_RPATH:
+                    info.rpath.extend(string(value).split(':'))
+                elif tag == DT_RUNPATH:
+                    info.runpath.extend(string(value).split(':'))
+
+    # section headers: symbol table
+    for i in range(shnum):
+        fields = shdr_fmt.unpack(_read_at(fp, shoff + i * shentsize, shdr_fmt.size))
+        if fields[1] == SHT_SYMTAB:
+            info.stripped = False
+            break
+
+    return info
+
+
+def read(filename):
+    '''Return the ElfFile of filename, or None if it is not a valid ELF
+    file.'''
+    try:
+        fp = open(filename, 'rb')
+    except IOError:
+        return None
+    try:
+        return _parse(fp, filename)
+    except (IOError, ValueError, struct.error):
+        return None
+    finally:
+        fp.close()
+
+
+def _read_ld_so_conf(filename, dirs):
+    try:
+        lines = open(filename).readlines()
+    except IOError:
+        return
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith('include') and line[7:8] in (' ', '\t'):
+            for pattern in line[8:].split():
+                pattern = os.path.join(os.path.dirname(filename), pattern)
+                for included in sorted(glob.glob(pattern)):
+                    _read_ld_so_conf(included, dirs)
+        elif line.startswith('hwcap') and line[5:6] in (' ', '\t'):
+            continue
+        else:
+            for directory in line.replace(',', ' ').replace(':', ' ').split():
+                # remove the optional =TYPE suffix
+                directory = directory.split('=', 1)[0]
+                if directory not in dirs:
+                    dirs.append(directory)
+
+
+_system_library_path = None
+
+def get_system_library_path():
+    '''Return the directories searched by the dynamic linker after
+    LD_LIBRARY_PATH, as listed in /etc/ld.so.conf, followed by the trusted
+    directories.'''
+    global _system_library_path
+    if _system_library_path is None:
+        dirs = []
+        _read_ld_so_conf('/etc/ld.so.conf', dirs)
+        for directory in ('/lib64', '/usr/lib64', '/lib', '/usr/lib'):
+            if directory not in dirs:
+                dirs.append(directory)
+        _system_library_path = dirs
+    return _system_library_path
+
+
+# sonames of the dynamic linker, which is always loaded and not listed
+_dynamic_linker_re = re.compile(r'^ld(-linux[-\w.]*|64)?\.so(\.\d+)*$')
+
+
+class LibraryResolver(object):
+    '''Find the shared libraries loaded with ELF files, the way ldd(1)
+    lists them, with library_path as LD_LIBRARY_PATH.
+
+    Parsed files are kept, so that libraries shared by the files of a
+    module are only read once.'''
+
+    def __init__(self, library_path=None, system_library_path=None):
+        self.library_path = [x for x in (library_path or []) if x]
+        if system_library_path is None:
+            system_library_path = get_system_library_path()
+        self.system_library_path = system_library_path
+        self._files = {}
+        self._dependencies = {}
+
+    def add(self, info):
+        '''Use info, an ElfFile that was already read, for its file.'''
+        self._files[info.filename] = info
+
+    def read(self, filename):
+        try:
+            return self._files[filename]
+        except KeyError:
+            info = self._files[filename] = read(filename)
+            return info
+
+    def _expand(self, directories, info):
+        origin = os.path.dirname(os.path.abspath(info.filename))
+        lib = info.elfclass == ELFCLASS64 and 'lib64' or 'lib'
+        result = []
+        for directory in directories:
+            if '$' in directory:
+                for token, value in (('ORIGIN', origin), ('LIB', lib),
+                                     ('PLATFORM', os.uname()[4])):
+                    directory = directory.replace('${%s}' % token, value)
+                    directory = directory.replace('$%s' % token, value)
+            if directory:
+                result.append(directory)
+        return result
+
+    def _find(self, name, info, loaders, main):
+        if '/' in name:
+            candidates = [name]
+        else:
+            directories = []
+            if not info.runpath:
+                # DT_RPATH of the object and of the objects that loaded it,
+                # up to the executable, unless they have DT_RUNPATH
+                for loader in [info] + loaders:
+                    if not loader.runpath:
+                        directories.extend(self._expand(loader.rpath, loader))
+            directories.extend(self.library_path)
+            directories.extend(self._expand(info.runpath, info))
+            directories.extend(self.system_library_path)
+            candidates = [os.path.join(x, name) for x in directories]
+        for candidate in candidates:
+            library = self.read(candidate)
+            if library is not None and main.is_compatible(library):
+                return candidate, library
+        return None, None
+
+    def dependencies(self, filename):
+        '''Return a list of the paths of the shared libraries loaded with
+        filename, and the list of the names of the ones that were not found.
+
+        Both are empty if filename is not a dynamically linked ELF file.'''
+        try:
+            return self._dependencies[filename]
+        except KeyError:
+            pass
+        found = []
+        notfound = []
+        main = self.read(filename)
+        if main is not None and main.dynamic:
+            loaded = set([main.soname])
+            if main.interpreter:
+                loaded.add(os.path.basename(main.interpreter))
+            loaded_files = set()
+            try:
+                st = os.stat(filename)
+                loaded_files.add((st.st_dev, st.st_ino))
+            except OSError:
+                pass
+            # breadth first, as the dynamic linker does
+            queue = [(main, [])]
+            while queue:
+                info, loaders = queue.pop(0)
+                for name in info.needed:
+                    if name in loaded or _dynamic_linker_re.match(name):
+                        continue
+                    loaded.add(name)
+                    path, library = self._find(name, info, loaders, main)
+                    if path is None:
+                        notfound.append(name)
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if (st.st_dev, st.st_ino) in loaded_files:
+                        continue
+                    loaded_files.add((st.st_dev, st.st_ino))
+                    if library.soname:
+                        loaded.add(library.soname)
+                    found.append(path)
+                    queue.append((library, [info] + loaders))
+        self._dependencies[filename] = (found, notfound)
+        return found, notfound
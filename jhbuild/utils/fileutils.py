@@ -114,6 +114,23 @@ Turns relative paths into absolute paths, as appropriate."""
         result.append(path)
     return result
 
+def same_contents(filename1, filename2, bufsize=65536):
+    """Return whether the two files have the same contents."""
+    fp1 = open(filename1, 'rb')
+    try:
+        fp2 = open(filename2, 'rb')
+        try:
+            while True:
+                data1 = fp1.read(bufsize)
+                if data1 != fp2.read(bufsize):
+                    return False
+                if not data1:
+                    return True
+        finally:
+            fp2.close()
+    finally:
+        fp1.close()
+
 # Modified rename from http://selenic.com/repo/hg/file/tip/mercurial/windows.py
 def _windows_rename(src, dst):
     '''atomically rename file src to dst, replacing dst if it exists'''
@@ -0,0 +1,123 @@
+# jhbuild - a tool to ease building collections of source packages
+#
+#   inventory.py: single pass listing of installed files
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Listing of the files installed into a DESTDIR.
+
+The tree is read once, with one lstat() per entry, and the ELF headers of
+the files that may be executables or libraries are read at the same time.
+The stages of Package.process_install then work from the inventory instead
+of walking the tree again, and record the files they add or remove.
+'''
+
+import os
+import stat
+import collections
+
+from jhbuild.utils import elf
+
+__all__ = ['Entry', 'Inventory']
+
+_EXEC_BITS = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+
+
+class Entry(object):
+    __slots__ = ('path', 'mode', 'size', 'elf')
+
+    def __init__(self, path, st):
+        self.path = path
+        self.mode = st.st_mode
+        self.size = st.st_size
+        # ElfFile of executables and libraries, None for other files
+        self.elf = None
+
+    @property
+    def isdir(self):
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def islink(self):
+        return stat.S_ISLNK(self.mode)
+
+    @property
+    def isfile(self):
+        return stat.S_ISREG(self.mode)
+
+    def may_be_elf(self):
+        '''Return whether the file is an executable or a shared library,
+        judging from its mode and name.'''
+        return self.isfile and (self.mode & _EXEC_BITS or 'so' in
+                os.path.basename(self.path).split(os.path.extsep))
+
+    def __repr__(self):
+        return '<Entry %s>' % self.path
+
+
+class Inventory(object):
+    '''Files, directories and links under root.
+
+    entries maps paths relative to root to Entry objects, directories before
+    the entries they contain.'''
+
+    def __init__(self, root):
+        self.root = root
+        self.entries = collections.OrderedDict()
+        if os.path.isdir(root):
+            self._scan('')
+
+    def _scan(self, dirname):
+        for name in os.listdir(os.path.join(self.root, dirname)):
+            self._read(os.path.join(dirname, name))
+
+    def _read(self, path):
+        fullpath = os.path.join(self.root, path)
+        entry = Entry(path, os.lstat(fullpath))
+        if entry.may_be_elf():
+            entry.elf = elf.read(fullpath)
+        self.entries[path] = entry
+        if entry.isdir:
+            self._scan(path)
+        return entry
+
+    def add(self, path):
+        '''Record path, which was created or modified after the tree was
+        read, with its parent directories, and return its entry.'''
+        parent = os.path.dirname(path)
+        if parent and parent not in self.entries:
+            self.add(parent)
+        if path in self.entries and not self.entries[path].isdir:
+            del self.entries[path]
+        if path in self.entries:
+            return self.entries[path]
+        return self._read(path)
+
+    def remove(self, path):
+        '''Delete the file path.'''
+        os.unlink(os.path.join(self.root, path))
+        del self.entries[path]
+
+    def contents(self):
+        '''Return the files and empty directories, as
+        fileutils.accumulate_dirtree_contents does.'''
+        parents = set(os.path.dirname(path) for path in self.entries)
+        contents = []
+        for path, entry in self.entries.iteritems():
+            if not entry.isdir:
+                contents.append(path)
+            elif path not in parents:
+                contents.append(path + os.sep)
+        return contents
@@ -0,0 +1,144 @@
+# jhbuild - a tool to ease building collections of source packages
+#
+#   modulesetcache.py: on-disk cache of parsed modulesets
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Cache of parsed modulesets.
+
+Parsing a moduleset and the modulesets it includes produces module objects
+that only depend on the content of the moduleset files, on the jhbuild code
+and on the few configuration variables read while parsing.  They are
+pickled to top_builddir/modulesets, with the SHA-1 of every file that was
+read, and reused as long as none of those changed.
+'''
+
+import os
+import hashlib
+import logging
+import cPickle
+
+from jhbuild.utils import fileutils
+from jhbuild.utils import httpcache
+
+# increase when the format of the cache entries changes
+CACHE_VERSION = 1
+
+# configuration variables read while parsing modulesets, other variables are
+# only read from the configuration object once modules are built
+_parse_keys = ('moduleset', 'modulesets_dir', 'use_local_modulesets',
+               'conditions', 'branches', 'repos', 'checkoutroot',
+               'dvcs_mirror_dir', 'mirror_policy', 'module_mirror_policy',
+               'modulecmakeargs', 'appendmodulecmakeargs', 'prefix',
+               'cvs_program', 'svn_program')
+
+_CONFIG_ID = 'config'
+
+
+def hash_file(filename):
+    return hashlib.sha1(open(filename, 'rb').read()).hexdigest()
+
+
+def _config_key(config):
+    items = []
+    for key in _parse_keys:
+        value = getattr(config, key, None)
+        if isinstance(value, (set, frozenset)):
+            value = sorted(value)
+        elif isinstance(value, dict):
+            value = sorted(value.items())
+        items.append((key, value))
+    return hashlib.sha1(repr(items)).hexdigest()
+
+
+def _code_key():
+    '''Return a key changing with the code building module objects'''
+    topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    mtimes = [os.stat(os.path.join(topdir, 'moduleset.py')).st_mtime]
+    for subdir in ('modtypes', 'versioncontrol'):
+        dirname = os.path.join(topdir, subdir)
+        for name in sorted(os.listdir(dirname)):
+            if name.endswith('.py'):
+                mtimes.append((name,
+                               os.stat(os.path.join(dirname, name)).st_mtime))
+    return hashlib.sha1(repr(mtimes)).hexdigest()
+
+
+def _cache_filename(config, uri):
+    return os.path.join(config.top_builddir, 'modulesets',
+                        hashlib.sha1(uri).hexdigest() + '.pickle')
+
+
+def _sources_unchanged(config, sources):
+    for uri, digest in sources:
+        try:
+            # remote modulesets are checked against the copy kept by the
+            # HTTP cache, which is only validated with the server once it
+            # expired, rather than downloaded again
+            filename = httpcache.load(uri, nonetwork=config.nonetwork)
+            if hash_file(filename) != digest:
+                return False
+        except Exception:
+            return False
+    return True
+
+
+def load(config, uri):
+    '''Return the data saved for uri, or None if there is no valid cache
+    entry for it.'''
+    filename = _cache_filename(config, uri)
+    if not os.path.exists(filename):
+        return None
+    try:
+        fp = open(filename, 'rb')
+        try:
+            unpickler = cPickle.Unpickler(fp)
+            unpickler.persistent_load = lambda x: config
+            header = unpickler.load()
+            if header != (CACHE_VERSION, uri, _config_key(config), _code_key()):
+                return None
+            sources = unpickler.load()
+            if not _sources_unchanged(config, sources):
+                return None
+            return unpickler.load()
+        finally:
+            fp.close()
+    except Exception as e:
+        logging.debug('ignoring moduleset cache for %s: %s', uri, e)
+        return None
+
+
+def save(config, uri, sources, data):
+    '''Save data, which is the result of parsing uri, a process that read
+    sources, a list of (uri, SHA-1) tuples.'''
+    filename = _cache_filename(config, uri)
+    try:
+        fileutils.mkdir_with_parents(os.path.dirname(filename))
+        writer = fileutils.SafeWriter(filename)
+    except (IOError, OSError) as e:
+        logging.debug('cannot write moduleset cache for %s: %s', uri, e)
+        return
+    try:
+        pickler = cPickle.Pickler(writer.fp, cPickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda obj: (_CONFIG_ID if obj is config
+                                             else None)
+        pickler.dump((CACHE_VERSION, uri, _config_key(config), _code_key()))
+        pickler.dump(sources)
+        pickler.dump(data)
+    except Exception as e:
+        logging.debug('cannot write moduleset cache for %s: %s', uri, e)
+        writer.abandon()
+        return
+    writer.commit()
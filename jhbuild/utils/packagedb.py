@@ -22,6 +22,8 @@ import sys
 import time
 import logging
 import errno
+import cPickle
+import threading
 import xml.dom.minidom as DOM
 import json
 try:
@@ -34,8 +36,15 @@ try:
 except ImportError:
     import elementtree.ElementTree as ET
 
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
 from StringIO import StringIO
 
+from jhbuild.errors import FatalError
+from jhbuild.utils import debugstore
 from jhbuild.utils import fileutils
 
 def _parse_isotime(string):
@@ -47,6 +56,16 @@ def _parse_isotime(string):
 def _format_isotime(tm):
     return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(tm))
 
+def _stat_key(st):
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+def _owner_names(value):
+    if value is None:
+        return []
+    if isinstance(value, tuple):
+        return list(value)
+    return [value]
+
 class PackageEntry:
     def __init__(self, package, version, metadata, dirname):
         self.package = package # string
@@ -228,32 +247,227 @@ class PackageEntry:
         # it seems not to exist...
         return None
 
+class SQLitePackageEntry(PackageEntry):
+    '''Entry of a SQLitePackageDB; the manifest is only read when used.'''
+
+    def __init__(self, package, version, metadata, db):
+        PackageEntry.__init__(self, package, version, metadata, db.dirname)
+        self.db = db
+        self._has_manifest = True
+
+    def get_manifest(self):
+        if self._manifest is None and self._has_manifest:
+            self._manifest = self.db._read_manifest(self.package)
+        return self._manifest
+
+    manifest = property(get_manifest, PackageEntry.set_manifest)
+
+    def get_systemdependencies(self):
+        return self._systemdependencies or []
+
+    systemdependencies = property(get_systemdependencies,
+                                  PackageEntry.set_systemdependencies)
+
+    def get_branch(self):
+        return self._branch or {}
+
+    branch = property(get_branch, PackageEntry.set_branch)
+
+    def write(self):
+        self.db._write_entries([self])
+
+    def remove(self):
+        self.db._remove_entry(self.package)
+
 class PackageDB:
+    # increase when the format of the owners index changes
+    OWNERS_VERSION = 1
+
     def __init__(self, dbfile, config):
         self.dirname = os.path.dirname(dbfile)
         self.config = config
+        # package name -> (stat key of the info file, PackageEntry)
+        self._cache = {}
+        # path relative to the prefix -> name of the package that installed
+        # it, or tuple of names if several did
+        self._owners = None
+        # package name -> stat key of the info file the owners are from
+        self._owners_signature = None
+        self._owners_lock = threading.Lock()
 
     def get(self, package):
         '''Return entry if package is installed, otherwise return None.'''
-        return PackageEntry.open(self.dirname, package)
+        try:
+            st = os.stat(os.path.join(self.dirname, 'info', package))
+        except OSError:
+            self._cache.pop(package, None)
+            return PackageEntry.open(self.dirname, package)
+        # the info file is written again, under a new inode, whenever any
+        # file of the entry changes
+        key = _stat_key(st)
+        cached = self._cache.get(package)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        entry = PackageEntry.open(self.dirname, package)
+        if entry is not None:
+            self._cache[package] = (key, entry)
+        return entry
+
+    def _create_entry(self, package, version, metadata):
+        return PackageEntry(package, version, metadata, self.dirname)
+
+    def _owner_key(self, path):
+        '''Return how path is looked up in the owners index: relative to
+        the prefix, as unicode and without trailing separator.'''
+        if isinstance(path, str):
+            path = path.decode('utf-8', 'replace')
+        prefix = self.config.prefix.rstrip(os.sep) + os.sep
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+        return path.rstrip(os.sep)
+
+    def _add_owners(self, owners, package, manifest):
+        for path in manifest:
+            key = self._owner_key(path)
+            value = owners.get(key)
+            if value is None:
+                owners[key] = package
+            elif package not in _owner_names(value):
+                owners[key] = tuple(_owner_names(value) + [package])
+
+    def _remove_owners(self, owners, package, manifest):
+        for path in manifest:
+            key = self._owner_key(path)
+            names = _owner_names(owners.get(key))
+            if package not in names:
+                continue
+            names.remove(package)
+            if not names:
+                del owners[key]
+            elif len(names) == 1:
+                owners[key] = names[0]
+            else:
+                owners[key] = tuple(names)
+
+    def _load_owners(self):
+        '''Return the owners index, updated from the manifests that changed
+        since it was saved.'''
+        with self._owners_lock:
+            if self._owners is not None:
+                return self._owners
+            signature = {}
+            try:
+                packages = os.listdir(os.path.join(self.dirname, 'info'))
+            except OSError:
+                packages = []
+            for package in packages:
+                try:
+                    signature[package] = _stat_key(
+                            os.stat(os.path.join(self.dirname, 'info', package)))
+                except OSError:
+                    pass
+
+            filename = os.path.join(self.dirname, 'owners.pickle')
+            owners, saved_signature = {}, {}
+            try:
+                fp = open(filename, 'rb')
+                try:
+                    header, data = cPickle.load(fp)
+                finally:
+                    fp.close()
+                if header == (self.OWNERS_VERSION, self.config.prefix):
+                    saved_signature, owners = data
+            except Exception as e:
+                if not isinstance(e, EnvironmentError) or e.errno != errno.ENOENT:
+                    logging.debug('ignoring owners index %s: %s', filename, e)
+
+            changed = set([package for package in set(signature) | set(saved_signature)
+                           if signature.get(package) != saved_signature.get(package)])
+            if changed:
+                if saved_signature:
+                    for key, value in owners.items():
+                        names = [x for x in _owner_names(value) if x not in changed]
+                        if not names:
+                            del owners[key]
+                        elif len(names) == 1:
+                            owners[key] = names[0]
+                        elif len(names) != len(_owner_names(value)):
+                            owners[key] = tuple(names)
+                for package in sorted(changed):
+                    if package not in signature:
+                        continue
+                    entry = PackageEntry.open(self.dirname, package)
+                    if entry is not None and entry.manifest:
+                        self._add_owners(owners, package, entry.manifest)
+                try:
+                    writer = fileutils.SafeWriter(filename)
+                    cPickle.dump(((self.OWNERS_VERSION, self.config.prefix),
+                                  (signature, owners)),
+                                 writer.fp, cPickle.HIGHEST_PROTOCOL)
+                    writer.commit()
+                except EnvironmentError as e:
+                    logging.debug('cannot write owners index %s: %s', filename, e)
+
+            self._owners_signature = signature
+            self._owners = owners
+            return owners
+
+    def _update_owners(self, package, old_manifest, new_manifest):
+        with self._owners_lock:
+            if self._owners is None:
+                # updated from the info files when loaded
+                return
+            self._remove_owners(self._owners, package, old_manifest or [])
+            try:
+                self._owners_signature[package] = _stat_key(
+                        os.stat(os.path.join(self.dirname, 'info', package)))
+            except OSError:
+                self._owners_signature.pop(package, None)
+            else:
+                self._add_owners(self._owners, package, new_manifest or [])
+
+    def owners(self, path):
+        '''Return the names of the packages that installed path.'''
+        return sorted(_owner_names(self._load_owners().get(self._owner_key(path))))
+
+    def collisions(self, package, contents):
+        '''Return a list of (path, packages) tuples for the files of contents
+        that were already installed by other packages than package.'''
+        owners = self._load_owners()
+        result = []
+        for path in contents:
+            if path.endswith(os.sep):
+                # empty directories can be shared
+                continue
+            names = [x for x in _owner_names(owners.get(self._owner_key(path)))
+                     if x != package]
+            if names:
+                result.append((path, sorted(names)))
+        return result
 
     def add(self, package, version, contents, configure_cmd = None, systemdependencies = None, branch = None, module_hash = None):
         '''Add a module to the install cache.'''
         entry = self.get(package)
         if entry:
-            metadata = entry.metadata
+            metadata = entry.metadata.copy()
         else:
             metadata = {}
+        if entry and self._owners is not None:
+            previous_contents = entry.manifest
+        else:
+            previous_contents = None
         metadata['installed-date'] = time.time() # now
         if configure_cmd:
             metadata['configure-hash'] = hashlib.md5(configure_cmd).hexdigest()
         if module_hash:
             metadata['module-hash'] = module_hash
-        pkg = PackageEntry(package, version, metadata, self.dirname)
+        pkg = self._create_entry(package, version, metadata)
         pkg.manifest = contents
         pkg.systemdependencies = systemdependencies or []
         pkg.branch = branch or {}
         pkg.write()
+        self._cache.pop(package, None)
+        self._update_owners(package, previous_contents, contents)
 
     def check(self, package, version=None, module_hash=None):
         '''Check whether a particular module is installed.'''
@@ -292,6 +506,8 @@ class PackageDB:
         # may try to remove the user's ~ or something
         # (presumably we'd fail, but better not to try)
         to_delete = fileutils.filter_files_by_prefix(self.config, entry.manifest)
+        if self.config.debug_store == 'build-id':
+            to_delete = debugstore.filter_shared(self, package_name, to_delete)
 
         # Don't warn on non-empty directories; we want to allow multiple
         # modules to share the same directory.  We could improve this by
@@ -306,3 +522,204 @@ class PackageDB:
                                                                          'msg': error_string})
 
         entry.remove()
+        self._cache.pop(package_name, None)
+        self._update_owners(package_name, entry.manifest, None)
+
+class SQLitePackageDB(PackageDB):
+    '''Registry of installed packages kept in a single SQLite database.
+
+    The status of all packages is read with a single query the first time it
+    is needed; manifests are only read for the packages whose files are
+    used, and can be looked up by path.  When the database is created, the
+    entries of the file based registry of the same directory are imported.
+    '''
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, dbfile, config):
+        PackageDB.__init__(self, dbfile, config)
+        self.dbfile = dbfile
+        self._connection = None
+        self._entries = None
+        # the connection is shared by the threads building modules
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        if sqlite3 is None:
+            raise FatalError(_('the sqlite3 Python module is required by the '
+                               'sqlite package database backend'))
+        fileutils.mkdir_with_parents(self.dirname)
+        connection = sqlite3.connect(self.dbfile, check_same_thread=False)
+        schema_version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if schema_version == 0:
+            with connection:
+                connection.executescript('''
+                    CREATE TABLE packages (
+                        package TEXT PRIMARY KEY,
+                        version TEXT NOT NULL,
+                        installed_date REAL,
+                        configure_hash TEXT,
+                        module_hash TEXT,
+                        branch TEXT,
+                        sysdeps TEXT,
+                        has_manifest INTEGER NOT NULL);
+                    CREATE TABLE files (
+                        package TEXT NOT NULL,
+                        path TEXT NOT NULL);
+                    CREATE INDEX files_package ON files (package);
+                    CREATE INDEX files_path ON files (path);
+                    PRAGMA user_version = %d;
+                    ''' % self.SCHEMA_VERSION)
+            self._connection = connection
+            try:
+                self.import_directory(self.dirname)
+            except:
+                # retry the import next time
+                self._connection = None
+                connection.close()
+                fileutils.ensure_unlinked(self.dbfile)
+                raise
+        elif schema_version != self.SCHEMA_VERSION:
+            connection.close()
+            raise FatalError(_('unsupported version of package database %s')
+                             % self.dbfile)
+        self._connection = connection
+        return connection
+
+    def _load_entries(self):
+        with self._lock:
+            if self._entries is not None:
+                return self._entries
+            entries = {}
+            cursor = self._connect().execute(
+                'SELECT package, version, installed_date, configure_hash, '
+                'module_hash, branch, sysdeps, has_manifest FROM packages')
+            for row in cursor:
+                (package, version, installed_date, configure_hash,
+                 module_hash, branch, sysdeps, has_manifest) = row
+                metadata = {}
+                if installed_date is not None:
+                    metadata['installed-date'] = installed_date
+                if configure_hash:
+                    metadata['configure-hash'] = configure_hash
+                if module_hash:
+                    metadata['module-hash'] = module_hash
+                entry = SQLitePackageEntry(package, version, metadata, self)
+                entry.branch = json.loads(branch) if branch else {}
+                entry.systemdependencies = [
+                    (dep_type, value,
+                     [(dep_type2, value2, []) for dep_type2, value2, x in altdeps])
+                    for dep_type, value, altdeps in json.loads(sysdeps or '[]')]
+                entry._has_manifest = bool(has_manifest)
+                entries[package] = entry
+            self._entries = entries
+            return entries
+
+    def get(self, package):
+        '''Return entry if package is installed, otherwise return None.'''
+        return self._load_entries().get(package)
+
+    def _create_entry(self, package, version, metadata):
+        return SQLitePackageEntry(package, version, metadata, self)
+
+    def _read_manifest(self, package):
+        with self._lock:
+            cursor = self._connect().execute(
+                'SELECT path FROM files WHERE package = ? ORDER BY rowid',
+                (package,))
+            return [path for (path,) in cursor]
+
+    def _write_entries(self, entries):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                for entry in entries:
+                    metadata = entry.metadata
+                    manifest = entry.manifest
+                    connection.execute(
+                        'INSERT OR REPLACE INTO packages VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?, ?)',
+                        (entry.package, entry.version,
+                         metadata.get('installed-date'),
+                         metadata.get('configure-hash'),
+                         metadata.get('module-hash'),
+                         json.dumps(entry.branch, sort_keys=True),
+                         json.dumps(entry.systemdependencies),
+                         manifest is not None))
+                    connection.execute('DELETE FROM files WHERE package = ?',
+                                       (entry.package,))
+                    if manifest:
+                        connection.executemany(
+                            'INSERT INTO files VALUES (?, ?)',
+                            [(entry.package,
+                              path.decode('utf-8', 'replace')
+                              if isinstance(path, str) else path)
+                             for path in manifest])
+            if self._entries is not None:
+                for entry in entries:
+                    if isinstance(entry, SQLitePackageEntry):
+                        entry._has_manifest = entry.manifest is not None
+                    else:
+                        entry = self._create_entry(entry.package, entry.version,
+                                                   entry.metadata)
+                    self._entries[entry.package] = entry
+
+    def _remove_entry(self, package):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('DELETE FROM packages WHERE package = ?',
+                                   (package,))
+                connection.execute('DELETE FROM files WHERE package = ?',
+                                   (package,))
+            if self._entries is not None:
+                self._entries.pop(package, None)
+
+    def _find_owners(self, path):
+        # manifests have paths relative to the prefix, with a trailing
+        # separator for directories; old ones have absolute paths
+        key = self._owner_key(path)
+        absolute = os.path.join(self.config.prefix, key)
+        return self._connect().execute(
+            'SELECT DISTINCT package FROM files WHERE path IN (?, ?, ?, ?) '
+            'ORDER BY package', (key, key + os.sep, absolute, absolute + os.sep))
+
+    def owners(self, path):
+        '''Return the names of the packages that installed path.'''
+        with self._lock:
+            return [package for (package,) in self._find_owners(path)]
+
+    def collisions(self, package, contents):
+        '''Return a list of (path, packages) tuples for the files of contents
+        that were already installed by other packages than package.'''
+        result = []
+        with self._lock:
+            for path in contents:
+                if path.endswith(os.sep):
+                    continue
+                names = [x for (x,) in self._find_owners(path) if x != package]
+                if names:
+                    result.append((path, names))
+        return result
+
+    def import_directory(self, dirname):
+        '''Import the entries of the file based registry kept in dirname,
+        and return how many were imported.'''
+        packages = set()
+        for subdir in ('info', 'manifests'):
+            try:
+                packages.update(os.listdir(os.path.join(dirname, subdir)))
+            except OSError:
+                pass
+        entries = []
+        for package in sorted(packages):
+            entry = PackageEntry.open(dirname, package)
+            if entry is not None:
+                entries.append(entry)
+        if entries:
+            self._write_entries(entries)
+            logging.info(_('imported %d packages into %s') %
+                         (len(entries), self.dbfile))
+        return len(entries)
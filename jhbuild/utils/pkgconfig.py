@@ -0,0 +1,239 @@
+# jhbuild - a tool to ease building collections of source packages
+#
+#   pkgconfig.py: reading of pkg-config .pc files
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Reading of pkg-config .pc files, to know the installed packages and
+their versions without running pkg-config for each of them.
+
+The files of the directories of the pkg-config search path are parsed
+once and indexed by directory, with the modification time of the
+directory.  The index is saved to a file, and a directory is only read
+again when it changed, so that a warm run costs a stat() per directory.
+'''
+
+import os
+import re
+import errno
+import logging
+import cPickle
+import subprocess
+
+from jhbuild.utils import fileutils
+
+__all__ = ['PcFile', 'parse', 'PkgConfigIndex']
+
+# increase when the format of the index changes
+INDEX_VERSION = 1
+
+_line_re = re.compile(r'^([A-Za-z0-9_.]+)\s*([:=])\s*(.*)$')
+_variable_re = re.compile(r'\$\$|\$\{([^}]*)\}')
+
+
+class PcFile(object):
+    '''A .pc file: variables maps the names of its variables to their
+    values, and fields the keywords (Name, Version, Requires...) to theirs,
+    with the variables substituted.'''
+
+    def __init__(self, name, filename):
+        self.name = name
+        self.filename = filename
+        self.variables = {}
+        self.fields = {}
+
+    @property
+    def version(self):
+        return self.fields.get('Version', '')
+
+    def __repr__(self):
+        return '<PcFile %s>' % self.name
+
+
+def _substitute(value, variables):
+    def replace(match):
+        if match.group(1) is None:
+            return '$'
+        return variables.get(match.group(1), '')
+    return _variable_re.sub(replace, value)
+
+
+def _predefined_variables(filename):
+    return {'pcfiledir': os.path.dirname(filename),
+            'pc_sysrootdir': os.environ.get('PKG_CONFIG_SYSROOT_DIR') or '/',
+            'pc_top_builddir': os.environ.get('PKG_CONFIG_TOP_BUILD_DIR',
+                                              '$(top_builddir)')}
+
+
+def parse(filename):
+    '''Return the PcFile of filename, or None if it cannot be read.
+
+    Lines are read as pkg-config does: comments start with #, a backslash
+    at the end of a line continues it, and variables are substituted when
+    they are defined.'''
+    try:
+        data = open(filename).read()
+    except IOError:
+        return None
+    name = os.path.basename(filename)[:-len('.pc')]
+    pc = PcFile(name, filename)
+    variables = _predefined_variables(filename)
+    for line in data.replace('\\\n', '').splitlines():
+        pos = line.find('#')
+        while pos != -1 and pos > 0 and line[pos-1] == '\\':
+            line = line[:pos-1] + line[pos:]
+            pos = line.find('#', pos)
+        if pos != -1:
+            line = line[:pos]
+        match = _line_re.match(line.strip())
+        if match is None:
+            continue
+        key, operator, value = match.groups()
+        value = _substitute(value.strip(), variables)
+        if operator == '=':
+            variables[key] = value
+            pc.variables[key] = value
+        elif key not in pc.fields:
+            pc.fields[key] = value
+    return pc
+
+
+def _stat_key(st):
+    return (st.st_mtime, st.st_ino, st.st_dev)
+
+
+def _find_program(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        filename = os.path.join(directory, name)
+        if os.path.isfile(filename) and os.access(filename, os.X_OK):
+            return filename
+    return None
+
+
+class PkgConfigIndex(object):
+    '''The .pc files of the directories of the pkg-config search path,
+    saved to filename, if given, by save().'''
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        # (pkg-config executable, its stat key, its default search path)
+        self._pc_path = None
+        # directory -> (stat key, {name: PcFile})
+        self._directories = {}
+        self._changed = False
+        if filename is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            fp = open(self.filename, 'rb')
+            try:
+                version, pc_path, directories = cPickle.load(fp)
+            finally:
+                fp.close()
+        except Exception as e:
+            if not isinstance(e, EnvironmentError) or e.errno != errno.ENOENT:
+                logging.debug('ignoring pkg-config index %s: %s', self.filename, e)
+            return
+        if version == INDEX_VERSION:
+            self._pc_path = pc_path
+            self._directories = directories
+
+    def save(self):
+        '''Write the index to its file, if it changed.'''
+        if self.filename is None or not self._changed:
+            return
+        try:
+            fileutils.mkdir_with_parents(os.path.dirname(self.filename))
+            writer = fileutils.SafeWriter(self.filename)
+            cPickle.dump((INDEX_VERSION, self._pc_path, self._directories),
+                         writer.fp, cPickle.HIGHEST_PROTOCOL)
+            writer.commit()
+        except EnvironmentError as e:
+            logging.debug('cannot write pkg-config index %s: %s', self.filename, e)
+            return
+        self._changed = False
+
+    def _default_path(self, program):
+        '''Return the directories pkg-config searches by default, as
+        reported by pkg-config itself, once for each of its versions.'''
+        try:
+            key = _stat_key(os.stat(program))
+        except OSError:
+            return []
+        if self._pc_path is not None and self._pc_path[:2] == (program, key):
+            return self._pc_path[2]
+        try:
+            output = subprocess.check_output(
+                    [program, '--variable', 'pc_path', 'pkg-config'],
+                    close_fds=True)
+        except (subprocess.CalledProcessError, OSError):
+            return []
+        pc_path = [x for x in output.strip().split(os.pathsep) if x]
+        self._pc_path = (program, key, pc_path)
+        self._changed = True
+        return pc_path
+
+    def get_search_path(self):
+        '''Return the directories where pkg-config looks for .pc files, in
+        order, or None if pkg-config is not installed.'''
+        program = _find_program('pkg-config')
+        if program is None:
+            return None
+        search_path = [x for x in os.environ.get('PKG_CONFIG_PATH', '').split(
+                os.pathsep) if x]
+        libdir = os.environ.get('PKG_CONFIG_LIBDIR')
+        if libdir is not None:
+            search_path.extend([x for x in libdir.split(os.pathsep) if x])
+        else:
+            search_path.extend(self._default_path(program))
+        return search_path
+
+    def _read_directory(self, directory):
+        try:
+            key = _stat_key(os.stat(directory))
+        except OSError:
+            if directory in self._directories:
+                del self._directories[directory]
+                self._changed = True
+            return {}
+        entry = self._directories.get(directory)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        packages = {}
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith('.pc'):
+                continue
+            pc = parse(os.path.join(directory, name))
+            if pc is not None:
+                packages[pc.name] = pc
+        self._directories[directory] = (key, packages)
+        self._changed = True
+        return packages
+
+    def get_packages(self, search_path):
+        '''Return a dictionary mapping the names of the packages found in
+        the directories of search_path to their PcFile.  The first
+        directory with a package wins, as with pkg-config.'''
+        result = {}
+        for directory in search_path:
+            for name, pc in self._read_directory(directory).iteritems():
+                if name not in result:
+                    result[name] = pc
+        return result
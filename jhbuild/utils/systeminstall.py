@@ -18,6 +18,7 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import os
+import re
 import sys 
 import logging
 import shlex
@@ -25,44 +26,30 @@ import subprocess
 import pipes
 import imp
 import time
+import urllib
 from StringIO import StringIO
+try:
+    import xml.etree.ElementTree as ET
+except ImportError:
+    import elementtree.ElementTree as ET
 
 import cmds
+from jhbuild.utils import dpkg
+from jhbuild.utils import pkgconfig
 
 def get_installed_pkgconfigs(config):
     """Returns a dictionary mapping pkg-config names to their current versions on the system."""
-    pkgversions = {}
-    try:
-        proc = subprocess.Popen(['pkg-config', '--list-all'], stdout=subprocess.PIPE, close_fds=True)
-        stdout = proc.communicate()[0]
-        proc.wait()
-        pkgs = []
-        for line in StringIO(stdout):
-            pkg, rest = line.split(None, 1)
-            pkgs.append(pkg)
-
-        # see if we can get the versions "the easy way"
-        try:
-            stdout = subprocess.check_output(['pkg-config', '--modversion'] + pkgs)
-            versions = stdout.splitlines()
-            if len(versions) == len(pkgs):
-                return dict(zip(pkgs, versions))
-        except (subprocess.CalledProcessError, OSError):
-            pass
-
-        # We have to rather inefficiently repeatedly fork to work around
-        # broken pkg-config installations - if any package has a missing
-        # dependency pkg-config will fail entirely.
-        for pkg in pkgs:
-            args = ['pkg-config', '--modversion']
-            args.append(pkg)
-            proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
-            stdout = proc.communicate()[0]
-            proc.wait()
-            pkgversions[pkg] = stdout.strip()
-    except (subprocess.CalledProcessError, OSError): # pkg-config not installed
-        pass
-    return pkgversions
+    # the .pc files are read directly rather than with pkg-config, and
+    # indexed by directory so that only the directories that changed since
+    # the last run are read again
+    index = pkgconfig.PkgConfigIndex(os.path.join(config.top_builddir,
+                                                  'pkgconfig.pickle'))
+    search_path = index.get_search_path()
+    if search_path is None: # pkg-config not installed
+        return {}
+    packages = index.get_packages(search_path)
+    index.save()
+    return dict((name, pc.version) for name, pc in packages.iteritems())
 
 def get_uninstalled_pkgconfigs(uninstalled):
     uninstalled_pkgconfigs = []
@@ -96,117 +83,280 @@ def get_uninstalled_filenames(uninstalled):
             uninstalled_filenames.append((module_name, os.path.join('/usr/include', value)))
     return uninstalled_filenames
 
-def systemdependencies_met(module_name, sysdeps, config):
-    '''Returns True of the system dependencies are met for module_name'''
-    def get_c_include_search_paths(config):
-        '''returns a list of C include paths (-I) from the environment and the
-        user's config'''
-        def extract_path_from_cflags(args):
-            '''extract the C include paths (-I) from a list of arguments (args)
-            Returns a list of paths'''
-            itr = iter(args.split())
-            paths = []
-            if os.name == 'nt':
-                # shlex.split doesn't handle sep '\' on Windows
-                import string
-                shell_split = string.split
-            else:
-                shell_split = shlex.split
-            try:
-                while True:
-                    arg = itr.next()
-                    if arg.strip() in ['-I', '-isystem']:
-                        # extract paths handling quotes and multiple paths
-                        paths += shell_split(itr.next())[0].split(os.pathsep)
-                    elif arg.startswith('-I'):
-                        paths += shell_split(arg[2:])[0].split(os.pathsep)
-            except StopIteration:
-                pass
-            return paths
+def _extract_path_from_cflags(args):
+    '''extract the C include paths (-I) from a list of arguments (args)
+    Returns a list of paths'''
+    itr = iter(args.split())
+    paths = []
+    if os.name == 'nt':
+        # shlex.split doesn't handle sep '\' on Windows
+        import string
+        shell_split = string.split
+    else:
+        shell_split = shlex.split
+    try:
+        while True:
+            arg = itr.next()
+            if arg.strip() in ['-I', '-isystem']:
+                # extract paths handling quotes and multiple paths
+                paths += shell_split(itr.next())[0].split(os.pathsep)
+            elif arg.startswith('-I'):
+                paths += shell_split(arg[2:])[0].split(os.pathsep)
+    except StopIteration:
+        pass
+    return paths
+
+def _is_uri(value):
+    # what is not a valid URI, such as a string with spaces, is looked up
+    # as a public identifier by xmlcatalog
+    return re.match(r'^[^\s"<>\\^`{|}]*$', value) is not None
+
+class XmlCatalog(object):
+    '''The entries of an XML catalog file, and of the catalogs it
+    delegates to or chains to, read once to resolve public identifiers,
+    system identifiers and URIs as xmlcatalog(1) does.
+
+    The entries which are not read, such as systemSuffix and uriSuffix,
+    are left to xmlcatalog when an identifier is not found.'''
+
+    # element: (kind of identifier, attribute)
+    _entries = {'public': ('public', 'publicId'),
+                'system': ('system', 'systemId'),
+                'uri': ('uri', 'name')}
+    _prefixes = {'rewriteSystem': ('system', 'systemIdStartString'),
+                 'rewriteURI': ('uri', 'uriStartString')}
+    _delegates = {'delegatePublic': ('public', 'publicIdStartString'),
+                  'delegateSystem': ('system', 'systemIdStartString'),
+                  'delegateURI': ('uri', 'uriStartString')}
+
+    def __init__(self, filename, catalogs=None):
+        if catalogs is None:
+            catalogs = {}
+        catalogs[filename] = self
+        self.filename = filename
+        kinds = ('public', 'system', 'uri')
+        self.entries = dict((kind, set()) for kind in kinds)
+        self.prefixes = dict((kind, []) for kind in kinds)
+        self.delegates = dict((kind, []) for kind in kinds)
+        self.next_catalogs = []
+        root = ET.parse(filename).getroot()
+        if not root.tag.endswith('}catalog'):
+            raise ValueError('%s is not an XML catalog' % filename)
+        for node in root.getiterator():
+            tag = node.tag.split('}')[-1]
+            if tag in self._entries:
+                kind, attr = self._entries[tag]
+                self.entries[kind].add(node.get(attr))
+            elif tag in self._prefixes:
+                kind, attr = self._prefixes[tag]
+                self.prefixes[kind].append(node.get(attr))
+            elif tag in self._delegates or tag == 'nextCatalog':
+                catalog = self._open(filename, node.get('catalog'), catalogs)
+                if catalog is None:
+                    continue
+                if tag == 'nextCatalog':
+                    self.next_catalogs.append(catalog)
+                else:
+                    kind, attr = self._delegates[tag]
+                    self.delegates[kind].append((node.get(attr), catalog))
+
+    def _open(self, filename, uri, catalogs):
+        if not uri:
+            return None
+        if uri.startswith('file://'):
+            path = urllib.unquote(uri[len('file://'):])
+        elif ':' in uri.split('/')[0]:
+            # only local catalogs are read
+            return None
+        else:
+            path = os.path.join(os.path.dirname(filename), urllib.unquote(uri))
+        if path in catalogs:
+            return catalogs[path]
         try:
-            multiarch = subprocess.check_output(['gcc', '-print-multiarch']).strip()
-        except:
-            multiarch = None
-        # search /usr/include and its multiarch subdir (if any) by default
-        paths = [ os.path.join(os.sep, 'usr', 'include')]
-        if multiarch:
-            paths += [ os.path.join(paths[0], multiarch) ]
-        paths += extract_path_from_cflags(os.environ.get('CPPFLAGS', ''))
-        # check include paths incorrectly configured in CFLAGS, CXXFLAGS
-        paths += extract_path_from_cflags(os.environ.get('CFLAGS', ''))
-        paths += extract_path_from_cflags(os.environ.get('CXXFLAGS', ''))
-        # check include paths incorrectly configured in makeargs
-        paths += extract_path_from_cflags(config.makeargs)
-        paths += extract_path_from_cflags(config.module_autogenargs.get
-                                             (module_name, ''))
-        paths += extract_path_from_cflags(config.module_makeargs.get
-                                             (module_name, ''))
-        paths += os.environ.get('C_INCLUDE_PATH', '').split(':')
-        paths += os.environ.get('CPLUS_INCLUDE_PATH', '').split(':')
-        paths = list(set(paths)) # remove duplicates
-        return paths
-
-    c_include_search_paths = None
-    for dep_type, value, altdeps in sysdeps:
-        dep_met = True
-        if dep_type.lower() == 'path':
-            if os.path.split(value)[0]:
-                if not os.path.isfile(value) and not os.access(value, os.X_OK):
-                    dep_met = False
+            return XmlCatalog(path, catalogs)
+        except (EnvironmentError, SyntaxError, ValueError):
+            catalogs[path] = None
+            return None
+
+    def _resolve(self, value, kind, seen):
+        if self in seen:
+            return False
+        seen.add(self)
+        if value in self.entries[kind]:
+            return True
+        for prefix in self.prefixes[kind]:
+            if prefix and value.startswith(prefix):
+                return True
+        matching = [catalog for prefix, catalog in self.delegates[kind]
+                    if prefix and value.startswith(prefix)]
+        if matching:
+            # the delegated catalogs replace the rest of this one
+            return any(catalog._resolve(value, kind, seen)
+                       for catalog in matching)
+        return any(catalog._resolve(value, kind, seen)
+                   for catalog in self.next_catalogs)
+
+    def resolve(self, value):
+        '''Return whether value, a public identifier, a system identifier
+        or a URI, has an entry in the catalog.'''
+        if _is_uri(value):
+            # like xmlcatalog, look for a URI entry when there is no system
+            # entry
+            return (self._resolve(value, 'system', set()) or
+                    self._resolve(value, 'uri', set()))
+        return self._resolve(value, 'public', set())
+
+class SystemDependencyChecker(object):
+    '''Checks the system dependencies of modules.
+
+    The directories of PATH and the C include directories are listed once,
+    and the XML catalog is read once, the first time they are needed, so
+    that the dependencies of all the modules are evaluated with a few
+    system calls and without running gcc or xmlcatalog for each of them.'''
+
+    def __init__(self, config):
+        self.config = config
+        self._listings = {}
+        self._c_include_search_paths = None
+        self._xml_catalog = None
+        self._python_modules = {}
+
+    def _listdir(self, directory):
+        '''Return the set of the names in directory, listed once.'''
+        directory = directory or os.curdir
+        try:
+            return self._listings[directory]
+        except KeyError:
+            try:
+                names = set(os.listdir(directory))
+            except OSError:
+                names = set()
+            self._listings[directory] = names
+            return names
+
+    def _find_file(self, directories, value, executable=False):
+        dirname, basename = os.path.split(value)
+        for path in directories:
+            if dirname:
+                directory = os.path.join(path, dirname)
             else:
-                pathdirs = set(os.environ.get('PATH', '').split(os.pathsep))
-                pathdirs.update(['/sbin', '/usr/sbin'])
-                for path in pathdirs:
-                    filename = os.path.join(path, value)
-                    if os.path.isfile(filename) and os.access(filename, os.X_OK):
-                        break
-                else:
-                    dep_met = False
-        elif dep_type.lower() == 'c_include':
-            if c_include_search_paths is None:
-                c_include_search_paths = get_c_include_search_paths(config)
-            found = False
-            for path in c_include_search_paths:
-                filename = os.path.join(path, value)
-                if os.path.isfile(filename):
-                    found = True
-                    break
-            if not found:
-                dep_met = False
+                directory = path
+            if basename not in self._listdir(directory):
+                continue
+            filename = os.path.join(directory, basename)
+            if os.path.isfile(filename) and (not executable or
+                                             os.access(filename, os.X_OK)):
+                return True
+        return False
 
-        elif dep_type == 'python2':
+    def _get_path_dirs(self):
+        pathdirs = set(os.environ.get('PATH', '').split(os.pathsep))
+        pathdirs.update(['/sbin', '/usr/sbin'])
+        return pathdirs
+
+    def get_c_include_search_paths(self, module_name):
+        '''returns a list of C include paths (-I) from the environment and
+        the user's config'''
+        if self._c_include_search_paths is None:
             try:
-                imp.find_module(value)
+                multiarch = subprocess.check_output(['gcc', '-print-multiarch']).strip()
             except:
-                dep_met = False
-
-        elif dep_type == 'xml':
+                multiarch = None
+            # search /usr/include and its multiarch subdir (if any) by default
+            paths = [ os.path.join(os.sep, 'usr', 'include')]
+            if multiarch:
+                paths += [ os.path.join(paths[0], multiarch) ]
+            paths += _extract_path_from_cflags(os.environ.get('CPPFLAGS', ''))
+            # check include paths incorrectly configured in CFLAGS, CXXFLAGS
+            paths += _extract_path_from_cflags(os.environ.get('CFLAGS', ''))
+            paths += _extract_path_from_cflags(os.environ.get('CXXFLAGS', ''))
+            # check include paths incorrectly configured in makeargs
+            paths += _extract_path_from_cflags(self.config.makeargs)
+            paths += os.environ.get('C_INCLUDE_PATH', '').split(':')
+            paths += os.environ.get('CPLUS_INCLUDE_PATH', '').split(':')
+            self._c_include_search_paths = paths
+        paths = self._c_include_search_paths[:]
+        paths += _extract_path_from_cflags(self.config.module_autogenargs.get
+                                              (module_name, ''))
+        paths += _extract_path_from_cflags(self.config.module_makeargs.get
+                                              (module_name, ''))
+        return list(set(paths)) # remove duplicates
+
+    def _get_xml_catalog(self):
+        if self._xml_catalog is None:
             xml_catalog = '/etc/xml/catalog'
-
             if not os.path.exists(xml_catalog):
                 for d in os.environ['XDG_DATA_DIRS'].split(':'):
                     xml_catalog = os.path.join(d, 'xml', 'catalog')
                     if os.path.exists(xml_catalog):
                         break
-
             try:
-                # no xmlcatalog installed will (correctly) fail the check
-                subprocess.check_output(['xmlcatalog', xml_catalog, value])
-
-            except:
-                dep_met = False
+                catalog = XmlCatalog(xml_catalog)
+            except (EnvironmentError, SyntaxError, ValueError):
+                # not an XML catalog that can be read, ask xmlcatalog
+                catalog = xml_catalog
+            self._xml_catalog = catalog
+        return self._xml_catalog
+
+    def _xml_dependency_met(self, value):
+        # no xmlcatalog installed will (correctly) fail the check
+        if not self._find_file(self._get_path_dirs(), 'xmlcatalog', True):
+            return False
+        catalog = self._get_xml_catalog()
+        if isinstance(catalog, XmlCatalog):
+            if catalog.resolve(value):
+                return True
+            catalog = catalog.filename
+        try:
+            subprocess.check_output(['xmlcatalog', catalog, value])
+        except:
+            return False
+        return True
 
-        # check alternative dependencies
-        if not dep_met and altdeps:
-            for altdep in altdeps:
-                if systemdependencies_met(module_name, [ altdep ], config):
-                    dep_met = True
-                    break
+    def dependency_met(self, module_name, dep_type, value):
+        if dep_type.lower() == 'path':
+            if os.path.split(value)[0]:
+                return os.path.isfile(value) or os.access(value, os.X_OK)
+            return self._find_file(self._get_path_dirs(), value, True)
+        elif dep_type.lower() == 'c_include':
+            return self._find_file(self.get_c_include_search_paths(module_name),
+                                   value)
+        elif dep_type == 'python2':
+            if value not in self._python_modules:
+                try:
+                    imp.find_module(value)
+                    self._python_modules[value] = True
+                except:
+                    self._python_modules[value] = False
+            return self._python_modules[value]
+        elif dep_type == 'xml':
+            return self._xml_dependency_met(value)
+        return True
+
+    def dependencies_met(self, module_name, sysdeps):
+        '''Returns True if the system dependencies are met for module_name'''
+        for dep_type, value, altdeps in sysdeps:
+            dep_met = self.dependency_met(module_name, dep_type, value)
+            # check alternative dependencies
+            if not dep_met and altdeps:
+                for altdep in altdeps:
+                    if self.dependencies_met(module_name, [ altdep ]):
+                        dep_met = True
+                        break
+            if not dep_met:
+                return False
+        return True
 
-        if not dep_met:
-            return False
+    def check_modules(self, modules):
+        '''Returns a dictionary mapping the modules to whether their system
+        dependencies are met.'''
+        return dict((module, self.dependencies_met(module.name,
+                                                   module.systemdependencies))
+                    for module in modules)
 
-    return True
+def systemdependencies_met(module_name, sysdeps, config):
+    '''Returns True of the system dependencies are met for module_name'''
+    return SystemDependencyChecker(config).dependencies_met(module_name, sysdeps)
 
 class SystemInstall(object):
     def __init__(self):
@@ -395,6 +545,23 @@ class PacmanSystemInstall(SystemInstall):
 class AptSystemInstall(SystemInstall):
     def __init__(self):
         SystemInstall.__init__(self)
+        self._dpkg_index = None
+
+    def _get_installed_package_for(self, filename, exact_match):
+        if self._dpkg_index is None:
+            self._dpkg_index = dpkg.DpkgIndex(
+                    filename=dpkg.get_cache_filename())
+            self._dpkg_index.save()
+        if exact_match:
+            found = {filename: self._dpkg_index.get_owners(filename)}
+        else:
+            found = self._dpkg_index.search(['*%s*' % filename])
+        for path, packages in sorted(found.iteritems()):
+            if '/lsb3' in path or '/emscripten' in path:
+                continue
+            if packages:
+                return packages[0]
+        return None
 
     def _get_package_for(self, filename, exact_match):
         # HACK: speed up look up for path:/usr/share/doc/pkgname
@@ -403,6 +570,12 @@ class AptSystemInstall(SystemInstall):
             if '/' not in name:
                 return name
 
+        # files of installed packages are found in the dpkg database,
+        # without running apt-file
+        name = self._get_installed_package_for(filename, exact_match)
+        if name:
+            return name
+
         if exact_match:
             proc = subprocess.Popen(['apt-file', '--fixed-string', 'search', filename],
                                     stdout=subprocess.PIPE, close_fds=True)
@@ -21,6 +21,8 @@ import os
 import sys 
 import subprocess
 import re
+import sre_constants
+import sre_parse
 
 from jhbuild.utils import cmds
 
@@ -63,15 +65,21 @@ should be run."""
            if not cmds.has_command(self._executable):
                return False
        for path in files_list:
-           for r in self._rematches:
-               match = r.search(path)
-               if match:
-                   return True
-           for literal in self._literal_matches:
-               if path.find(literal) >= 0:
-                   return True
+           if self.matches_path(path):
+               return True
        return False
 
+    def matches_path(self, path):
+        """Return True if @path is matched by one of the keys of this trigger
+script, whether its executable is available or not."""
+        for r in self._rematches:
+            if r.search(path):
+                return True
+        for literal in self._literal_matches:
+            if literal in path:
+                return True
+        return False
+
     def command(self):
         """Returns the command required to execute the trigger script."""
         return ['/bin/sh', self._file]
@@ -80,11 +88,97 @@ def load_all(dirpath):
     if not os.path.isdir(dirpath):
         return []
     result = []
-    for filename in os.listdir(dirpath):
+    for filename in sorted(os.listdir(dirpath)):
         if not filename.endswith(Trigger.SUFFIX):
             continue
         filepath = os.path.join(dirpath, filename)
         p = Trigger(filepath)
         result.append(p)
     return result
-        
+
+def _required_literal(regex):
+    """Return the longest string that all the matches of @regex contain, or
+None if there is none that can be found simply."""
+    if regex.flags & (re.IGNORECASE | re.LOCALE | re.UNICODE):
+        return None
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except (re.error, RuntimeError):
+        return None
+    best = ''
+    run = []
+    for op, av in list(parsed) + [(None, None)]:
+        if op == sre_constants.LITERAL and av < 128:
+            run.append(chr(av))
+            continue
+        if len(run) > len(best):
+            best = ''.join(run)
+        run = []
+    return best or None
+
+class TriggerMatcher(object):
+    """Find the triggers matching lists of files, for all the triggers at
+    once.
+
+    The files of a list are joined into a single string, which is searched
+    once for each literal of the triggers and for the string that each of
+    their regular expressions requires; the expressions are then only
+    matched against the few files containing that string.  The executables
+    of the triggers are only looked for once they match, and remembered
+    once found."""
+
+    def __init__(self, triggers):
+        self.triggers = list(triggers)
+        self._executables = set()
+        # trigger -> (literals, [(string required by the expression, or
+        # None, compiled expression)])
+        self._keys = {}
+        for trig in self.triggers:
+            self._keys[trig] = (list(trig._literal_matches),
+                                [(_required_literal(r), r) for r in trig._rematches])
+
+    def _has_executable(self, trig):
+        if trig._executable is None or trig._executable in self._executables:
+            return True
+        # not remembered when missing, it may be installed by the build
+        if cmds.has_command(trig._executable):
+            self._executables.add(trig._executable)
+            return True
+        return False
+
+    def _search(self, regex, required, files, files_list):
+        if required is None:
+            for path in files_list:
+                if regex.search(path):
+                    return True
+            return False
+        pos = files.find(required)
+        while pos != -1:
+            start = files.rfind('\n', 0, pos) + 1
+            end = files.find('\n', pos)
+            if end == -1:
+                end = len(files)
+            if regex.search(files[start:end]):
+                return True
+            pos = files.find(required, end)
+        return False
+
+    def _matches(self, trig, files, files_list):
+        literals, regexes = self._keys[trig]
+        for literal in literals:
+            if literal in files:
+                return True
+        for required, regex in regexes:
+            if self._search(regex, required, files, files_list):
+                return True
+        return False
+
+    def matches(self, files_list):
+        """Return the list of the triggers to run for @files_list, a list
+of absolute file paths, in the order of self.triggers."""
+        try:
+            files = '\n'.join(files_list)
+        except UnicodeError:
+            return [x for x in self.triggers if x.matches(files_list)]
+        return [x for x in self.triggers
+                if self._matches(x, files, files_list) and self._has_executable(x)]
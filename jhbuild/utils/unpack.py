@@ -19,13 +19,193 @@
 
 import tarfile
 import zipfile
-import os.path
+import os
+import errno
+import shutil
 import tempfile
+import subprocess
 
 from jhbuild.utils.cmds import has_command
 from jhbuild.errors import CommandError
 from jhbuild.utils import fileutils
 
+# decompressors of tar archives, by extension; the multithreaded ones come
+# first and are used when they are installed
+_decompressors = {
+    '.gz': (['pigz', '-dc'], ['gzip', '-dc']),
+    '.bz2': (['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc'],
+             ['bunzip2', '-dc']),
+    '.xz': (['xz', '-dc', '-T0'], ['xzcat']),
+    '.lzma': (['xz', '-dc', '--format=lzma'], ['lzcat', '-d']),
+    '.zst': (['zstd', '-dc'],),
+}
+_decompressors['.tgz'] = _decompressors['.gz']
+_decompressors['.tbz2'] = _decompressors['.bz2']
+_decompressors['.txz'] = _decompressors['.xz']
+
+_found_decompressors = {}
+
+
+def get_decompressor(filename):
+    """Return the command reading the compressed tar archive filename on its
+    standard input and writing it uncompressed, [] for an uncompressed tar
+    archive, or None if the archive cannot be extracted with tar(1)."""
+    ext = os.path.splitext(filename)[-1]
+    if ext == '.tar':
+        return []
+    if ext not in _decompressors:
+        return None
+    if ext not in _found_decompressors:
+        for command in _decompressors[ext]:
+            if has_command(command[0]):
+                break
+        else:
+            command = None
+        _found_decompressors[ext] = command
+    return _found_decompressors[ext]
+
+
+def can_stream(filename):
+    """Return whether the archive filename can be extracted while it is
+    read, by an Extraction."""
+    return has_command('tar') and get_decompressor(filename) is not None
+
+
+class Extraction(object):
+    """Extraction of the tar archive filename by a decompressor and tar(1)
+    running in parallel, without a shell.
+
+    With stream=True, the data of the archive is given to write() as it is
+    received, otherwise the decompressor reads filename.  The archive is
+    extracted to a staging directory in target_directory, and finish()
+    moves its content in place, or into checkoutdir; abort() removes it."""
+
+    def __init__(self, filename, target_directory, checkoutdir=None,
+                 stream=True):
+        self.filename = filename
+        self.target_directory = target_directory
+        self.checkoutdir = checkoutdir
+        self.staging_directory = tempfile.mkdtemp(dir=target_directory)
+        self._failed = False
+        self._input = None
+        self._processes = []
+
+        if stream:
+            source = subprocess.PIPE
+        else:
+            source = open(filename, 'rb')
+        # descriptors of the parent end to close once the processes have
+        # their own copies
+        inherited = []
+        if source is not subprocess.PIPE:
+            inherited.append(source)
+        try:
+            decompressor = get_decompressor(filename)
+            if decompressor:
+                proc = subprocess.Popen(decompressor, stdin=source,
+                                        stdout=subprocess.PIPE, close_fds=True)
+                self._processes.append(proc)
+                self._input = proc.stdin
+                source = proc.stdout
+                inherited.append(source)
+            proc = subprocess.Popen(['tar', 'xf', '-'], stdin=source,
+                                    cwd=self.staging_directory, close_fds=True)
+            self._processes.append(proc)
+            if self._input is None:
+                self._input = proc.stdin
+        except OSError as e:
+            self.abort()
+            raise CommandError(_('Failed to unpack %(file)s: %(msg)s') % {
+                    'file': filename, 'msg': e})
+        finally:
+            for fp in inherited:
+                fp.close()
+
+    def write(self, data):
+        if self._failed:
+            return
+        try:
+            self._input.write(data)
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+            # tar or the decompressor stopped, finish() reports it
+            self._failed = True
+
+    def _wait(self):
+        if self._input is not None:
+            try:
+                self._input.close()
+            except IOError:
+                self._failed = True
+            self._input = None
+        for proc in self._processes:
+            if proc.wait() != 0:
+                self._failed = True
+        self._processes = []
+
+    def finish(self):
+        """Wait for the end of the extraction, and move the extracted files
+        in place.  Raises CommandError if the archive could not be
+        extracted."""
+        self._wait()
+        if self._failed:
+            self.abort()
+            raise CommandError(_('Failed to unpack %s') % self.filename)
+        _install_unpacked(self.filename, self.staging_directory,
+                          self.target_directory, self.checkoutdir)
+
+    def abort(self):
+        """Stop the extraction, and remove what was extracted."""
+        for proc in self._processes:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        try:
+            self._wait()
+        except IOError:
+            pass
+        shutil.rmtree(self.staging_directory, ignore_errors=True)
+
+
+def _move_into(source, destination):
+    """Move the content of the directory source into destination, merging
+    it with the directories that already exist there, as tar(1) would."""
+    for name in os.listdir(source):
+        src = os.path.join(source, name)
+        dest = os.path.join(destination, name)
+        if os.path.isdir(dest) and not os.path.islink(dest) and \
+                os.path.isdir(src) and not os.path.islink(src):
+            _move_into(src, dest)
+        else:
+            if os.path.lexists(dest) and not os.path.isdir(dest):
+                os.remove(dest)
+            fileutils.rename(src, dest)
+    os.rmdir(source)
+
+
+def _install_unpacked(localfile, staging_directory, target_directory,
+                      checkoutdir):
+    """Move the files unpacked in staging_directory to target_directory,
+    or to the checkoutdir directory of target_directory."""
+    if not checkoutdir:
+        _move_into(staging_directory, target_directory)
+        return
+    names = os.listdir(staging_directory)
+    if len(names) == 0:
+        shutil.rmtree(staging_directory, ignore_errors=True)
+        raise CommandError(_('Failed to unpack %s (empty file?)') % localfile)
+    if len(names) == 1:
+        # a single directory, just move it
+        fileutils.rename(os.path.join(staging_directory, names[0]),
+                         os.path.join(target_directory, checkoutdir))
+        os.rmdir(staging_directory)
+    else:
+        # more files, just rename the staging directory to the final name
+        fileutils.rename(staging_directory,
+                         os.path.join(target_directory, checkoutdir))
+
 
 def unpack_tar_file(localfile, target_directory):
     pkg = tarfile.open(localfile, 'r|*')
@@ -115,24 +295,18 @@ def unpack_archive(buildscript, localfile, target_directory, checkoutdir=None):
     Unpack @localfile to @target_directory; if @checkoutdir is specified make
     sure the unpacked content gets into a directory by that name
     """
+    ext = os.path.splitext(localfile)[-1]
+    if can_stream(localfile):
+        extraction = Extraction(localfile, target_directory, checkoutdir,
+                                stream=False)
+        extraction.finish()
+        return
+
     if checkoutdir:
         final_target_directory = target_directory
         target_directory = tempfile.mkdtemp(dir=final_target_directory)
 
-    ext = os.path.splitext(localfile)[-1]
-    if ext == '.lzma' and has_command('lzcat') and has_command('tar'):
-        buildscript.execute('lzcat -d "%s" | tar xf -' % localfile,
-                cwd=target_directory)
-    elif ext == '.xz' and has_command('xzcat') and has_command('tar'):
-        buildscript.execute('xzcat -d "%s" | tar xf -' % localfile,
-                cwd=target_directory)
-    elif ext == '.bz2' and has_command('bunzip2') and has_command('tar'):
-        buildscript.execute('bunzip2 -dc "%s" | tar xf -' % localfile,
-                cwd=target_directory)
-    elif ext in ('.gz', '.tgz') and has_command('gzip') and has_command('tar'):
-        buildscript.execute('gzip -dc "%s" | tar xf -' % localfile,
-                cwd=target_directory)
-    elif ext == '.zip' and has_command('unzip'):
+    if ext == '.zip' and has_command('unzip'):
         # liuhuan: create a directory with the zip file's basename before unziping it to support zipped files without top level directory
         dirname=os.path.join(target_directory,os.path.basename(localfile)[:-4])
         buildscript.execute('mkdir -p %s'%(dirname))
@@ -150,15 +324,7 @@ def unpack_archive(buildscript, localfile, target_directory, checkoutdir=None):
             raise CommandError(_('Failed to unpack %s') % localfile)
 
     if checkoutdir:
-        # tarball has been extracted in $destdir/$tmp/, check, then move the
+        # archive has been extracted in $destdir/$tmp/, check, then move the
         # content of that directory
-        if len(os.listdir(target_directory)) == 0:
-            raise CommandError(_('Failed to unpack %s (empty file?)') % localfile)
-        if len(os.listdir(target_directory)) == 1:
-            # a single directory, just move it
-            tmpdirname = os.path.join(target_directory, os.listdir(target_directory)[0])
-            fileutils.rename(tmpdirname, os.path.join(final_target_directory, checkoutdir))
-            os.rmdir(target_directory)
-        else:
-            # more files, just rename the temporary directory to the final name
-            fileutils.rename(target_directory, os.path.join(final_target_directory, checkoutdir))
+        _install_unpacked(localfile, target_directory, final_target_directory,
+                          checkoutdir)
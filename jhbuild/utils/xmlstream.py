@@ -0,0 +1,155 @@
+# jhbuild - a tool to ease building collections of source packages
+#
+#   xmlstream.py: incremental loading of XML documents
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Incremental loading of XML documents made of a list of independent
+elements, such as modulesets.
+
+The document is read with expat, and each child element of the document
+element is handed to a callback as soon as it is closed, as a small tree
+of nodes implementing the part of the xml.dom.minidom API used by jhbuild
+(nodeType, nodeName, childNodes, getAttribute, hasAttribute, attributes,
+getElementsByTagName, data and nodeValue).  Nothing is kept once the
+callback returns.
+'''
+
+import xml.parsers.expat
+
+__all__ = ['parse', 'Element', 'Text']
+
+
+class Node(object):
+    __slots__ = ()
+
+    ELEMENT_NODE = 1
+    TEXT_NODE = 3
+    COMMENT_NODE = 8
+
+    def normalize(self):
+        # adjacent text is always merged
+        pass
+
+
+class Element(Node):
+    __slots__ = ('nodeName', 'attributes', 'childNodes')
+
+    nodeType = Node.ELEMENT_NODE
+
+    def __init__(self, name, attributes):
+        self.nodeName = name
+        self.attributes = attributes
+        self.childNodes = []
+
+    @property
+    def tagName(self):
+        return self.nodeName
+
+    def getAttribute(self, name):
+        return self.attributes.get(name, '')
+
+    def hasAttribute(self, name):
+        return name in self.attributes
+
+    def getElementsByTagName(self, name):
+        result = []
+        for child in self.childNodes:
+            if child.nodeType == Node.ELEMENT_NODE:
+                if child.nodeName == name:
+                    result.append(child)
+                result.extend(child.getElementsByTagName(name))
+        return result
+
+    def __repr__(self):
+        return '<Element %s>' % self.nodeName
+
+
+class Text(Node):
+    __slots__ = ('data',)
+
+    nodeType = Node.TEXT_NODE
+    nodeName = '#text'
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def nodeValue(self):
+        return self.data
+
+
+class Comment(Text):
+    __slots__ = ()
+
+    nodeType = Node.COMMENT_NODE
+    nodeName = '#comment'
+
+
+def parse(filename, start, callback, wanted=None):
+    '''Parse filename, calling start(document_element) once the document
+    element is opened, then callback(element) for each of its children.
+
+    document_element has no children.  If wanted is given, only the children
+    whose name is in it are built and handed to callback; the others are
+    skipped.
+
+    Raises xml.parsers.expat.ExpatError or IOError.'''
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    # stack of open elements; None for elements that are skipped
+    stack = []
+
+    def start_element(name, attributes):
+        if not stack:
+            element = Element(name, attributes)
+            start(element)
+        elif stack[-1] is None or (len(stack) == 1 and
+                                   wanted is not None and name not in wanted):
+            element = None
+        else:
+            element = Element(name, attributes)
+            if len(stack) > 1:
+                stack[-1].childNodes.append(element)
+        stack.append(element)
+
+    def end_element(name):
+        element = stack.pop()
+        if len(stack) == 1 and element is not None:
+            callback(element)
+
+    def character_data(data):
+        if len(stack) < 2 or stack[-1] is None:
+            return
+        children = stack[-1].childNodes
+        if children and children[-1].nodeType == Node.TEXT_NODE:
+            children[-1].data += data
+        else:
+            children.append(Text(data))
+
+    def comment(data):
+        if len(stack) < 2 or stack[-1] is None:
+            return
+        stack[-1].childNodes.append(Comment(data))
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.CommentHandler = comment
+    fp = open(filename, 'rb')
+    try:
+        parser.ParseFile(fp)
+    finally:
+        fp.close()
@@ -22,12 +22,16 @@ __all__ = [
     'Branch',
     'register_repo_type',
     'get_repo_type',
+    'get_tree_ids',
+    'map_branches',
     ]
 
 __metaclass__ = type
 
 from jhbuild.errors import FatalError, BuildStateError
 import os
+import sys
+import threading
 
 class Repository:
     """An abstract class representing a collection of modules."""
@@ -198,3 +202,38 @@ def get_repo_type(name):
     if name not in _repo_types:
         raise FatalError(_('unknown repository type %s') % name)
     return _repo_types[name]
+
+def get_tree_ids(branches, jobs=1):
+    '''Return a dictionary mapping branches to their tree_id(), running up
+    to jobs queries at the same time.'''
+    return map_branches(lambda branch: branch.tree_id(), branches, jobs)
+
+def map_branches(func, branches, jobs=1):
+    '''Return a dictionary mapping branches to func(branch), running up to
+    jobs calls at the same time.'''
+    queue = list(branches)
+    results = {}
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not queue or errors:
+                    return
+                branch = queue.pop(0)
+            try:
+                results[branch] = func(branch)
+            except Exception:
+                errors.append(sys.exc_info())
+                return
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(len(queue), max(jobs, 1)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
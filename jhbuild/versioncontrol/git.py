@@ -23,16 +23,20 @@ __metaclass__ = type
 
 import os
 import stat
+import shutil
 import urlparse
 import subprocess
 import re
 import urllib
 import sys
+import time
 import logging
+import threading
 
 from jhbuild.errors import FatalError, CommandError
 from jhbuild.utils.cmds import get_output, check_version
-from jhbuild.versioncontrol import Repository, Branch, register_repo_type
+from jhbuild.versioncontrol import Repository, Branch, register_repo_type, \
+     map_branches
 import jhbuild.versioncontrol.svn
 from jhbuild.commands.sanitycheck import inpath
 from jhbuild.utils.sxml import sxml
@@ -69,6 +73,169 @@ def get_git_mirror_directory(mirror_root, checkoutdir, module):
     else:
         return mirror_dir + '.git'
 
+# file touched in a mirror each time it is refreshed, holding the refs
+# fetched by mirror-sync or dvcs_mirror_sync, so that the checkouts of this
+# run and of the following ones do not need to fetch again
+MIRROR_STAMP = 'jhbuild-mirror-stamp'
+
+def get_git_mirror_age(mirror_dir):
+    '''Return the number of seconds since the mirror at mirror_dir was last
+    refreshed, or None if it is not known.'''
+    try:
+        mtime = os.stat(os.path.join(mirror_dir, MIRROR_STAMP)).st_mtime
+    except OSError:
+        return None
+    return time.time() - mtime
+
+def is_git_mirror_fresh(config, mirror_dir):
+    '''Return whether the mirror at mirror_dir was refreshed less than
+    dvcs_mirror_max_age seconds ago.'''
+    age = get_git_mirror_age(mirror_dir)
+    return age is not None and 0 <= age < (config.dvcs_mirror_max_age or 0)
+
+def get_git_mirror_refs(mirror_dir):
+    extra_env = dict((k, v) for k, v in get_git_extra_env().items()
+                     if v is not None)
+    return get_output(['git', 'for-each-ref',
+                       '--format=%(objectname) %(refname)'],
+                      cwd=mirror_dir, extra_env=extra_env)
+
+def set_git_mirror_refreshed(mirror_dir, refs=''):
+    '''Touch the stamp of the mirror at mirror_dir, recording refs, the refs
+    of the mirror after a sync.'''
+    stamp = os.path.join(mirror_dir, MIRROR_STAMP)
+    try:
+        fp = open(stamp, 'w')
+        try:
+            fp.write(refs)
+        finally:
+            fp.close()
+    except IOError:
+        pass
+
+def is_git_mirror_synced(config, mirror_dir):
+    '''Return whether the mirror at mirror_dir was refreshed by mirror-sync
+    or dvcs_mirror_sync less than dvcs_mirror_max_age seconds ago, and has
+    not changed since.'''
+    if not is_git_mirror_fresh(config, mirror_dir):
+        return False
+    try:
+        refs = open(os.path.join(mirror_dir, MIRROR_STAMP)).read()
+    except IOError:
+        return False
+    if not refs:
+        # refreshed by a checkout
+        return False
+    try:
+        return get_git_mirror_refs(mirror_dir) == refs
+    except CommandError:
+        return False
+
+def find_git_mirrors(config, branches=()):
+    '''Return the (mirror_dir, url) pairs of the mirrors of branches, the
+    mirrored GitBranch objects, followed by the other Git mirrors found in
+    dvcs_mirror_dir, whose url is None.'''
+    mirrors = []
+    seen = set()
+    for branch in branches:
+        if not branch.unmirrored_module:
+            continue
+        mirror_dir = get_git_mirror_directory(config.dvcs_mirror_dir,
+                branch.checkoutdir, branch.unmirrored_module)
+        if mirror_dir not in seen:
+            seen.add(mirror_dir)
+            mirrors.append((mirror_dir, branch.unmirrored_module))
+    try:
+        names = sorted(os.listdir(config.dvcs_mirror_dir))
+    except OSError:
+        names = []
+    for name in names:
+        mirror_dir = os.path.join(config.dvcs_mirror_dir, name)
+        if (name.endswith('.git') and mirror_dir not in seen and
+                os.path.exists(os.path.join(mirror_dir, 'HEAD')) and
+                os.path.isdir(os.path.join(mirror_dir, 'objects'))):
+            mirrors.append((mirror_dir, None))
+    return mirrors
+
+def sync_git_mirror(config, mirror_dir, url=None):
+    '''Fetch the new commits of the mirror at mirror_dir, from url if it is
+    not None, cloning url if the mirror does not exist yet.
+
+    Each git command is killed after dvcs_mirror_timeout seconds.  Raises
+    CommandError on failure.'''
+    extra_env = dict((k, v) for k, v in get_git_extra_env().items()
+                     if v is not None)
+    timeout = config.dvcs_mirror_timeout
+    if os.path.exists(mirror_dir):
+        if url:
+            get_output(['git', 'remote', 'set-url', 'origin', url],
+                    cwd=mirror_dir, extra_env=extra_env)
+        get_output(['git', 'fetch'], cwd=mirror_dir, extra_env=extra_env,
+                timeout=timeout)
+    elif url:
+        # clone under another name, not to leave a partial mirror behind
+        tmp_dir = '%s.jhbuild-%d' % (mirror_dir, os.getpid())
+        try:
+            get_output(['git', 'clone', '--mirror', url, tmp_dir],
+                    extra_env=extra_env, timeout=timeout)
+            os.rename(tmp_dir, mirror_dir)
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+    else:
+        raise CommandError(_('%s is not a mirror') % mirror_dir)
+    set_git_mirror_refreshed(mirror_dir, get_git_mirror_refs(mirror_dir))
+
+def sync_git_mirrors(config, mirrors):
+    '''Refresh mirrors, a list of (mirror_dir, url) pairs as returned by
+    find_git_mirrors, dvcs_mirror_jobs at a time.  Mirrors refreshed less
+    than dvcs_mirror_max_age seconds ago are left alone.
+
+    Return the list of (mirror_dir, message) pairs of the mirrors that could
+    not be refreshed.'''
+    queue = [(mirror_dir, url) for mirror_dir, url in mirrors
+             if not is_git_mirror_fresh(config, mirror_dir)]
+    failures = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                mirror_dir, url = queue.pop(0)
+            try:
+                sync_git_mirror(config, mirror_dir, url)
+            except (CommandError, OSError) as e:
+                logging.warning(_('cannot refresh mirror %(mirror)s: %(msg)s')
+                        % {'mirror': mirror_dir, 'msg': e})
+                with lock:
+                    failures.append((mirror_dir, str(e)))
+            else:
+                logging.info(_('refreshed mirror %s') % mirror_dir)
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(len(queue), max(config.dvcs_mirror_jobs, 1)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(failures)
+
+# revisions of checkouts, with the state of their repository they were
+# computed for, by checkout directory.  Whether checkouts have uncommitted
+# changes is not kept, patches and autogen change the working tree.
+_revision_cache = {}
+
+def query_revisions(branches, jobs=1):
+    '''Query the revisions of the checkouts of branches, running up to jobs
+    git processes at the same time, so that they are found in the cache
+    afterwards.'''
+    map_branches(lambda branch: branch._get_revision(), branches, jobs)
+
+# results of GitBranch.check_version_git
+_version_checks = {}
+
 class GitUnknownBranchNameError(Exception):
     pass
 
@@ -226,8 +393,12 @@ class GitBranch(Branch):
                 + ['HEAD'])
 
     def check_version_git(self, version_spec):
-        return check_version(['git', '--version'], r'git version ([\d.]+)',
-                version_spec, extra_env=get_git_extra_env())
+        key = (version_spec, os.environ.get('UNMANGLED_PATH'))
+        if key not in _version_checks:
+            _version_checks[key] = check_version(['git', '--version'],
+                    r'git version ([\d.]+)', version_spec,
+                    extra_env=get_git_extra_env())
+        return _version_checks[key]
 
     def get_current_branch(self):
         """Returns either a branchname or None if head is detached"""
@@ -434,6 +605,21 @@ class GitBranch(Branch):
             buildscript.execute(cmd, cwd=self.get_checkoutdir(),
                     extra_env=get_git_extra_env())
 
+    def get_origin(self):
+        '''Return the URL the checkout is cloned and updated from: the
+        mirror of the module, unless it could not be created, in which case
+        the module is used directly.'''
+        if (self.unmirrored_module and not self.config.nonetwork and
+                not os.path.isdir(self.module)):
+            return self.unmirrored_module
+        return self.module
+
+    def _keep_shared_objects(self, buildscript, repo_dir):
+        # the objects of repo_dir are used by other repositories, which
+        # would be corrupted if git gc pruned them once unreachable
+        buildscript.execute(['git', 'config', 'gc.pruneExpire', 'never'],
+                cwd=repo_dir, extra_env=get_git_extra_env())
+
     def update_dvcs_mirror(self, buildscript):
         if not self.config.dvcs_mirror_dir:
             return
@@ -448,12 +634,16 @@ class GitBranch(Branch):
             buildscript.execute(['git', 'remote', 'set-url', 'origin',
                     self.unmirrored_module], cwd=mirror_dir,
                     extra_env=get_git_extra_env())
+            if is_git_mirror_synced(self.config, mirror_dir):
+                # refreshed by mirror-sync or dvcs_mirror_sync
+                return
             buildscript.execute(['git', 'fetch'], cwd=mirror_dir,
                     extra_env=get_git_extra_env())
         else:
             buildscript.execute(
                     ['git', 'clone', '--mirror', self.unmirrored_module,
                     mirror_dir], extra_env=get_git_extra_env())
+        set_git_mirror_refreshed(mirror_dir)
 
     def _checkout(self, buildscript, copydir=None):
 
@@ -466,7 +656,13 @@ class GitBranch(Branch):
 
         self.update_dvcs_mirror(buildscript)
 
-        cmd = ['git', 'clone'] + extra_opts + [self.module]
+        origin = self.get_origin()
+        if self.unmirrored_module and origin == self.module:
+            # borrow the objects of the mirror instead of copying them
+            extra_opts.append('--shared')
+            self._keep_shared_objects(buildscript, self.module)
+
+        cmd = ['git', 'clone'] + extra_opts + [origin]
         if self.checkoutdir:
             cmd.append(self.checkoutdir)
 
@@ -495,7 +691,7 @@ class GitBranch(Branch):
             self.update_dvcs_mirror(buildscript)
 
         buildscript.execute(['git', 'remote', 'set-url', 'origin',
-                self.module], **git_extra_args)
+                self.get_origin()], **git_extra_args)
 
         buildscript.execute(['git', 'remote', 'update', 'origin'],
                 **git_extra_args)
@@ -519,25 +715,92 @@ class GitBranch(Branch):
             raise CommandError(_('%s not found') % 'git')
         Branch.checkout(self, buildscript)
 
+    def _copy(self, buildscript, copydir):
+        # git clone drops the .git suffix of mirrors
+        name = os.path.basename(self.checkoutdir or self.get_module_basename())
+        fromdir = os.path.join(copydir, name)
+        todir = os.path.join(self.config.checkoutroot, name)
+        if os.path.exists(todir):
+            self._wipedir(buildscript, self.srcdir)
+        gitdir = os.path.join(fromdir, '.git')
+        if not os.path.isdir(os.path.join(gitdir, 'objects')):
+            buildscript.execute(['cp', '-R', fromdir, todir])
+            return
+
+        # copy everything but the objects, which the copy borrows from
+        # copydir
+        self._keep_shared_objects(buildscript, fromdir)
+        shutil.copytree(fromdir, todir, symlinks=True,
+                        ignore=lambda d, names: d == gitdir and ['objects'] or [])
+        objects_dir = os.path.join(todir, '.git', 'objects')
+        os.makedirs(os.path.join(objects_dir, 'info'))
+        os.makedirs(os.path.join(objects_dir, 'pack'))
+        fp = open(os.path.join(objects_dir, 'info', 'alternates'), 'w')
+        fp.write(os.path.abspath(os.path.join(gitdir, 'objects')) + '\n')
+        fp.close()
+
     def delete_unknown_files(self, buildscript):
         git_extra_args = {'cwd': self.get_checkoutdir(), 'extra_env': get_git_extra_env()}
         buildscript.execute(['git', 'clean', '-d', '-f', '-x'], **git_extra_args)
 
+    def _get_repository_state(self):
+        '''Return what identifies the revision of the checkout: the
+        contents of HEAD, and the modification times of HEAD, packed-refs
+        and the branch HEAD refers to.  None is returned if the repository
+        cannot be read.'''
+        gitdir = os.path.join(self.get_checkoutdir(), '.git')
+        try:
+            head = open(os.path.join(gitdir, 'HEAD')).read()
+        except IOError:
+            return None
+        paths = ['HEAD', 'packed-refs']
+        if head.startswith('ref: '):
+            paths.append(head[5:].strip())
+        state = [head]
+        for path in paths:
+            try:
+                st = os.stat(os.path.join(gitdir, path))
+            except OSError:
+                state.append(None)
+            else:
+                # git replaces these files, which changes their inode
+                state.append((st.st_mtime, st.st_size, st.st_ino))
+        return tuple(state)
+
+    def _get_revision(self):
+        '''Return the revision of the checkout, or None.
+
+        The result is kept until the repository state changes, so that the
+        build policy, the installation and snapshot do not run git again for
+        each of them.'''
+        checkoutdir = self.get_checkoutdir()
+        repository_state = self._get_repository_state()
+        cached = _revision_cache.get(checkoutdir)
+        if (repository_state is not None and cached is not None and
+                cached[0] == repository_state):
+            return cached[1]
+        revision = None
+        if os.path.exists(checkoutdir):
+            try:
+                revision = get_output(['git', 'rev-parse', 'HEAD'],
+                        cwd=checkoutdir, get_stderr=False,
+                        extra_env=get_git_extra_env()).strip()
+            except CommandError:
+                pass
+        if repository_state is not None:
+            _revision_cache[checkoutdir] = (repository_state, revision)
+        return revision
+
     def tree_id(self):
         if not os.path.exists(self.get_checkoutdir()):
             return None
-        try:
-            output = get_output(['git', 'rev-parse', 'HEAD'],
-                    cwd = self.get_checkoutdir(), get_stderr=False,
-                    extra_env=get_git_extra_env())
-        except CommandError:
-            return None
-        except GitUnknownBranchNameError:
+        revision = self._get_revision()
+        if revision is None:
             return None
         id_suffix = ''
         if self.is_dirty():
             id_suffix = self.dirty_branch_suffix
-        return output.strip() + id_suffix
+        return revision + id_suffix
 
     def to_sxml(self):
         attrs = {}
@@ -33,8 +33,9 @@ from jhbuild.errors import FatalError, CommandError, BuildStateError
 from jhbuild.versioncontrol import Repository, Branch, register_repo_type
 from jhbuild.utils.cmds import has_command, get_output
 from jhbuild.modtypes import get_branch
-from jhbuild.utils.unpack import unpack_archive
+from jhbuild.utils.unpack import unpack_archive, can_stream, Extraction
 from jhbuild.utils import httpcache
+from jhbuild.utils import download
 from jhbuild.utils.sxml import sxml
 
 
@@ -169,8 +170,21 @@ class TarballBranch(Branch):
         return self.version
     branchname = property(branchname)
 
-    def _check_tarball(self):
-        """Check whether the tarball has been downloaded correctly."""
+    def _get_hash_algo(self):
+        """Return the hashlib algorithm of source_hash, or None if it
+        cannot be checked."""
+        if self.source_hash is None:
+            return None
+        algo = self.source_hash.split(':')[0]
+        if hasattr(hashlib, algo):
+            return algo
+        return None
+
+    def _check_tarball(self, digest=None):
+        """Check whether the tarball has been downloaded correctly.
+
+        digest is the hash of the file computed while it was downloaded,
+        if it was."""
         localfile = self._local_tarball
         if not os.path.exists(localfile):
             raise BuildStateError(_('file not downloaded'))
@@ -186,7 +200,7 @@ class TarballBranch(Branch):
             except ValueError:
                 logging.warning(_('invalid hash attribute on module %s') % self.module)
                 return
-            if hasattr(hashlib, algo):
+            if digest is None and hasattr(hashlib, algo):
                 local_hash = getattr(hashlib, algo)()
 
                 fp = open(localfile, 'rb')
@@ -195,35 +209,28 @@ class TarballBranch(Branch):
                     local_hash.update(data)
                     data = fp.read(32768)
                 fp.close()
-                if local_hash.hexdigest() != hash:
+                digest = local_hash.hexdigest()
+            if digest is not None:
+                if digest != hash:
                     raise BuildStateError(
                             _('file hash is incorrect (expected %(sum1)s, got %(sum2)s)')
-                            % {'sum1':hash, 'sum2':local_hash.hexdigest()})
+                            % {'sum1':hash, 'sum2':digest})
             else:
                 logging.warning(_('skipped hash check (missing support for %s)') % algo)
 
-    def _download_tarball(self, buildscript, localfile):
+    def _download_tarball(self, buildscript, localfile, sink=None):
+        """Downloads the tarball off the internet, and return its hash, as
+        computed while downloading it.  The data is also given to sink,
+        if any."""
         if not os.access(self.config.tarballdir, os.R_OK|os.W_OK|os.X_OK):
             raise FatalError(_('tarball dir (%s) must be writable') % self.config.tarballdir)
-        """Downloads the tarball off the internet, using wget or curl."""
-        extra_env = {
-            'LD_LIBRARY_PATH': os.environ.get('UNMANGLED_LD_LIBRARY_PATH'),
-            'PATH': os.environ.get('UNMANGLED_PATH')
-            }
-        lines = [
-            ['wget', '--continue', self.module, '-O', localfile],
-            ['curl', '--continue-at', '-', '-L', self.module, '-o', localfile]
-            ]
-        lines = [line for line in lines if has_command(line[0])]
-        if not lines:
-            raise FatalError(_("unable to find wget or curl"))
-        try:
-            return buildscript.execute(lines[0], extra_env = extra_env)
-        except CommandError:
-            # Cleanup potential leftover file
-            if os.path.exists(localfile):
-                os.remove(localfile)
-            raise
+        if os.path.exists(localfile):
+            # an interrupted download, or a file that was modified; try to
+            # continue it, the download starts again if it does not match
+            os.rename(localfile, localfile + '.part')
+        buildscript.message(_('Downloading %s') % self.module)
+        return download.download(self.module, localfile, self._get_hash_algo(),
+                                 sink)
 
     def _download_and_unpack(self, buildscript):
         localfile = self._local_tarball
@@ -233,16 +240,39 @@ class TarballBranch(Branch):
             except OSError:
                 raise FatalError(
                         _('tarball dir (%s) can not be created') % self.config.tarballdir)
+        extraction = None
         try:
             self._check_tarball()
         except BuildStateError:
-            # don't have the tarball, try downloading it and check again
-            res = self._download_tarball(buildscript, localfile)
-            self._check_tarball()
+            # don't have the tarball, try downloading it and check again;
+            # it is unpacked while it is received when possible, and the
+            # extracted files are only kept if the check succeeds
+            try:
+                if can_stream(localfile):
+                    extraction = Extraction(localfile, self.checkoutroot,
+                                            self.checkoutdir)
+                digest = self._download_tarball(buildscript, localfile,
+                                                extraction)
+            except:
+                if extraction:
+                    extraction.abort()
+                raise
+            try:
+                self._check_tarball(digest)
+            except BuildStateError:
+                # start again next time
+                if extraction:
+                    extraction.abort()
+                os.remove(localfile)
+                raise
 
         # now to unpack it
         try:
-            unpack_archive(buildscript, localfile, self.checkoutroot, self.checkoutdir)
+            if extraction:
+                extraction.finish()
+            else:
+                unpack_archive(buildscript, localfile, self.checkoutroot,
+                               self.checkoutdir)
         except CommandError:
             raise FatalError(_('failed to unpack %s') % localfile)
 
@@ -349,6 +379,11 @@ class TarballBranch(Branch):
                         extra_env={'QUILT_PATCHES' : self.quilt.srcdir}))
         return '%s-%s' % (self.version, md5sum.hexdigest())
 
+    def get_source_options(self):
+        '''Return what, besides the version, selects the sources that are
+        built.'''
+        return [self.module, self.source_hash, self.patches]
+
     def to_sxml(self):
         return ([sxml.branch(module=self.module,
                              repo=self.repository.name,
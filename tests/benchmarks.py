@@ -0,0 +1,1386 @@
+#! /usr/bin/env python2
+# jhbuild - a tool to ease building collections of source packages
+#
+#   benchmarks.py: performance benchmarks
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+'''Benchmarks for jhbuild internals, run on the modulesets shipped with
+jhbuild.
+
+Usage: benchmarks.py [benchmark ...]
+'''
+
+import os
+import BaseHTTPServer
+import collections
+import glob
+import logging
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+import xml.dom.minidom
+
+import __builtin__
+__builtin__.__dict__['_'] = lambda x: x
+__builtin__.__dict__['N_'] = lambda x: x
+
+__builtin__.__dict__['PKGDATADIR'] = None
+__builtin__.__dict__['DATADIR'] = None
+__builtin__.__dict__['SRCDIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.insert(0, SRCDIR)
+
+import jhbuild.moduleset
+import jhbuild.config
+import jhbuild.modtypes
+import jhbuild.utils.cmds
+import jhbuild.utils.dpkg
+import jhbuild.utils.elf
+import jhbuild.utils.inventory
+import jhbuild.utils.packagedb
+import jhbuild.utils.trigger
+from jhbuild.utils import fileutils
+
+MODULESETS_DIR = os.path.join(SRCDIR, 'modulesets')
+
+
+class BenchmarkConfig(jhbuild.config.Config):
+    def setup_env(self):
+        pass
+
+
+def make_config(temp_dir):
+    rcfile = os.path.join(temp_dir, 'jhbuildrc')
+    fp = open(rcfile, 'w')
+    fp.write('jhhome = %r\n' % temp_dir)
+    fp.write('prefix = %r\n' % os.path.join(temp_dir, 'prefix'))
+    fp.write('checkoutroot = %r\n' % os.path.join(temp_dir, 'checkout'))
+    fp.write('modulecmakeargs = {}\n')
+    fp.write('appendmodulecmakeargs = {}\n')
+    fp.close()
+    config = BenchmarkConfig(rcfile, [])
+    config.modulesets_dir = MODULESETS_DIR
+    config.use_local_modulesets = True
+    config.nonetwork = True
+    return config
+
+
+def timed(func, *args, **kwargs):
+    '''Run func, returning its result and the best wall time of three runs'''
+    best = None
+    for i in range(3):
+        start = time.time()
+        result = func(*args, **kwargs)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+
+def report(name, legacy, current):
+    print '%-40s %10.4fs %10.4fs %8.1fx' % (name, legacy, current,
+                                          legacy / max(current, 1e-9))
+
+
+def legacy_full_module_list(self, module_names='all', skip=[],
+                            include_suggests=True, include_afters=False):
+    '''ModuleSet.get_full_module_list as of jhbuild 3.x, list based'''
+
+    def dep_resolve(node, resolved, seen, after):
+        circular = False
+        seen.append(node)
+        if include_suggests:
+            edges = node.dependencies + node.suggests + node.after
+        else:
+            edges = node.dependencies + node.after
+        resolved_deps = [module for module, after_module in resolved \
+                         if not after_module]
+        for edge_name in edges:
+            edge = self.modules.get(edge_name)
+            if edge == None:
+                pass
+            elif edge_name not in skip and edge not in resolved_deps:
+                if edge in seen:
+                    circular = True
+                    break
+                else:
+                    if edge_name in node.after:
+                        dep_resolve(edge, resolved, seen, True)
+                    elif edge_name in node.suggests:
+                        dep_resolve(edge, resolved, seen, after)
+                    elif edge_name in node.dependencies:
+                        dep_resolve(edge, resolved, seen, after)
+                        if edge not in [i[0] for i in resolved]:
+                            resolved.append((edge, after))
+
+        seen.remove(node)
+
+        if not circular:
+            if node not in [i[0] for i in resolved]:
+                resolved.append((node, after))
+            elif not after:
+                for index, item in enumerate(resolved):
+                    if item[1] == True and item[0] == node:
+                        resolved[index] = (node, False)
+
+    if module_names == 'all':
+        module_names = self.modules.keys()
+    modules = [self.get_module(module, ignore_case = True) \
+               for module in module_names if module not in skip]
+
+    resolved = []
+    for module in modules:
+        dep_resolve(module, resolved, [], False)
+
+    if include_afters:
+        return [module[0] for module in resolved]
+    return [module for module, after_module in resolved if not after_module]
+
+
+def benchmark_dependency_resolution():
+    '''Dependency resolution on gnome-world.modules'''
+    config = make_config(tempfile.mkdtemp(prefix='jhbuild-benchmark-'))
+    logging.getLogger().setLevel(logging.ERROR)
+    module_set = jhbuild.moduleset.load(config, 'gnome-world')
+    names = sorted(module_set.modules.keys())
+    print '%d modules' % len(names)
+
+    def resolve_all(resolver):
+        return [x.name for x in resolver(module_set, names,
+                                         include_afters=True)]
+
+    def resolve_each(resolver):
+        # what rdepends and extdeps do
+        return [[x.name for x in resolver(module_set, [name])]
+                for name in names]
+
+    def current(module_set, *args, **kwargs):
+        return module_set.get_full_module_list(
+                *args, warn_about_circular_dependencies=False, **kwargs)
+
+    for label, func in (('full module list', resolve_all),
+                        ('module list of each module', resolve_each)):
+        legacy_result, legacy_time = timed(func, legacy_full_module_list)
+        result, current_time = timed(func, current)
+        assert result == legacy_result, 'build order differs'
+        report(label, legacy_time, current_time)
+
+    shutil.rmtree(os.path.dirname(config.prefix))
+
+
+def legacy_parse_module_set(config, uri, included_moduleset_uris=None):
+    '''_parse_module_set as of jhbuild 3.x, loading a minidom document'''
+    from jhbuild.moduleset import ModuleSet, _child_elements, \
+            _child_elements_matching, _handle_conditions
+    from jhbuild.versioncontrol import get_repo_type
+    from jhbuild import modtypes
+
+    if included_moduleset_uris is None:
+        included_moduleset_uris = set()
+    document = xml.dom.minidom.parse(uri)
+    _handle_conditions(config, document.documentElement)
+
+    moduleset = ModuleSet(config=config, db=True,
+                          included_moduleset_uris=included_moduleset_uris)
+    moduleset_name = document.documentElement.getAttribute('name')
+    if not moduleset_name:
+        moduleset_name = os.path.basename(uri)
+        if moduleset_name.endswith('.modules'):
+            moduleset_name = moduleset_name[:-len('.modules')]
+
+    repositories = {}
+    default_repo = None
+    for node in _child_elements_matching(document.documentElement,
+                                         ['repository']):
+        name = node.getAttribute('name')
+        if node.getAttribute('default') == 'yes':
+            default_repo = name
+        repo_class = get_repo_type(node.getAttribute('type'))
+        kws = {}
+        for attr in repo_class.init_xml_attrs:
+            if node.hasAttribute(attr):
+                kws[attr.replace('-', '_')] = node.getAttribute(attr)
+        repositories[name] = repo_class(config, name, **kws)
+        repositories[name].moduleset_uri = uri
+        mirrors = {}
+        for mirror in _child_elements_matching(node, ['mirror']):
+            mirror_type = mirror.getAttribute('type')
+            mirror_class = get_repo_type(mirror_type)
+            kws = {}
+            for attr in mirror_class.init_xml_attrs:
+                if mirror.hasAttribute(attr):
+                    kws[attr.replace('-','_')] = mirror.getAttribute(attr)
+            mirrors[mirror_type] = mirror_class(config, name, **kws)
+        setattr(repositories[name], "mirrors", mirrors)
+
+    for node in _child_elements(document.documentElement):
+        if node.nodeName == 'include':
+            inc_uri = urlparse.urljoin(uri, node.getAttribute('href'))
+            if inc_uri in moduleset.included_moduleset_uris:
+                continue
+            inc_moduleset = legacy_parse_module_set(config, inc_uri,
+                                                    included_moduleset_uris)
+            moduleset.modules.update(inc_moduleset.modules)
+            moduleset.included_moduleset_uris.add(inc_uri)
+        elif node.nodeName != 'repository':
+            module = modtypes.parse_xml_node(node, config, uri,
+                    repositories, default_repo)
+            if moduleset_name:
+                module.tags.append(moduleset_name)
+            module.moduleset_name = moduleset_name
+            moduleset.add(module)
+
+    return moduleset
+
+
+def summarize(obj, depth=0):
+    '''Return a comparable summary of the attributes of obj'''
+    if hasattr(obj, '__dict__') and depth < 3:
+        return sorted([(key, summarize(value, depth + 1))
+                       for key, value in vars(obj).items()
+                       if key != 'config'])
+    if isinstance(obj, (list, tuple)):
+        return [summarize(x, depth + 1) for x in obj]
+    if isinstance(obj, dict):
+        return sorted([(key, summarize(value, depth + 1))
+                       for key, value in obj.items()])
+    if isinstance(obj, (basestring, int, long, float, bool, type(None))):
+        return obj
+    return type(obj).__name__
+
+
+def peak_memory(func):
+    '''Run func in a child process, returning how much the peak resident
+    memory of the child grew, in kilobytes'''
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            func()
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_fd, str(after - before))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 100)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return int(result)
+
+
+def benchmark_moduleset_parser():
+    '''Parsing gnome-world.modules'''
+    config = make_config(tempfile.mkdtemp(prefix='jhbuild-benchmark-'))
+    logging.getLogger().setLevel(logging.ERROR)
+    uri = os.path.join(MODULESETS_DIR, 'gnome-world.modules')
+
+    def legacy():
+        return legacy_parse_module_set(config, uri).modules
+
+    def current():
+        return jhbuild.moduleset._parse_module_set(config, uri).modules
+
+    # measure memory first, in a process where nothing was parsed yet, but
+    # with the module types and repositories already imported
+    for name in ('autotools', 'cmake', 'distutils', 'meson', 'systemmodule',
+                 'tarball', 'waf'):
+        __import__('jhbuild.modtypes.%s' % name)
+    for name in ('bzr', 'cvs', 'git', 'svn', 'system', 'tarball'):
+        __import__('jhbuild.versioncontrol.%s' % name)
+    legacy_memory = peak_memory(legacy)
+    current_memory = peak_memory(current)
+
+    legacy_result, legacy_time = timed(legacy)
+    result, current_time = timed(current)
+    assert sorted(result) == sorted(legacy_result), 'modules differ'
+    for name in result:
+        assert summarize(result[name]) == summarize(legacy_result[name]), \
+                'module %s differs' % name
+    report('parse %d modules' % len(result), legacy_time, current_time)
+
+    print '%-40s %9dk %10dk' % ('peak memory increase',
+                                legacy_memory, current_memory)
+
+    shutil.rmtree(os.path.dirname(config.prefix))
+
+
+def benchmark_moduleset_cache():
+    '''Loading gnome-world.modules from the cache of parsed modulesets'''
+    config = make_config(tempfile.mkdtemp(prefix='jhbuild-benchmark-'))
+    logging.getLogger().setLevel(logging.ERROR)
+    uri = os.path.join(MODULESETS_DIR, 'gnome-world.modules')
+
+    def parse():
+        return sorted(jhbuild.moduleset._parse_module_set(config, uri).modules)
+
+    def load():
+        return sorted(jhbuild.moduleset._load_module_set(config, uri))
+
+    load()  # fill the cache
+    legacy_result, legacy_time = timed(parse)
+    result, current_time = timed(load)
+    assert result == legacy_result, 'modules differ'
+    report('load %d modules' % len(result), legacy_time, current_time)
+
+    shutil.rmtree(os.path.dirname(config.prefix))
+
+
+def legacy_rdepends(module_set, modname):
+    '''Reverse dependencies as computed by cmd_rdepends as of jhbuild 3.x'''
+    dependencies_list = [x.name for x in module_set.get_module_list([modname])]
+    if modname in dependencies_list:
+        dependencies_list.remove(modname)
+    modules = module_set.get_full_module_list(skip=dependencies_list)
+    modules = modules[[x.name for x in modules].index(modname)+1:]
+    rdeps = []
+    for module in modules:
+        module_list = module_set.get_module_list([module.name])
+        if modname in [x.name for x in module_list]:
+            rdeps.append(module.name)
+    return rdeps
+
+
+def benchmark_reverse_dependencies():
+    '''Reverse dependencies on gnome-world.modules'''
+    config = make_config(tempfile.mkdtemp(prefix='jhbuild-benchmark-'))
+    # do not ask pkg-config about system modules
+    config.partial_build = False
+    logging.getLogger().setLevel(logging.ERROR)
+    module_set = jhbuild.moduleset.load(config, 'gnome-world')
+
+    def current_rdepends(module_set, modname):
+        dependencies_list = [x.name for x in module_set.get_module_list([modname])]
+        if modname in dependencies_list:
+            dependencies_list.remove(modname)
+        modules = module_set.get_full_module_list(skip=dependencies_list)
+        rdeps = module_set.get_reverse_dependencies(modname, transitive=True,
+                                                    include_suggests=True)
+        return [x.name for x in modules if x.name in rdeps]
+
+    for modname in ('glib', 'gtk+-3'):
+        legacy_result, legacy_time = timed(legacy_rdepends, module_set, modname)
+        result, current_time = timed(current_rdepends, module_set, modname)
+        assert result == legacy_result, 'reverse dependencies differ'
+        report('rdepends %s (%d modules)' % (modname, len(result)),
+               legacy_time, current_time)
+
+    shutil.rmtree(os.path.dirname(config.prefix))
+
+
+def benchmark_packagedb():
+    '''Reading the status of 500 installed modules'''
+    config = make_config(tempfile.mkdtemp(prefix='jhbuild-benchmark-'))
+    logging.getLogger().setLevel(logging.ERROR)
+    dbfile = os.path.join(config.top_builddir, 'packagedb.xml')
+    sqlite_dbfile = os.path.join(config.top_builddir, 'packagedb.sqlite')
+    names = ['module-%03d' % i for i in range(500)]
+    db = jhbuild.utils.packagedb.PackageDB(dbfile, config)
+    for name in names:
+        db.add(name, '1.0', [os.path.join(config.prefix, name, str(i))
+                             for i in range(50)], module_hash=name)
+    # created from the files
+    jhbuild.utils.packagedb.SQLitePackageDB(sqlite_dbfile, config).get('')
+
+    def status(db):
+        return [(db.check(name, '1.0', name), db.installdate(name))
+                for name in names]
+
+    def files_status():
+        return status(jhbuild.utils.packagedb.PackageDB(dbfile, config))
+
+    def sqlite_status():
+        return status(jhbuild.utils.packagedb.SQLitePackageDB(sqlite_dbfile,
+                                                              config))
+
+    legacy_result, legacy_time = timed(files_status)
+    result, current_time = timed(sqlite_status)
+    assert [x[0] for x in result] == [x[0] for x in legacy_result], \
+            'status differ'
+    report('check 500 modules', legacy_time, current_time)
+
+    shutil.rmtree(os.path.dirname(config.prefix))
+
+
+class LegacyPackageDB(jhbuild.utils.packagedb.PackageDB):
+    def get(self, package):
+        return jhbuild.utils.packagedb.PackageEntry.open(self.dirname, package)
+
+
+def benchmark_packagedb_cache():
+    '''updated-deps build policy check of 500 modules with 10 dependencies'''
+    config = make_config(tempfile.mkdtemp(prefix='jhbuild-benchmark-'))
+    dbfile = os.path.join(config.top_builddir, 'packagedb.xml')
+    names = ['module-%03d' % i for i in range(500)]
+    db = jhbuild.utils.packagedb.PackageDB(dbfile, config)
+    for name in names:
+        db.add(name, '1.0', [os.path.join(config.prefix, name)])
+
+    def policy(db):
+        result = []
+        for i, name in enumerate(names):
+            install_date = db.installdate(name)
+            result.append([db.installdate(dep) > install_date
+                           for dep in names[max(0, i - 10):i]])
+        return result
+
+    legacy_db = LegacyPackageDB(dbfile, config)
+    legacy_result, legacy_time = timed(policy, legacy_db)
+    result, current_time = timed(policy, db)
+    assert result == legacy_result, 'policy differs'
+    report('check policy of 500 modules', legacy_time, current_time)
+
+    shutil.rmtree(os.path.dirname(config.prefix))
+
+
+def legacy_owners(db, paths):
+    # read every manifest
+    result = {}
+    for package in sorted(os.listdir(os.path.join(db.dirname, 'info'))):
+        manifest = set(jhbuild.utils.packagedb.PackageEntry.open(
+                db.dirname, package).manifest)
+        for path in paths:
+            if path in manifest:
+                result.setdefault(path, []).append(package)
+    return [result.get(path, []) for path in paths]
+
+
+def benchmark_owners():
+    '''Looking up the owners of files among 300000 installed files'''
+    config = make_config(tempfile.mkdtemp(prefix='jhbuild-benchmark-'))
+    dbfile = os.path.join(config.top_builddir, 'packagedb.xml')
+    db = jhbuild.utils.packagedb.PackageDB(dbfile, config)
+    for i in range(500):
+        db.add('module-%03d' % i, '1.0',
+               ['lib/module-%03d/file-%03d' % (i, j) for j in range(600)])
+    db.owners('')  # save the index
+
+    paths = ['lib/module-%03d/file-%03d' % (i, i) for i in range(0, 500, 50)]
+
+    def owners():
+        db = jhbuild.utils.packagedb.PackageDB(dbfile, config)
+        return [db.owners(path) for path in paths]
+
+    legacy_result, legacy_time = timed(legacy_owners, db, paths)
+    result, current_time = timed(owners)
+    assert result == legacy_result, 'owners differ'
+    report('look up %d files' % len(paths), legacy_time, current_time)
+
+    contents = ['lib/module-%03d/file-%03d' % (i, j)
+                for i in (0, 1) for j in range(1000)]
+    legacy_result, legacy_time = timed(legacy_owners, db, contents)
+    result, current_time = timed(db.collisions, 'module-new', contents)
+    assert result == [(path, owners) for path, owners in
+                      zip(contents, legacy_result) if owners], \
+            'collisions differ'
+    report('collisions of %d files' % len(contents), legacy_time, current_time)
+
+    shutil.rmtree(os.path.dirname(config.prefix))
+
+
+def legacy_find_executable_system_dependencies(destdir_prefix, installroot):
+    # run file on every file and ldd on every ELF file and library
+    executables = []
+    for filename in fileutils.accumulate_dirtree_contents(destdir_prefix):
+        fullfilename = os.path.join(destdir_prefix, filename)
+        if not os.path.isfile(fullfilename) or os.path.islink(fullfilename):
+            continue
+        if not os.access(fullfilename, os.X_OK) and \
+                'so' not in os.path.basename(filename).split(os.path.extsep):
+            continue
+        if filename.endswith('.debug'):
+            continue
+        fileinfo = ''
+        try:
+            fileinfo = subprocess.check_output(['file', '-b', fullfilename]).strip()
+        except Exception:
+            pass
+        if fileinfo.startswith('ELF '):
+            executables.append(filename)
+    fullexecutables = set(os.path.join(destdir_prefix, x) for x in executables)
+    librarypaths = sorted(set(os.path.dirname(x) for x in fullexecutables))
+    env = os.environ.copy()
+    env['LD_LIBRARY_PATH'] = ':'.join([os.path.join(destdir_prefix, 'lib'),
+                                       os.path.join(installroot, 'lib')] +
+                                      librarypaths)
+    notfounds = {}
+    rdependencies = collections.defaultdict(set)
+    executablequeue = set(fullexecutables)
+    allexecutables = set(fullexecutables)
+    while executablequeue:
+        fullfilename = executablequeue.pop()
+        lines = []
+        try:
+            lines = subprocess.check_output(['ldd', fullfilename], env=env,
+                                            stderr=open(os.devnull, 'w')).splitlines()
+        except Exception:
+            pass
+        found = []
+        notfound = []
+        for line in lines:
+            if '=>' not in line:
+                continue
+            lib, rest = [x.strip() for x in line.split('=>')]
+            if 'not found' in rest:
+                notfound.append(lib)
+            else:
+                found.append(rest.split()[0])
+        if fullfilename in fullexecutables:
+            filename = fullfilename[len(destdir_prefix) + len(os.path.sep):]
+            for foundfilename in found:
+                if foundfilename in fullexecutables:
+                    rdependencies[foundfilename[len(destdir_prefix) + len(os.path.sep):]].add(filename)
+            if notfound:
+                notfounds[filename] = notfound
+        executablequeue.update(set(found).difference(allexecutables))
+        allexecutables.update(found)
+    systemdependencies = []
+    for fullfilename in allexecutables:
+        if fullfilename.startswith(destdir_prefix) or fullfilename.startswith(installroot):
+            continue
+        altdeps = []
+        realfilename = os.path.realpath(fullfilename)
+        if fullfilename != realfilename:
+            altdeps.append(('path', realfilename, []))
+        systemdependencies.append(('path', fullfilename, altdeps))
+    return systemdependencies, notfounds, rdependencies
+
+
+def benchmark_elf():
+    '''Finding the system dependencies of 300 installed ELF files'''
+    temp_dir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    destdir_prefix = os.path.join(temp_dir, 'root', 'opt')
+    installroot = os.path.join(temp_dir, 'opt')
+    for subdir, pattern in (('bin', '/usr/bin/*'),
+                            ('lib', '/usr/lib/*-linux-gnu/lib*.so.*')):
+        os.makedirs(os.path.join(destdir_prefix, subdir))
+        count = 0
+        for filename in sorted(glob.glob(pattern)):
+            if os.path.islink(filename) or jhbuild.utils.elf.read(filename) is None:
+                continue
+            target = os.path.join(destdir_prefix, subdir,
+                                  os.path.basename(filename))
+            shutil.copyfile(filename, target)
+            # file(1) does not report setuid executables as ELF files
+            os.chmod(target, 0755)
+            count += 1
+            if count == 150:
+                break
+
+    def normalize(result):
+        systemdependencies, notfounds, rdependencies = result
+        return (sorted(systemdependencies),
+                dict((k, sorted(v)) for k, v in notfounds.items()),
+                dict(rdependencies))
+
+    package = jhbuild.modtypes.Package('benchmark')
+    legacy_result, legacy_time = timed(
+            legacy_find_executable_system_dependencies, destdir_prefix, installroot)
+    result, current_time = timed(
+            package._find_executable_system_dependencies, destdir_prefix, installroot)
+    assert normalize(result) == normalize(legacy_result), 'dependencies differ'
+    report('system dependencies (%d found)' % len(result[0]),
+           legacy_time, current_time)
+
+    shutil.rmtree(temp_dir)
+
+
+def legacy_install_stages(package, destdir, destdir_prefix, prefix):
+    '''Walks of the DESTDIR made by Package.process_install, each stage
+    reading the tree again'''
+    def clean_la_files(path):
+        for name in os.listdir(path):
+            subpath = os.path.join(path, name)
+            if os.path.isdir(subpath) and not os.path.islink(subpath):
+                clean_la_files(subpath)
+            elif name.endswith('.la'):
+                os.unlink(subpath)
+    if os.path.isdir(destdir_prefix) and not os.path.islink(destdir_prefix):
+        clean_la_files(destdir_prefix)
+    if os.path.isdir(destdir_prefix):
+        dirfile = os.path.join(destdir_prefix, 'share/info/dir')
+        if os.path.isfile(dirfile):
+            os.unlink(dirfile)
+
+    def elf_files():
+        for filename in fileutils.accumulate_dirtree_contents(destdir_prefix):
+            fullfilename = os.path.join(destdir_prefix, filename)
+            if not os.path.isfile(fullfilename) or os.path.islink(fullfilename):
+                continue
+            if not os.access(fullfilename, os.X_OK) and \
+                    'so' not in os.path.basename(filename).split(os.path.extsep):
+                continue
+            fileinfo = jhbuild.utils.elf.read(fullfilename)
+            if fileinfo is not None:
+                yield filename, fileinfo
+    # finding executables, then stripping the ones with symbols
+    executables = [x for x, info in elf_files() if not x.endswith('.debug')]
+    unstripped = [x for x, info in elf_files() if not info.stripped]
+    contents = fileutils.accumulate_dirtree_contents(destdir_prefix)
+
+    def process_install_files(curdir):
+        num_copied = 0
+        for filename in os.listdir(curdir):
+            src_path = os.path.join(curdir, filename)
+            dest_path = src_path[len(destdir):]
+            if os.path.islink(src_path):
+                linkto = os.readlink(src_path)
+                if os.path.islink(dest_path) or os.path.isfile(dest_path):
+                    os.unlink(dest_path)
+                os.symlink(linkto, dest_path)
+                os.unlink(src_path)
+                num_copied += 1
+            elif os.path.isdir(src_path):
+                if os.path.exists(dest_path):
+                    if not os.path.isdir(dest_path):
+                        os.unlink(dest_path)
+                        os.mkdir(dest_path)
+                else:
+                    os.mkdir(dest_path)
+                num_copied += process_install_files(src_path)
+                os.rmdir(src_path)
+            else:
+                fileutils.rename(src_path, dest_path)
+                num_copied += 1
+        return num_copied
+    process_install_files(destdir_prefix)
+    return sorted(executables), sorted(unstripped), sorted(contents)
+
+
+def current_install_stages(package, destdir, destdir_prefix, prefix):
+    '''The same stages working from an Inventory'''
+    buildscript = collections.namedtuple('BuildScript', 'config')(package.config)
+    inventory = jhbuild.utils.inventory.Inventory(destdir_prefix)
+    package._clean_la_files(buildscript, destdir, inventory)
+    package._clean_texinfo_dir_files(buildscript, destdir, inventory)
+    executables = package._find_executables(destdir_prefix, inventory)
+    unstripped = [x for x, entry in inventory.entries.items()
+                  if entry.elf is not None and not entry.elf.stripped]
+    contents = inventory.contents()
+    package._process_install_files(destdir, destdir_prefix, prefix, [],
+                                   inventory)
+    return sorted(executables), sorted(unstripped), sorted(contents)
+
+
+class SyscallCounter(object):
+    '''Count the calls to the os functions accessing the file system'''
+
+    functions = ('stat', 'lstat', 'listdir', 'access', 'readlink', 'rename',
+                 'unlink', 'mkdir', 'rmdir', 'symlink')
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        self._saved = [(name, getattr(os, name)) for name in self.functions]
+        self._saved_open = __builtin__.open
+        def counted(func):
+            def wrapper(*args, **kwargs):
+                self.count += 1
+                return func(*args, **kwargs)
+            return wrapper
+        for name, func in self._saved:
+            setattr(os, name, counted(func))
+        __builtin__.open = counted(self._saved_open)
+        return self
+
+    def __exit__(self, *args):
+        for name, func in self._saved:
+            setattr(os, name, func)
+        __builtin__.open = self._saved_open
+
+
+def benchmark_install_inventory():
+    '''Processing the DESTDIR of a module of 5000 files'''
+    temp_dir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    config = make_config(temp_dir)
+    template = os.path.join(temp_dir, 'template')
+    # a few hundred ELF files among many data files
+    share = []
+    for dirpath, dirnames, filenames in os.walk('/usr/share'):
+        dirnames.sort()
+        share.extend(os.path.join(dirpath, x) for x in sorted(filenames))
+        if len(share) > 10000:
+            break
+    for subdir, filenames, limit in (
+            ('bin', sorted(glob.glob('/usr/bin/*')), 200),
+            ('lib', sorted(glob.glob('/usr/lib/*-linux-gnu/lib*.so.*')), 200),
+            ('share', share, 4600)):
+        count = 0
+        for filename in filenames:
+            if not os.path.isfile(filename) or os.path.islink(filename):
+                continue
+            if subdir == 'share':
+                dirname = os.path.join(template, os.path.dirname(filename)[5:])
+            else:
+                dirname = os.path.join(template, subdir)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            shutil.copy(filename, dirname)
+            count += 1
+            if count == limit:
+                break
+    for name in ('libfoo.la', 'libbar.la'):
+        open(os.path.join(template, 'lib', name), 'w').close()
+    os.symlink('lib', os.path.join(template, 'lib64'))
+
+    package = jhbuild.modtypes.Package('benchmark')
+    package.config = config
+    results = {}
+    for name, func in (('legacy', legacy_install_stages),
+                       ('current', current_install_stages)):
+        best = None
+        for i in range(3):
+            prefix = os.path.join(temp_dir, name, 'prefix')
+            destdir = os.path.join(temp_dir, name, 'root-benchmark')
+            destdir_prefix = os.path.join(destdir, prefix.lstrip(os.sep))
+            if os.path.exists(os.path.join(temp_dir, name)):
+                shutil.rmtree(os.path.join(temp_dir, name))
+            os.makedirs(prefix)
+            shutil.copytree(template, destdir_prefix, symlinks=True)
+            config.prefix = prefix
+            with SyscallCounter() as counter:
+                start = time.time()
+                result = func(package, destdir, destdir_prefix, prefix)
+                elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        results[name] = (result, best, counter.count)
+
+    assert results['legacy'][0] == results['current'][0], 'results differ'
+    report('install stages (%d files)' % len(results['current'][0][2]),
+           results['legacy'][1], results['current'][1])
+    print '%-40s %11d %11d %8.1fx' % (
+            'file system calls', results['legacy'][2], results['current'][2],
+            results['legacy'][2] / float(max(results['current'][2], 1)))
+
+    shutil.rmtree(temp_dir)
+
+
+def legacy_tree_id(branch):
+    from jhbuild.versioncontrol.git import get_git_extra_env
+    from jhbuild.utils.cmds import get_output, check_version
+    try:
+        output = get_output(['git', 'rev-parse', 'HEAD'],
+                cwd=branch.get_checkoutdir(), get_stderr=False,
+                extra_env=get_git_extra_env())
+    except jhbuild.errors.CommandError:
+        return None
+    check_version(['git', '--version'], r'git version ([\d.]+)', '1.5.6',
+                  extra_env=get_git_extra_env())
+    if branch.execute_git_predicate(['git', 'diff', '--exit-code', '--quiet',
+                                     '--ignore-submodules', 'HEAD']):
+        return output.strip()
+    return output.strip() + branch.dirty_branch_suffix
+
+
+def benchmark_git_tree_id():
+    """Revisions of Git checkouts, as queried by build_policy='updated'"""
+    import jhbuild.versioncontrol.git
+    temp_dir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    config = make_config(temp_dir)
+    config.jobs = 4
+    os.environ.setdefault('UNMANGLED_PATH', os.environ['PATH'])
+    os.environ.setdefault('UNMANGLED_LD_LIBRARY_PATH', '')
+    git = ['git', '-c', 'user.name=jhbuild', '-c', 'user.email=jhbuild@localhost']
+    repository = jhbuild.versioncontrol.git.GitRepository(config, 'local',
+                                                          'http://example.org/')
+    branches = []
+    for i in range(50):
+        checkout = os.path.join(config.checkoutroot, 'module%d' % i)
+        subprocess.check_call(['git', 'init', '-q', checkout])
+        for j in range(20):
+            open(os.path.join(checkout, 'file%d' % j), 'w').write('%d\n' % j)
+        subprocess.check_call(['git', 'add', '.'], cwd=checkout)
+        subprocess.check_call(git + ['commit', '-q', '-m', 'first'], cwd=checkout)
+        branches.append(repository.branch('module%d' % i))
+
+    # check_build_policy: is_dirty() and get_revision(), then
+    # process_install: get_revision()
+    def legacy():
+        result = []
+        for branch in branches:
+            legacy_tree_id(branch)
+            result.append(legacy_tree_id(branch))
+            legacy_tree_id(branch)
+        return result
+
+    def current():
+        jhbuild.versioncontrol.git._revision_cache.clear()
+        jhbuild.versioncontrol.git._version_checks.clear()
+        jhbuild.versioncontrol.git.query_revisions(branches, config.jobs)
+        result = []
+        for branch in branches:
+            branch.is_dirty()
+            result.append(branch.tree_id())
+            branch.tree_id()
+        return result
+
+    legacy_result, legacy_time = timed(legacy)
+    result, current_time = timed(current)
+    assert result == legacy_result, 'revisions differ'
+    report('%d checkouts' % len(branches), legacy_time, current_time)
+
+    shutil.rmtree(temp_dir)
+
+
+class ShellBuildScript(object):
+    def execute(self, command, cwd=None):
+        subprocess.check_call(command, shell=True, cwd=cwd,
+                              stdout=open(os.devnull, 'w'))
+
+
+def legacy_unpack_archive(buildscript, localfile, target_directory, checkoutdir):
+    '''unpack_archive before the extraction engine, with a shell pipe into
+    tar(1) in a temporary directory'''
+    final_target_directory = target_directory
+    target_directory = tempfile.mkdtemp(dir=final_target_directory)
+    ext = os.path.splitext(localfile)[-1]
+    if ext == '.xz':
+        buildscript.execute('xzcat -d "%s" | tar xf -' % localfile,
+                cwd=target_directory)
+    elif ext == '.bz2':
+        buildscript.execute('bunzip2 -dc "%s" | tar xf -' % localfile,
+                cwd=target_directory)
+    elif ext == '.gz':
+        buildscript.execute('gzip -dc "%s" | tar xf -' % localfile,
+                cwd=target_directory)
+    elif ext == '.zip':
+        dirname = os.path.join(target_directory, os.path.basename(localfile)[:-4])
+        buildscript.execute('mkdir -p %s' % dirname)
+        buildscript.execute('unzip -u "%s" -d "%s"' % (localfile, dirname),
+                cwd=target_directory)
+    names = os.listdir(target_directory)
+    if len(names) == 1:
+        fileutils.rename(os.path.join(target_directory, names[0]),
+                         os.path.join(final_target_directory, checkoutdir))
+        os.rmdir(target_directory)
+    else:
+        fileutils.rename(target_directory,
+                         os.path.join(final_target_directory, checkoutdir))
+
+
+class ThrottledHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Serves the files of the server directory at the server rate, in
+    bytes per second'''
+
+    def do_GET(self):
+        filename = os.path.join(self.server.directory, self.path.lstrip('/'))
+        data = open(filename, 'rb').read()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        chunk = 65536
+        for i in range(0, len(data), chunk):
+            self.wfile.write(data[i:i + chunk])
+            time.sleep(float(chunk) / self.server.rate)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def benchmark_unpack():
+    """Download and extraction of source archives"""
+    import random
+    import jhbuild.utils.download
+    import jhbuild.utils.unpack
+    temp_dir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    source_dir = os.path.join(temp_dir, 'source')
+    words = ['static', 'int', 'void', 'return', 'const', 'char', 'if', 'else',
+             'gboolean', 'gpointer', 'g_return_if_fail', 'NULL', '{', '}']
+    rand = random.Random(0)
+    for i in range(2000):
+        path = os.path.join(source_dir, 'foo-1.0', 'dir%d' % (i % 50),
+                            'file%d.c' % i)
+        fileutils.mkdir_with_parents(os.path.dirname(path))
+        open(path, 'w').write(' '.join(rand.choice(words) for j in range(2000)))
+    archives = []
+    for ext, command in (('.tar.gz', ['tar', 'czf']),
+                         ('.tar.xz', ['tar', 'cJf']),
+                         ('.tar.bz2', ['tar', 'cjf']),
+                         ('.zip', ['zip', '-qr'])):
+        if not jhbuild.utils.cmds.has_command(command[0]):
+            continue
+        archive = os.path.join(temp_dir, 'foo-1.0' + ext)
+        subprocess.check_call(command + [archive, 'foo-1.0'], cwd=source_dir)
+        archives.append(archive)
+    shutil.rmtree(source_dir)
+    target = os.path.join(temp_dir, 'checkout')
+    tarballs = os.path.join(temp_dir, 'tarballs')
+    os.makedirs(target)
+    os.makedirs(tarballs)
+    buildscript = ShellBuildScript()
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ThrottledHandler)
+    server.directory = temp_dir
+    server.rate = 20 * 1024 * 1024
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    for archive in archives:
+        url = 'http://127.0.0.1:%d/%s' % (server.server_port,
+                                          os.path.basename(archive))
+        localfile = os.path.join(tarballs, os.path.basename(archive))
+
+        def clean():
+            shutil.rmtree(target)
+            os.makedirs(target)
+            if os.path.exists(localfile):
+                os.remove(localfile)
+
+        def legacy():
+            clean()
+            jhbuild.utils.download.download(url, localfile, 'sha256')
+            legacy_unpack_archive(buildscript, localfile, target, 'foo')
+
+        def current():
+            clean()
+            if jhbuild.utils.unpack.can_stream(localfile):
+                extraction = jhbuild.utils.unpack.Extraction(localfile, target,
+                                                             'foo')
+                jhbuild.utils.download.download(url, localfile, 'sha256',
+                                                extraction)
+                extraction.finish()
+            else:
+                jhbuild.utils.download.download(url, localfile, 'sha256')
+                jhbuild.utils.unpack.unpack_archive(buildscript, localfile,
+                                                    target, 'foo')
+
+        dummy, legacy_time = timed(legacy)
+        dummy, current_time = timed(current)
+        assert sum(len(x[2]) for x in os.walk(target)) == 2000
+        report('download and unpack %s' % os.path.basename(archive),
+               legacy_time, current_time)
+
+    server.shutdown()
+    server.server_close()
+    jhbuild.utils.download.close_connections()
+    shutil.rmtree(temp_dir)
+
+
+def legacy_pprint_output(pipe, format_line):
+    '''cmds.pprint_output before the line splitter, slicing the data read
+    after each line'''
+    import select
+    read_set = [pipe.stdout]
+    out_data = ''
+    while read_set:
+        rlist, wlist, xlist = select.select(read_set, [], [])
+        out_chunk = os.read(pipe.stdout.fileno(), 10000)
+        if out_chunk == '':
+            pipe.stdout.close()
+            read_set.remove(pipe.stdout)
+        out_data += out_chunk
+        while '\n' in out_data:
+            pos = out_data.find('\n')
+            format_line(out_data[:pos+1], False)
+            out_data = out_data[pos+1:]
+    if out_data:
+        format_line(out_data, False)
+    return pipe.wait()
+
+
+def benchmark_output_pump():
+    """Reading of command output, as in quiet mode"""
+    import jhbuild.utils.cmds
+    commands = [
+        ('300000 short lines',
+         'for i in range(300000): sys.stdout.write("gcc -c file%d.c\\n" % i)'),
+        ('one 8 MB line', 'sys.stdout.write("x" * (8 << 20) + "\\n")'),
+    ]
+
+    for name, script in commands:
+        command = [sys.executable, '-c', 'import sys\n' + script]
+
+        def legacy():
+            output = []
+            def format_line(line, error_output):
+                output.append(line)
+            p = subprocess.Popen(command, stdout=subprocess.PIPE)
+            legacy_pprint_output(p, format_line)
+            return ''.join(output)
+
+        def current():
+            output = jhbuild.utils.cmds.OutputTail()
+            p = subprocess.Popen(command, stdout=subprocess.PIPE)
+            jhbuild.utils.cmds.pprint_output(p, lambda line, error_output:
+                                             output.append(line))
+            return str(output)
+
+        legacy_result, legacy_time = timed(legacy)
+        result, current_time = timed(current)
+        assert result == legacy_result, 'outputs differ'
+        report(name, legacy_time, current_time)
+
+    # memory kept in quiet mode, where the output was all kept in a list
+    command = [sys.executable, '-c', 'import sys\n' + commands[0][1]]
+
+    def legacy_quiet():
+        output = []
+        p = subprocess.Popen(command, stdout=subprocess.PIPE)
+        jhbuild.utils.cmds.pprint_output(p, lambda line, error_output:
+                                         output.append(line))
+
+    def current_quiet():
+        output = jhbuild.utils.cmds.OutputTail(1000)
+        p = subprocess.Popen(command, stdout=subprocess.PIPE)
+        jhbuild.utils.cmds.pprint_output(p, lambda line, error_output:
+                                         output.append(line))
+
+    legacy_kb = peak_memory(legacy_quiet)
+    current_kb = peak_memory(current_quiet)
+    print '%-40s %9dkB %9dkB' % ('quiet mode memory', legacy_kb, current_kb)
+
+
+def legacy_installed_pkgconfigs():
+    '''systeminstall.get_installed_pkgconfigs before the .pc index, with
+    pkg-config --list-all and --modversion'''
+    proc = subprocess.Popen(['pkg-config', '--list-all'], stdout=subprocess.PIPE,
+                            close_fds=True)
+    stdout = proc.communicate()[0]
+    pkgs = [line.split(None, 1)[0] for line in stdout.splitlines()]
+    try:
+        stdout = subprocess.check_output(['pkg-config', '--modversion'] + pkgs)
+        versions = stdout.splitlines()
+        if len(versions) == len(pkgs):
+            return dict(zip(pkgs, versions))
+    except (subprocess.CalledProcessError, OSError):
+        pass
+    pkgversions = {}
+    for pkg in pkgs:
+        proc = subprocess.Popen(['pkg-config', '--modversion', pkg],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                close_fds=True)
+        pkgversions[pkg] = proc.communicate()[0].strip()
+    return pkgversions
+
+
+def benchmark_pkgconfig():
+    """Versions of the installed pkg-config packages, for sysdeps"""
+    import jhbuild.utils.systeminstall
+    if not jhbuild.utils.cmds.has_command('pkg-config'):
+        return
+    temp_dir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    config = make_config(temp_dir)
+    index = os.path.join(config.top_builddir, 'pkgconfig.pickle')
+
+    def cold():
+        if os.path.exists(index):
+            os.remove(index)
+        return jhbuild.utils.systeminstall.get_installed_pkgconfigs(config)
+
+    def warm():
+        return jhbuild.utils.systeminstall.get_installed_pkgconfigs(config)
+
+    legacy_result, legacy_time = timed(legacy_installed_pkgconfigs)
+    result, cold_time = timed(cold)
+    assert result == legacy_result, 'versions differ'
+    result, warm_time = timed(warm)
+    assert result == legacy_result, 'versions differ'
+    report('%d packages, no index' % len(result), legacy_time, cold_time)
+    report('%d packages, index' % len(result), legacy_time, warm_time)
+
+    shutil.rmtree(temp_dir)
+
+
+def legacy_find_system_packages(systemdependencies):
+    '''cmd_sysdeps._find_system_packages before the dpkg index, with
+    dpkg -S'''
+    patterns = set()
+    for dep_type, value, altdeps in systemdependencies:
+        if dep_type == 'path':
+            patterns.add(value)
+    stdout, stderr = subprocess.Popen(['dpkg', '-S'] + list(patterns),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    found = {}
+    for line in stdout.splitlines():
+        parts = line.strip().split(': ')
+        if len(parts) == 2:
+            found[parts[1]] = parts[0].split(', ')
+    return found
+
+
+def benchmark_dpkg_index():
+    """Owners of the libraries found by ldd, for sysdeps --dump-runtime"""
+    import jhbuild.commands.sysdeps
+    if not os.path.isdir('/var/lib/dpkg/info') or \
+            not jhbuild.utils.cmds.has_command('dpkg'):
+        return
+    temp_dir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    orig_cache_home = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = temp_dir
+    libraries = set()
+    for directory in ('/lib', '/usr/lib', '/lib/x86_64-linux-gnu',
+                      '/usr/lib/x86_64-linux-gnu'):
+        libraries.update(x for x in glob.glob(os.path.join(directory, '*.so*'))
+                         if not os.path.islink(x))
+    systemdependencies = [('path', x, []) for x in sorted(libraries)]
+
+    def current():
+        command = jhbuild.commands.sysdeps.cmd_sysdeps()
+        found, notfound = command._find_system_packages(systemdependencies)
+        return dict((path, sorted(packages))
+                    for path, packages in found.iteritems())
+
+    def legacy():
+        found = legacy_find_system_packages(systemdependencies)
+        return dict((path, sorted(packages))
+                    for path, packages in found.iteritems())
+
+    legacy_result, legacy_time = timed(legacy)
+    result, cold_time = timed(current)
+    assert result == legacy_result, 'owners differ'
+    result, warm_time = timed(current)
+    assert result == legacy_result, 'owners differ'
+    report('%d paths, no index' % len(systemdependencies),
+           legacy_time, cold_time)
+    report('%d paths, index' % len(systemdependencies),
+           legacy_time, warm_time)
+
+    # AptSystemInstall looks up the owner of one file at a time
+    paths = sorted(libraries)[:100]
+    def current_one_at_a_time():
+        index = jhbuild.utils.dpkg.DpkgIndex(
+                filename=jhbuild.utils.dpkg.get_cache_filename())
+        return dict((path, sorted(index.get_owners(path))) for path in paths)
+
+    def legacy_one_at_a_time():
+        found = {}
+        for path in paths:
+            found.update(legacy_find_system_packages([('path', path, [])]))
+        return dict((path, sorted(found.get(path, []))) for path in paths)
+
+    legacy_result, legacy_time = timed(legacy_one_at_a_time)
+    result, current_time = timed(current_one_at_a_time)
+    assert result == legacy_result, 'owners differ'
+    report('%d paths, one at a time' % len(paths), legacy_time, current_time)
+
+    if orig_cache_home is None:
+        del os.environ['XDG_CACHE_HOME']
+    else:
+        os.environ['XDG_CACHE_HOME'] = orig_cache_home
+    shutil.rmtree(temp_dir)
+
+
+def legacy_systemdependencies_met(module_name, sysdeps, config):
+    '''systeminstall.systemdependencies_met before the dependency checker,
+    probing every directory and running gcc and xmlcatalog for each module'''
+    import imp
+    import shlex
+    def get_c_include_search_paths(config):
+        '''returns a list of C include paths (-I) from the environment and the
+        user's config'''
+        def extract_path_from_cflags(args):
+            '''extract the C include paths (-I) from a list of arguments (args)
+            Returns a list of paths'''
+            itr = iter(args.split())
+            paths = []
+            if os.name == 'nt':
+                # shlex.split doesn't handle sep '\' on Windows
+                import string
+                shell_split = string.split
+            else:
+                shell_split = shlex.split
+            try:
+                while True:
+                    arg = itr.next()
+                    if arg.strip() in ['-I', '-isystem']:
+                        # extract paths handling quotes and multiple paths
+                        paths += shell_split(itr.next())[0].split(os.pathsep)
+                    elif arg.startswith('-I'):
+                        paths += shell_split(arg[2:])[0].split(os.pathsep)
+            except StopIteration:
+                pass
+            return paths
+        try:
+            multiarch = subprocess.check_output(['gcc', '-print-multiarch']).strip()
+        except:
+            multiarch = None
+        # search /usr/include and its multiarch subdir (if any) by default
+        paths = [ os.path.join(os.sep, 'usr', 'include')]
+        if multiarch:
+            paths += [ os.path.join(paths[0], multiarch) ]
+        paths += extract_path_from_cflags(os.environ.get('CPPFLAGS', ''))
+        # check include paths incorrectly configured in CFLAGS, CXXFLAGS
+        paths += extract_path_from_cflags(os.environ.get('CFLAGS', ''))
+        paths += extract_path_from_cflags(os.environ.get('CXXFLAGS', ''))
+        # check include paths incorrectly configured in makeargs
+        paths += extract_path_from_cflags(config.makeargs)
+        paths += extract_path_from_cflags(config.module_autogenargs.get
+                                             (module_name, ''))
+        paths += extract_path_from_cflags(config.module_makeargs.get
+                                             (module_name, ''))
+        paths += os.environ.get('C_INCLUDE_PATH', '').split(':')
+        paths += os.environ.get('CPLUS_INCLUDE_PATH', '').split(':')
+        paths = list(set(paths)) # remove duplicates
+        return paths
+
+    c_include_search_paths = None
+    for dep_type, value, altdeps in sysdeps:
+        dep_met = True
+        if dep_type.lower() == 'path':
+            if os.path.split(value)[0]:
+                if not os.path.isfile(value) and not os.access(value, os.X_OK):
+                    dep_met = False
+            else:
+                pathdirs = set(os.environ.get('PATH', '').split(os.pathsep))
+                pathdirs.update(['/sbin', '/usr/sbin'])
+                for path in pathdirs:
+                    filename = os.path.join(path, value)
+                    if os.path.isfile(filename) and os.access(filename, os.X_OK):
+                        break
+                else:
+                    dep_met = False
+        elif dep_type.lower() == 'c_include':
+            if c_include_search_paths is None:
+                c_include_search_paths = get_c_include_search_paths(config)
+            found = False
+            for path in c_include_search_paths:
+                filename = os.path.join(path, value)
+                if os.path.isfile(filename):
+                    found = True
+                    break
+            if not found:
+                dep_met = False
+
+        elif dep_type == 'python2':
+            try:
+                imp.find_module(value)
+            except:
+                dep_met = False
+
+        elif dep_type == 'xml':
+            xml_catalog = '/etc/xml/catalog'
+
+            if not os.path.exists(xml_catalog):
+                for d in os.environ['XDG_DATA_DIRS'].split(':'):
+                    xml_catalog = os.path.join(d, 'xml', 'catalog')
+                    if os.path.exists(xml_catalog):
+                        break
+
+            try:
+                # no xmlcatalog installed will (correctly) fail the check
+                subprocess.check_output(['xmlcatalog', xml_catalog, value])
+
+            except:
+                dep_met = False
+
+        # check alternative dependencies
+        if not dep_met and altdeps:
+            for altdep in altdeps:
+                if legacy_systemdependencies_met(module_name, [ altdep ], config):
+                    dep_met = True
+                    break
+
+        if not dep_met:
+            return False
+
+    return True
+
+
+
+def benchmark_sysdeps():
+    """System dependencies of the modules of gnome-sysdeps-latest.modules"""
+    import jhbuild.utils.systeminstall
+    from jhbuild.modtypes.systemmodule import SystemModule
+    temp_dir = tempfile.mkdtemp(prefix='jhbuild-benchmark-')
+    config = make_config(temp_dir)
+    logging.getLogger().setLevel(logging.ERROR)
+    os.environ.setdefault('XDG_DATA_DIRS', '/usr/share')
+    uri = os.path.join(MODULESETS_DIR, 'gnome-sysdeps-latest.modules')
+    modules = [module for module in
+               jhbuild.moduleset._parse_module_set(config, uri).modules.values()
+               if isinstance(module, SystemModule) and module.pkg_config is None]
+
+    def legacy():
+        return dict((module, legacy_systemdependencies_met(
+                module.name, module.systemdependencies, config))
+                    for module in modules)
+
+    def current():
+        checker = jhbuild.utils.systeminstall.SystemDependencyChecker(config)
+        return checker.check_modules(modules)
+
+    legacy_result, legacy_time = timed(legacy)
+    result, current_time = timed(current)
+    assert result == legacy_result, 'results differ'
+    report('%d system modules' % len(modules), legacy_time, current_time)
+
+    shutil.rmtree(temp_dir)
+
+
+def legacy_find_triggers(trigger_path, manifests):
+    '''BuildScript.run_triggers before the trigger matcher, loading the
+    triggers for each installed module'''
+    triggers_to_run = set()
+    for manifest in manifests:
+        for trig in jhbuild.utils.trigger.load_all(trigger_path):
+            if trig.matches(manifest):
+                triggers_to_run.add(trig.name)
+    return triggers_to_run
+
+
+def benchmark_triggers():
+    """Triggers matching the manifests of the installed modules"""
+    trigger_path = os.path.join(SRCDIR, 'triggers')
+    prefix = '/opt/gnome'
+    manifests = []
+    for i in range(200):
+        manifest = []
+        for j in range(1000):
+            manifest.append('%s/include/module%d/header%d.h' % (prefix, i, j))
+            manifest.append('%s/share/locale/l%d/LC_MESSAGES/module%d.mo' % (prefix, j, i))
+        manifest.append('%s/lib/libmodule%d.so' % (prefix, i))
+        if i % 20 == 0:
+            manifest.append('%s/share/icons/hicolor/48x48/apps/module%d.png' % (prefix, i))
+        manifests.append(manifest)
+
+    def current():
+        matcher = jhbuild.utils.trigger.TriggerMatcher(
+                jhbuild.utils.trigger.load_all(trigger_path))
+        triggers_to_run = set()
+        for manifest in manifests:
+            triggers_to_run.update(x.name for x in matcher.matches(manifest))
+        return triggers_to_run
+
+    legacy_result, legacy_time = timed(legacy_find_triggers, trigger_path,
+                                       manifests)
+    result, current_time = timed(current)
+    assert result == legacy_result, 'triggers differ'
+    report('%d modules, %d files' % (len(manifests), sum(map(len, manifests))),
+           legacy_time, current_time)
+
+
+def main(args):
+    benchmarks = [(name[len('benchmark_'):], func)
+                  for name, func in sorted(globals().items())
+                  if name.startswith('benchmark_')]
+    print '%-40s %11s %11s %9s' % ('', 'before', 'after', 'speedup')
+    for name, func in benchmarks:
+        if args and name not in args:
+            continue
+        print '== %s' % func.__doc__
+        func()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -26,6 +26,7 @@ import jhbuild.frontends.buildscript
 import jhbuild.versioncontrol
 import jhbuild.errors
 import jhbuild.config
+import jhbuild.utils.cmds
 
 class Config(jhbuild.config.Config):
     buildroot = tempfile.mkdtemp(prefix='jhbuild-tests-')
@@ -58,6 +59,28 @@ class Config(jhbuild.config.Config):
     build_targets = ['install']
 
     min_age = None
+    exit_on_error = False
+    jobs = 2
+    jobs_modules = 1
+    prefetch_modules = 0
+    packagedb_backend = 'files'
+    artifact_cache_dir = None
+    artifact_cache_size = 10240
+    debug_store = 'path'
+    incremental_install = False
+    dvcs_mirror_dir = None
+    dvcs_mirror_sync = False
+    dvcs_mirror_jobs = 8
+    dvcs_mirror_timeout = None
+    dvcs_mirror_max_age = 600
+
+    checkout_mode = 'update'
+    module_checkout_mode = {}
+    copy_dir = None
+    shallow_clone = False
+    sticky_date = None
+    branches = {}
+    repos = {}
 
     prefix = os.path.join(buildroot, 'prefix')
     top_builddir = os.path.join(buildroot, '_jhbuild')
@@ -73,6 +96,9 @@ class PackageEntry:
         self.manifest = manifest # list of strings
         self.metadata = metadata # hash of string to value
 
+    def get_manifest(self):
+        return self.manifest
+
 class PackageDB:
     time_delta = 0
 
@@ -88,8 +114,9 @@ class PackageDB:
             return None
         return entry.version == version
 
-    def add(self, package, version, manifest, configure_cmd=None):
-        entry = PackageEntry(package, version, [], {})
+    def add(self, package, version, manifest, configure_cmd=None,
+            systemdependencies=None, branch=None, module_hash=None):
+        entry = PackageEntry(package, version, manifest or [], {})
         entry.metadata['installed-date'] = time.time()+self.time_delta
         self.entries[package] = entry
 
@@ -106,8 +133,12 @@ class PackageDB:
         '''Return entry if package is installed, otherwise return None.'''
         return self.entries.get(package)
 
+    def collisions(self, package, contents):
+        return []
+
 class BuildScript(jhbuild.frontends.buildscript.BuildScript):
     execute_is_failure = False
+    supports_parallel_modules = True
 
     def __init__(self, config, module_list, moduleset):
         self.config = config
@@ -130,6 +161,14 @@ class BuildScript(jhbuild.frontends.buildscript.BuildScript):
         self.actions[-1] = self.actions[-1] + ' [error]'
         return 'fail'
 
+class CommandBuildScript(BuildScript):
+    '''A BuildScript that runs the commands, hiding their output.'''
+
+    def execute(self, command, hint=None, cwd=None, extra_env=None):
+        if extra_env is not None:
+            extra_env = dict((k, v) for k, v in extra_env.items() if v is not None)
+        jhbuild.utils.cmds.get_output(command, cwd=cwd, extra_env=extra_env)
+
 class MockModule(jhbuild.modtypes.Package):
     PHASE_FORCE_CHECKOUT = 'force-checkout'
     PHASE_CHECKOUT       = 'checkout'
@@ -143,8 +182,11 @@ class MockModule(jhbuild.modtypes.Package):
 
     def do_checkout(self, buildscript):
         buildscript.set_action(_('Checking out'), self)
+        if not buildscript.wait_for_prefetch(self):
+            self.branch.checkout(buildscript)
         if self.check_build_policy(buildscript) == self.PHASE_DONE:
             raise jhbuild.errors.SkipToEnd()
+        self.find_artifact(buildscript)
     do_checkout.error_phases = [PHASE_FORCE_CHECKOUT]
 
     def skip_checkout(self, buildscript, last_phase):
@@ -152,6 +194,7 @@ class MockModule(jhbuild.modtypes.Package):
         if not self.branch.may_checkout(buildscript):
             if self.check_build_policy(buildscript) == self.PHASE_DONE:
                 raise jhbuild.errors.SkipToEnd()
+            self.find_artifact(buildscript)
             return True
         return False
 
@@ -181,6 +224,24 @@ class MockModule(jhbuild.modtypes.Package):
     do_check.error_phases = [PHASE_CONFIGURE]
 
 
+class MockDestdirModule(MockModule):
+    '''Module installing prefix/share/<name> through DESTDIR'''
+
+    def __init__(self, *args, **kwargs):
+        MockModule.__init__(self, *args, **kwargs)
+        self.supports_install_destdir = True
+
+    def do_install(self, buildscript):
+        buildscript.set_action(_('Installing'), self)
+        destdir = self.prepare_installroot(buildscript)
+        dirname = os.path.join(destdir, buildscript.config.prefix.lstrip(os.sep),
+                               'share')
+        os.makedirs(dirname)
+        open(os.path.join(dirname, self.name), 'w').write(self.name)
+        self.process_install(buildscript, self.get_revision())
+    do_install.depends = [MockModule.PHASE_BUILD]
+
+
 class Branch(jhbuild.versioncontrol.Branch):
     def __init__(self, tmpdir):
         self._tmpdir = tmpdir
@@ -21,11 +21,20 @@
 
 
 import os
+import BaseHTTPServer
+import SocketServer
+import StringIO
+import errno
+import hashlib
 import shutil
 import logging
 import subprocess
+import stat
 import sys
+import tarfile
 import tempfile
+import time
+import threading
 import unittest
 
 import __builtin__
@@ -40,17 +49,33 @@ sys.path.insert(0, SRCDIR)
 
 # Override jhbuild.utils.systeminstall with this module 'tests'
 import jhbuild.utils.systeminstall
+real_systeminstall = jhbuild.utils.systeminstall
 sys.modules['jhbuild.utils.systeminstall'] = sys.modules[__name__]
 sys.modules['jhbuild.utils'].systeminstall = sys.modules[__name__]
 
-from jhbuild.errors import UsageError, CommandError
+from jhbuild.commands.sanitycheck import inpath
+from jhbuild.errors import UsageError, CommandError, BuildStateError, FatalError
 from jhbuild.modtypes import Package
 from jhbuild.modtypes.autotools import AutogenModule
 from jhbuild.modtypes.distutils import DistutilsModule
 import jhbuild.config
 import jhbuild.frontends.terminal
 import jhbuild.moduleset
+import jhbuild.utils.artifactcache
 import jhbuild.utils.cmds
+import jhbuild.utils.debugstore
+import jhbuild.utils.dpkg
+import jhbuild.utils.download
+import jhbuild.utils.elf
+import jhbuild.utils.fileutils
+import jhbuild.utils.inventory
+import jhbuild.utils.modulesetcache
+import jhbuild.utils.packagedb
+import jhbuild.utils.pkgconfig
+import jhbuild.utils.trigger
+import jhbuild.utils.unpack
+import jhbuild.versioncontrol
+import jhbuild.versioncontrol.git
 import jhbuild.versioncontrol.tarball
 
 def uencode(s):
@@ -182,6 +207,32 @@ class ModuleOrderingTestCase(JhbuildConfigTestCase):
         self.moduleset.modules['qux'].dependencies = ['quux']
         self.assertEqual(self.get_module_list(['foo']), ['baz', 'bar', 'quux', 'qux', 'foo'])
 
+    def test_dependency_chain_modified(self):
+        '''A chain of dependencies modified after a first resolution'''
+        self.moduleset.modules['foo'].dependencies = ['bar']
+        self.assertEqual(self.get_module_list(['foo']), ['bar', 'foo'])
+        self.moduleset.modules['foo'].dependencies.append('baz')
+        self.assertEqual(self.get_module_list(['foo']), ['bar', 'baz', 'foo'])
+        self.moduleset.modules['foo'].dependencies = ['qux']
+        self.assertEqual(self.get_module_list(['foo']), ['qux', 'foo'])
+
+    def test_reverse_dependencies(self):
+        '''Reverse dependencies of a module'''
+        self.moduleset.modules['foo'].dependencies = ['bar', 'qux']
+        self.moduleset.modules['bar'].dependencies = ['baz']
+        self.moduleset.modules['qux'].suggests = ['baz']
+        self.moduleset.modules['quux'].after = ['baz']
+        self.assertEqual(self.moduleset.get_reverse_dependencies('baz'),
+                         set(['bar']))
+        self.assertEqual(self.moduleset.get_reverse_dependencies('baz',
+                                transitive=True), set(['bar', 'foo']))
+        self.assertEqual(self.moduleset.get_reverse_dependencies('baz',
+                                transitive=True, include_suggests=True),
+                         set(['bar', 'qux', 'foo']))
+        self.moduleset.modules['corge'].dependencies = ['foo']
+        self.assertEqual(self.moduleset.get_reverse_dependencies('baz',
+                                transitive=True), set(['bar', 'foo', 'corge']))
+
     def test_dependency_cycle(self):
         '''A chain of dependencies with a cycle'''
         self.moduleset.modules['foo'].dependencies = ['bar', 'qux']
@@ -315,6 +366,286 @@ class ModuleOrderingTestCase(JhbuildConfigTestCase):
                          ['baz', 'syspkgbravo', 'bar', 'foo'])
 
 
+class ModuleSetLoadTestCase(JhbuildConfigTestCase):
+    '''Loading modulesets'''
+
+    def setUp(self):
+        super(ModuleSetLoadTestCase, self).setUp()
+        self.temp_dir = self.make_temp_dir()
+        self.config.top_builddir = os.path.join(self.temp_dir, '_jhbuild')
+        self.config.conditions = set()
+        self.config.nonetwork = True
+        self.uri = os.path.join(self.temp_dir, 'test.modules')
+        self.write_moduleset('test.modules', """<moduleset>
+  <include href="included.modules"/>
+  <metamodule id="foo">
+    <dependencies>
+      <dep package="bar"/>
+      <if condition-set="baz">
+        <dep package="baz"/>
+      </if>
+    </dependencies>
+  </metamodule>
+</moduleset>""")
+        self.write_moduleset('included.modules', """<moduleset>
+  <metamodule id="bar"/>
+  <metamodule id="baz"/>
+</moduleset>""")
+
+    def write_moduleset(self, name, content):
+        fp = open(os.path.join(self.temp_dir, name), 'w')
+        fp.write(content)
+        fp.close()
+
+    def load(self):
+        return jhbuild.moduleset._load_module_set(self.config, self.uri)
+
+    def test_cached(self):
+        '''Loading a moduleset from the cache'''
+        modules = self.load()
+        parse_module_set = jhbuild.moduleset._parse_module_set
+        def fail(*args, **kwargs):
+            self.fail('moduleset parsed again')
+        jhbuild.moduleset._parse_module_set = fail
+        try:
+            cached_modules = self.load()
+        finally:
+            jhbuild.moduleset._parse_module_set = parse_module_set
+        self.assertEqual(sorted(cached_modules.keys()), ['bar', 'baz', 'foo'])
+        self.assertEqual(cached_modules['foo'].dependencies,
+                         modules['foo'].dependencies)
+
+    def test_included_file_changed(self):
+        '''Loading a moduleset after an included moduleset changed'''
+        self.load()
+        self.write_moduleset('included.modules', """<moduleset>
+  <metamodule id="bar"/>
+  <metamodule id="baz"/>
+  <metamodule id="qux"/>
+</moduleset>""")
+        self.assertEqual(sorted(self.load().keys()), ['bar', 'baz', 'foo', 'qux'])
+
+    def test_conditions_changed(self):
+        '''Loading a moduleset after conditions changed'''
+        self.assertEqual(self.load()['foo'].dependencies, ['bar'])
+        self.config.conditions = set(['baz'])
+        self.assertEqual(self.load()['foo'].dependencies, ['bar', 'baz'])
+
+    def test_unrelated_config_changed(self):
+        '''Loading a moduleset after options not used by parsing changed'''
+        self.load()
+        self.config.jobs = self.config.jobs + 1
+        self.config.makeargs = '-k'
+        parse_module_set = jhbuild.moduleset._parse_module_set
+        def fail(*args, **kwargs):
+            self.fail('moduleset parsed again')
+        jhbuild.moduleset._parse_module_set = fail
+        try:
+            self.assertEqual(sorted(self.load().keys()), ['bar', 'baz', 'foo'])
+        finally:
+            jhbuild.moduleset._parse_module_set = parse_module_set
+
+    def test_parse_keys(self):
+        '''Configuration variables read while parsing modulesets'''
+        self.write_moduleset('test.modules', """<moduleset>
+  <repository type="git" name="git" href="git://example.org/" default="yes">
+    <mirror type="svn" href="svn://example.org/"/>
+  </repository>
+  <repository type="svn" name="svn" href="svn://example.org/"/>
+  <repository type="cvs" name="cvs" password=""
+              cvsroot=":pserver:anonymous@example.org:/cvs"/>
+  <repository type="tarball" name="tarballs" href="http://example.org/"/>
+  <repository type="pip" name="pip"/>
+  <repository type="system" name="system"/>
+  <autotools id="autotools"><branch/></autotools>
+  <cmake id="cmake"><branch/></cmake>
+  <meson id="meson"><branch/></meson>
+  <distutils id="distutils"><branch/></distutils>
+  <waf id="waf"><branch/></waf>
+  <qmake id="qmake"><branch/></qmake>
+  <perl id="perl"><branch/></perl>
+  <node id="node"><branch/></node>
+  <pip id="pip"><branch repo="pip" version="1.0"/></pip>
+  <autotools id="svn"><branch repo="svn"/></autotools>
+  <autotools id="cvs"><branch repo="cvs"/></autotools>
+  <autotools id="tarball"><branch repo="tarballs" module="foo-1.0.tar.xz" version="1.0"/></autotools>
+  <tarball id="oldtarball" version="1.0"><source href="http://example.org/foo-1.0.tar.xz"/></tarball>
+  <systemmodule id="system"><branch repo="system" version="1.0"/></systemmodule>
+  <testmodule id="test" type="ldtp"><branch/></testmodule>
+  <metamodule id="meta"/>
+</moduleset>""")
+        config = self.config
+        defaults = {'__file__': jhbuild.config._defaults_file,
+                    'addpath': lambda *args: None,
+                    'prependpath': lambda *args: None}
+        execfile(jhbuild.config._defaults_file, defaults)
+        for key in jhbuild.config._known_keys:
+            if key in defaults and not hasattr(config, key):
+                setattr(config, key, defaults[key])
+        # the CVS password goes to ~/.cvspass
+        os.environ['HOME'] = self.temp_dir
+        read = set()
+        class RecordingConfig(object):
+            def __getattr__(self, name):
+                read.add(name)
+                return getattr(config, name)
+        jhbuild.moduleset._parse_module_set(RecordingConfig(), self.uri)
+        # these are read to download modulesets and to open the package
+        # database, they do not change the modules
+        read.difference_update(['nonetwork', 'top_builddir',
+                                'packagedb_backend'])
+        self.assertEqual(
+            sorted(read.difference(jhbuild.utils.modulesetcache._parse_keys)),
+            [])
+
+    def test_toplevel_conditions(self):
+        '''Loading a moduleset with conditions around modules'''
+        self.write_moduleset('included.modules', """<moduleset>
+  <if condition-set="qux">
+    <metamodule id="bar">
+      <dependencies>
+        <dep package="qux"/>
+      </dependencies>
+    </metamodule>
+    <metamodule id="qux"/>
+  </if>
+  <metamodule id="bar"/>
+  <metamodule id="baz"/>
+</moduleset>""")
+        modules = self.load()
+        self.assertEqual(sorted(modules.keys()), ['bar', 'baz', 'foo'])
+        self.assertEqual(modules['bar'].dependencies, [])
+        self.config.conditions = set(['qux'])
+        modules = self.load()
+        self.assertEqual(sorted(modules.keys()), ['bar', 'baz', 'foo', 'qux'])
+        # elements of <if> come after the other ones
+        self.assertEqual(modules['bar'].dependencies, ['qux'])
+
+    def test_redirect(self):
+        '''Loading a moduleset redirecting to another one'''
+        self.write_moduleset('redirected.modules', """<moduleset>
+  <metamodule id="foo"/>
+  <redirect href="%s"/>
+</moduleset>""" % os.path.join(self.temp_dir, 'included.modules'))
+        self.uri = os.path.join(self.temp_dir, 'redirected.modules')
+        self.assertEqual(sorted(self.load().keys()), ['bar', 'baz'])
+
+
+class PackageDBTestCase(JhbuildConfigTestCase):
+    '''Registry of installed packages'''
+
+    def setUp(self):
+        super(PackageDBTestCase, self).setUp()
+        self.temp_dir = self.make_temp_dir()
+        self.config.prefix = os.path.join(self.temp_dir, 'prefix')
+        self.dbfile = os.path.join(self.temp_dir, '_jhbuild', 'packagedb.xml')
+        self.sqlite_dbfile = os.path.join(self.temp_dir, '_jhbuild',
+                                          'packagedb.sqlite')
+
+    def fill(self, db):
+        db.add('foo', '1.0', [os.path.join(self.config.prefix, 'foo'),
+                              os.path.join(self.config.prefix, 'share')],
+               configure_cmd='./configure', branch={'url': 'foo.git'})
+        db.add('bar', '2.0', [os.path.join(self.config.prefix, 'share')],
+               systemdependencies=[('path', 'bar', [('path', 'baz', [])])],
+               module_hash='abcd')
+
+    def assertSameEntries(self, db1, db2):
+        for package in ('foo', 'bar', 'baz'):
+            entry1, entry2 = db1.get(package), db2.get(package)
+            if entry1 is None:
+                self.assertEqual(entry2, None)
+                continue
+            self.assertEqual(entry1.version, entry2.version)
+            self.assertEqual(entry1.metadata.keys(), entry2.metadata.keys())
+            # dates are saved to the second in files
+            self.assertTrue(abs(entry1.metadata['installed-date'] -
+                                entry2.metadata['installed-date']) < 1)
+            self.assertEqual(entry1.metadata.get('configure-hash'),
+                             entry2.metadata.get('configure-hash'))
+            self.assertEqual(entry1.metadata.get('module-hash'),
+                             entry2.metadata.get('module-hash'))
+            self.assertEqual(entry1.manifest, entry2.manifest)
+            self.assertEqual(entry1.branch, entry2.branch)
+            self.assertEqual(entry1.systemdependencies,
+                             entry2.systemdependencies)
+
+    def test_cache(self):
+        '''Reusing entries until their files change'''
+        db = jhbuild.utils.packagedb.PackageDB(self.dbfile, self.config)
+        self.fill(db)
+        entry = db.get('foo')
+        self.assertTrue(db.get('foo') is entry)
+        db.add('foo', '1.1', [])
+        self.assertEqual(db.get('foo').version, '1.1')
+        self.assertEqual(entry.version, '1.0')
+        other_db = jhbuild.utils.packagedb.PackageDB(self.dbfile, self.config)
+        other_db.add('bar', '2.1', [])
+        self.assertEqual(db.get('bar').version, '2.1')
+        other_db.uninstall('bar')
+        self.assertEqual(db.get('bar'), None)
+
+    def test_owners(self):
+        '''Looking up which packages installed files'''
+        for db in (jhbuild.utils.packagedb.PackageDB(self.dbfile, self.config),
+                   jhbuild.utils.packagedb.SQLitePackageDB(self.sqlite_dbfile,
+                                                           self.config)):
+            self.fill(db)
+            share = os.path.join(self.config.prefix, 'share')
+            self.assertEqual(db.owners(share), ['bar', 'foo'])
+            self.assertEqual(db.collisions('baz', ['share', 'lib/', 'foo']),
+                             [('share', ['bar', 'foo']), ('foo', ['foo'])])
+            db.add('baz', '1.0', ['lib/', 'lib/libbaz.so'])
+            self.assertEqual(db.owners(os.path.join(self.config.prefix, 'lib')),
+                             ['baz'])
+            self.assertEqual(db.collisions('foo', ['foo', 'lib/libbaz.so']),
+                             [('lib/libbaz.so', ['baz'])])
+            db.uninstall('foo')
+            self.assertEqual(db.owners(share), ['bar'])
+            self.assertEqual(db.owners(os.path.join(self.config.prefix, 'foo')), [])
+
+        # the index saved by the first lookup is updated from the changes
+        # made by other processes
+        db = jhbuild.utils.packagedb.PackageDB(self.dbfile, self.config)
+        self.assertEqual(db.owners(share), ['bar'])
+        other_db = jhbuild.utils.packagedb.PackageDB(self.dbfile, self.config)
+        other_db.add('bar', '2.1', ['lib/libbaz.so'])
+        db = jhbuild.utils.packagedb.PackageDB(self.dbfile, self.config)
+        self.assertEqual(db.owners(share), [])
+        self.assertEqual(db.owners('lib/libbaz.so'), ['bar', 'baz'])
+
+    def test_sqlite(self):
+        '''Recording packages in a SQLite database'''
+        db = jhbuild.utils.packagedb.PackageDB(self.dbfile, self.config)
+        sqlite_db = jhbuild.utils.packagedb.SQLitePackageDB(self.sqlite_dbfile,
+                                                            self.config)
+        self.fill(sqlite_db)
+        self.fill(db)
+        self.assertSameEntries(db, sqlite_db)
+        self.assertTrue(sqlite_db.check('bar', '2.0', 'abcd'))
+        self.assertFalse(sqlite_db.check('bar', '1.0'))
+        share = os.path.join(self.config.prefix, 'share')
+        self.assertEqual(sqlite_db.owners(share), ['bar', 'foo'])
+        self.assertEqual(db.owners(share), ['bar', 'foo'])
+
+        sqlite_db.uninstall('foo')
+        self.assertEqual(sqlite_db.get('foo'), None)
+        sqlite_db = jhbuild.utils.packagedb.SQLitePackageDB(self.sqlite_dbfile,
+                                                            self.config)
+        self.assertEqual(sqlite_db.get('foo'), None)
+        self.assertEqual(sqlite_db.owners(share), ['bar'])
+        db.uninstall('foo')
+        self.assertSameEntries(db, sqlite_db)
+
+    def test_sqlite_import(self):
+        '''Importing packages recorded in files into a SQLite database'''
+        db = jhbuild.utils.packagedb.PackageDB(self.dbfile, self.config)
+        self.fill(db)
+        sqlite_db = jhbuild.utils.packagedb.SQLitePackageDB(self.sqlite_dbfile,
+                                                            self.config)
+        self.assertSameEntries(db, sqlite_db)
+
+
 class BuildTestCase(JhbuildConfigTestCase):
     def setUp(self):
         super(BuildTestCase, self).setUp()
@@ -570,6 +901,910 @@ class TwoModulesTestCase(BuildTestCase):
                  'bar:Checking out', 'bar:Configuring',
                  'bar:Building', 'bar:Checking', 'bar:Installing'])
 
+    def test_build_parallel_dependent_modules(self):
+        '''Building two dependent autotools modules in parallel'''
+        self.modules[1].dependencies = ['foo']
+        self.assertEqual(self.build(jobs_modules = 2),
+                ['foo:Checking out', 'foo:Configuring',
+                 'foo:Building', 'foo:Installing',
+                 'bar:Checking out', 'bar:Configuring',
+                 'bar:Building', 'bar:Installing',
+                ])
+
+    def test_build_parallel_independent_modules(self):
+        '''Building two independent autotools modules in parallel'''
+        actions = self.build(jobs_modules = 2)
+        self.assertEqual(sorted(actions),
+                sorted(['foo:Checking out', 'foo:Configuring',
+                        'foo:Building', 'foo:Installing',
+                        'bar:Checking out', 'bar:Configuring',
+                        'bar:Building', 'bar:Installing',
+                       ]))
+        for name in ('foo', 'bar'):
+            self.assertEqual([x for x in actions if x.startswith(name + ':')],
+                    ['%s:Checking out' % name, '%s:Configuring' % name,
+                     '%s:Building' % name, '%s:Installing' % name])
+
+    def test_build_parallel_failure_dependent_modules(self):
+        '''Building two dependent autotools modules in parallel, with failure in first'''
+        self.modules[1].dependencies = ['foo']
+
+        def build_error(buildscript, *args):
+            self.modules[0].do_build_orig(buildscript, *args)
+            raise CommandError('Mock Command Error Exception')
+        build_error.depends = self.modules[0].do_build.depends
+        build_error.error_phases = self.modules[0].do_build.error_phases
+        self.modules[0].do_build_orig = self.modules[0].do_build
+        self.modules[0].do_build = build_error
+
+        self.assertEqual(self.build(jobs_modules = 2),
+                ['foo:Checking out', 'foo:Configuring', 'foo:Building [error]'])
+
+    def test_build_parallel_unsupported_frontend(self):
+        '''Building in parallel with a frontend that does not support it'''
+        mock.BuildScript.supports_parallel_modules = False
+        try:
+            self.assertRaises(FatalError, self.build, jobs_modules = 2)
+        finally:
+            mock.BuildScript.supports_parallel_modules = True
+
+    def test_build_prefetch(self):
+        '''Building two autotools modules, checking out the second in advance'''
+        checkouts = []
+        class RecordingBranch(mock.Branch):
+            def checkout(self, buildscript):
+                checkouts.append((self._tmpdir, threading.current_thread().name))
+        self.modules[0].branch = RecordingBranch(self.foo_branch.srcdir)
+        self.modules[1].branch = RecordingBranch(self.branch.srcdir)
+        self.assertEqual(self.build(prefetch_modules = 1),
+                ['foo:Checking out', 'foo:Configuring',
+                 'foo:Building', 'foo:Installing',
+                 'bar:Checking out', 'bar:Configuring',
+                 'bar:Building', 'bar:Installing',
+                ])
+        self.assertEqual(sorted(checkouts),
+                sorted([(self.foo_branch.srcdir, threading.current_thread().name),
+                        (self.branch.srcdir, 'jhbuild-prefetch-bar')]))
+
+    def test_build_prefetch_skipped_checkout(self):
+        '''Building two autotools modules, the second skipping its checkout'''
+        checkouts = []
+        class RecordingBranch(mock.Branch):
+            def checkout(self, buildscript):
+                checkouts.append((self._tmpdir, threading.current_thread().name))
+        self.modules[0].branch = RecordingBranch(self.foo_branch.srcdir)
+        self.modules[1].branch = RecordingBranch(self.branch.srcdir)
+        self.modules[1].skip_checkout = lambda buildscript, last_phase: True
+        self.assertEqual(self.build(prefetch_modules = 1),
+                ['foo:Checking out', 'foo:Configuring',
+                 'foo:Building', 'foo:Installing',
+                 'bar:Configuring', 'bar:Building', 'bar:Installing',
+                ])
+        self.assertEqual(checkouts,
+                [(self.foo_branch.srcdir, threading.current_thread().name)])
+
+    def test_build_prefetch_failure(self):
+        '''Building two autotools modules, with failure in advance checkout'''
+        checkouts = []
+        class FailingBranch(mock.Branch):
+            def checkout(self, buildscript):
+                checkouts.append(threading.current_thread().name)
+                if len(checkouts) == 1:
+                    raise CommandError('Mock Command Error Exception')
+        self.modules[1].branch = FailingBranch(self.branch.srcdir)
+        self.assertEqual(self.build(prefetch_modules = 1),
+                ['foo:Checking out', 'foo:Configuring',
+                 'foo:Building', 'foo:Installing',
+                 'bar:Checking out', 'bar:Configuring',
+                 'bar:Building', 'bar:Installing',
+                ])
+        self.assertEqual(checkouts,
+                ['jhbuild-prefetch-bar', threading.current_thread().name])
+
+
+class TriggerTestCase(BuildTestCase):
+    '''Running post-installation triggers'''
+
+    def setUp(self):
+        super(TriggerTestCase, self).setUp()
+        self.trigger_dir = self.make_temp_dir()
+        self.write_trigger('icons', '# REMatch: /share/icons/.*\\.png$\n')
+        self.write_trigger('schemas', '# IfExecutable: sh\n'
+                           '# LiteralMatch: /glib-2.0/schemas/\n')
+        self.write_trigger('missing', '# IfExecutable: jhbuild-missing-command\n'
+                           '# LiteralMatch: /share/\n')
+        self.orig_triggers = os.environ.get('JHBUILD_TRIGGERS')
+        os.environ['JHBUILD_TRIGGERS'] = self.trigger_dir
+        self.modules = [
+                self.make_module('foo', ['/prefix/share/icons/foo.png']),
+                self.make_module('bar', ['/prefix/share/icons/bar.png',
+                                         '/prefix/share/glib-2.0/schemas/bar.xml']),
+                self.make_module('baz', ['/prefix/bin/baz'])]
+
+    def tearDown(self):
+        if self.orig_triggers is None:
+            del os.environ['JHBUILD_TRIGGERS']
+        else:
+            os.environ['JHBUILD_TRIGGERS'] = self.orig_triggers
+        super(TriggerTestCase, self).tearDown()
+
+    def write_trigger(self, name, keys):
+        open(os.path.join(self.trigger_dir, name + '.trigger'), 'w').write(
+                keys + 'true\n')
+
+    def make_module(self, name, manifest):
+        module = mock.MockModule(name, branch=self.branch)
+        module.config = self.config
+        def do_install(buildscript):
+            buildscript.set_action(_('Installing'), module)
+            buildscript.moduleset.packagedb.add(name, module.get_revision(),
+                                                manifest)
+        do_install.depends = [mock.MockModule.PHASE_BUILD]
+        module.do_install = do_install
+        return module
+
+    def build(self, **kwargs):
+        self.config.build_targets = ['install']
+        for k in kwargs:
+            setattr(self.config, k, kwargs[k])
+        self.config.update_build_targets()
+        self.packagedb = mock.PackageDB()
+        self.moduleset = jhbuild.moduleset.ModuleSet(self.config, db=self.packagedb)
+        self.buildscript = mock.BuildScript(self.config, self.modules, self.moduleset)
+        def execute(command, hint=None, cwd=None, extra_env=None):
+            name = os.path.basename(command[-1])[:-len('.trigger')]
+            self.buildscript.actions.append('trigger:%s' % name)
+        self.buildscript.execute = execute
+        self.buildscript.build()
+        return [x for x in self.buildscript.actions
+                if x.startswith('trigger:') or x.endswith(':Installing')]
+
+    def test_matcher(self):
+        '''Matching manifests against all the triggers at once'''
+        triggers = jhbuild.utils.trigger.load_all(self.trigger_dir)
+        self.assertEqual([x.name for x in triggers], ['icons', 'missing', 'schemas'])
+        matcher = jhbuild.utils.trigger.TriggerMatcher(triggers)
+        manifests = [['/prefix/share/icons/foo.png'],
+                     ['/prefix/share/icons/foo.svg', '/prefix/bin/foo'],
+                     ['/prefix/share/glib-2.0/schemas/foo.xml',
+                      '/prefix/share/icons/bar.png'],
+                     []]
+        for manifest in manifests:
+            self.assertEqual(matcher.matches(manifest),
+                             [x for x in triggers if x.matches(manifest)])
+        self.assertEqual([x.name for x in matcher.matches(manifests[2])],
+                         ['icons', 'schemas'])
+
+        # expressions with group references are matched too
+        self.write_trigger('group', '# REMatch: /(lib|share)/\\1/\n')
+        triggers = jhbuild.utils.trigger.load_all(self.trigger_dir)
+        matcher = jhbuild.utils.trigger.TriggerMatcher(triggers)
+        self.assertEqual([x.name for x in matcher.matches(['/prefix/lib/lib/x'])],
+                         ['group'])
+        self.assertEqual(matcher.matches(['/prefix/lib/share/x']), [])
+
+    def test_build(self):
+        '''Running the triggers once, at the end of the build'''
+        self.assertEqual(self.build(),
+                ['foo:Installing', 'bar:Installing', 'baz:Installing',
+                 'trigger:icons', 'trigger:schemas'])
+
+    def test_build_dependent_modules(self):
+        '''Running the triggers before the modules depending on them'''
+        self.modules[2].dependencies = ['foo']
+        self.assertEqual(self.build(),
+                ['foo:Installing', 'bar:Installing', 'trigger:icons',
+                 'baz:Installing', 'trigger:schemas'])
+
+    def test_build_parallel(self):
+        '''Running the triggers of modules built in parallel'''
+        self.modules[2].dependencies = ['foo', 'bar']
+        actions = self.build(jobs_modules=2)
+        self.assertEqual(sorted(actions[:2]), ['bar:Installing', 'foo:Installing'])
+        self.assertEqual(actions[2:],
+                         ['trigger:icons', 'trigger:schemas', 'baz:Installing'])
+
+    def test_build_single_module(self):
+        '''Running the triggers of a single module after its installation'''
+        self.modules = self.modules[1:2]
+        self.assertEqual(self.build(),
+                ['bar:Installing', 'trigger:icons', 'trigger:schemas'])
+
+    def test_build_interrupted(self):
+        '''Running the triggers of the installed modules when the build stops'''
+        def do_install(buildscript):
+            raise KeyboardInterrupt
+        do_install.depends = [mock.MockModule.PHASE_BUILD]
+        self.modules[2].do_install = do_install
+        self.assertRaises(KeyboardInterrupt, self.build)
+        self.assertEqual([x for x in self.buildscript.actions
+                          if x.startswith('trigger:') or x.endswith(':Installing')],
+                ['foo:Installing', 'bar:Installing',
+                 'trigger:icons', 'trigger:schemas'])
+
+        # a failing trigger does not hide the error that stopped the build
+        execute = mock.BuildScript.execute
+        def failing_execute(self, command, hint=None, cwd=None, extra_env=None):
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+        mock.BuildScript.execute = failing_execute
+        try:
+            self.config.build_targets = ['install']
+            self.config.update_build_targets()
+            self.buildscript = mock.BuildScript(self.config, self.modules,
+                                                jhbuild.moduleset.ModuleSet(
+                                                        self.config, db=mock.PackageDB()))
+            self.assertRaises(KeyboardInterrupt, self.buildscript.build)
+        finally:
+            mock.BuildScript.execute = execute
+
+
+class ArtifactCacheTestCase(BuildTestCase):
+    '''Installing modules from the artifact cache'''
+
+    def setUp(self):
+        super(ArtifactCacheTestCase, self).setUp()
+        temp_dir = self.make_temp_dir()
+        self.config.prefix = os.path.join(temp_dir, 'prefix')
+        self.config.top_builddir = os.path.join(temp_dir, '_jhbuild')
+        self.config.artifact_cache_dir = os.path.join(temp_dir, 'artifacts')
+        os.makedirs(self.config.prefix)
+        os.makedirs(self.config.top_builddir)
+        self.foo_branch = mock.Branch(os.path.join(self.config.buildroot, 'nonexistent-foo'))
+        self.modules = [mock.MockDestdirModule('foo', branch=self.foo_branch),
+                        mock.MockDestdirModule('bar', branch=self.branch,
+                                               dependencies=['foo'])]
+        self.packagedb = mock.PackageDB()
+        self.moduleset = jhbuild.moduleset.ModuleSet(self.config, db=self.packagedb)
+        for module in self.modules:
+            module.config = self.config
+            self.moduleset.add(module)
+
+    def test_build(self):
+        '''Installing unchanged modules from the cache'''
+        self.assertEqual(self.build(),
+                ['foo:Checking out', 'foo:Configuring',
+                 'foo:Building', 'foo:Installing',
+                 'bar:Checking out', 'bar:Configuring',
+                 'bar:Building', 'bar:Installing'])
+        foo = os.path.join(self.config.prefix, 'share', 'foo')
+        os.unlink(foo)
+        self.assertEqual(self.build(),
+                ['foo:Checking out', 'foo:Installing from artifact cache',
+                 'bar:Checking out', 'bar:Installing from artifact cache'])
+        self.assertTrue(os.path.exists(foo))
+        self.assertTrue(self.packagedb.get('foo'))
+
+        # a change in a dependency invalidates the modules depending on it
+        self.modules[0].module_hash = 'changed'
+        self.assertEqual(self.build(),
+                ['foo:Checking out', 'foo:Configuring',
+                 'foo:Building', 'foo:Installing',
+                 'bar:Checking out', 'bar:Configuring',
+                 'bar:Building', 'bar:Installing'])
+
+    def test_build_no_network(self):
+        '''Installing from the cache without network'''
+        self.build()
+        self.assertEqual(self.build(nonetwork=True),
+                ['foo:Installing from artifact cache',
+                 'bar:Installing from artifact cache'])
+
+    def test_eviction(self):
+        '''Removing the least recently used artifacts'''
+        self.build()
+        foo = jhbuild.utils.artifactcache.lookup(
+                self.config, self.modules[0].get_artifact_key(self.buildscript))
+        bar = jhbuild.utils.artifactcache.lookup(
+                self.config, self.modules[1].get_artifact_key(self.buildscript))
+        os.utime(foo, (0, 0))
+        self.config.artifact_cache_size = os.stat(bar).st_size / (1024.0 * 1024)
+        jhbuild.utils.artifactcache.evict(self.config)
+        self.assertFalse(os.path.exists(foo))
+        self.assertTrue(os.path.exists(bar))
+
+    def test_unknown_revision(self):
+        '''Not caching modules depending on sources of unknown revision'''
+        self.foo_branch.tree_id = lambda: None
+        # even when they are not installed with DESTDIR
+        self.modules[0].supports_install_destdir = False
+        self.buildscript = mock.BuildScript(self.config, self.modules,
+                                            self.moduleset)
+        for module in self.modules:
+            self.assertEqual(module.get_artifact_key(self.buildscript), None)
+
+    def test_dirty_checkout(self):
+        '''Not caching modules built from sources with local changes'''
+        self.foo_branch.is_dirty = lambda: True
+        self.buildscript = mock.BuildScript(self.config, self.modules,
+                                            self.moduleset)
+        for module in self.modules:
+            self.assertEqual(module.get_artifact_key(self.buildscript), None)
+        self.foo_branch.is_dirty = lambda: False
+        for module in self.modules:
+            module._artifact_key = None
+            self.assertNotEqual(module.get_artifact_key(self.buildscript), None)
+
+    def test_build_environment(self):
+        '''Artifact keys depending on the build environment'''
+        self.buildscript = mock.BuildScript(self.config, self.modules,
+                                            self.moduleset)
+        old_environ = os.environ.copy()
+        try:
+            os.environ.pop('CFLAGS', None)
+            keys = [module.get_artifact_key(self.buildscript)
+                    for module in self.modules]
+            os.environ['CFLAGS'] = '-O0'
+            for module, key in zip(self.modules, keys):
+                module._artifact_key = None
+                self.assertNotEqual(module.get_artifact_key(self.buildscript),
+                                    key)
+        finally:
+            restore_environ(old_environ)
+
+    def test_restore_outside_destdir(self):
+        '''Rejecting artifacts that would be extracted outside DESTDIR'''
+        temp_dir = self.make_temp_dir()
+        for name in ('../foo', os.path.join(temp_dir, 'foo'), 'usr/../../foo'):
+            filename = os.path.join(temp_dir, 'artifact.tar.gz')
+            archive = tarfile.open(filename, 'w:gz')
+            archive.addfile(tarfile.TarInfo('usr'))
+            # tarfile.add() would remove the leading slash
+            archive.addfile(tarfile.TarInfo(name))
+            archive.close()
+            destdir = os.path.join(temp_dir, 'destdir')
+            os.mkdir(destdir)
+            self.assertRaises(tarfile.TarError,
+                              jhbuild.utils.artifactcache.restore,
+                              filename, destdir)
+            self.assertEqual(os.listdir(destdir), [])
+            os.rmdir(destdir)
+
+    def test_restore_symlinks(self):
+        '''Rejecting artifacts with links pointing outside DESTDIR'''
+        temp_dir = self.make_temp_dir()
+        outside = os.path.join(temp_dir, 'outside')
+        os.mkdir(outside)
+        filename = os.path.join(temp_dir, 'artifact.tar.gz')
+        def make_artifact(members):
+            archive = tarfile.open(filename, 'w:gz')
+            for name, linkname in members:
+                info = tarfile.TarInfo(name)
+                if linkname is not None:
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = linkname
+                archive.addfile(info)
+            archive.close()
+        def restore():
+            destdir = os.path.join(temp_dir, 'destdir')
+            if os.path.exists(destdir):
+                shutil.rmtree(destdir)
+            os.mkdir(destdir)
+            jhbuild.utils.artifactcache.restore(filename, destdir)
+            return destdir
+
+        for members in ([('d', outside), ('d/evil', None)],
+                        [('usr', None), ('usr/d', '../..'), ('usr/d/evil', None)],
+                        [('d', 'usr'), ('d/evil', None)]):
+            make_artifact(members)
+            self.assertRaises(tarfile.TarError, restore)
+            self.assertEqual(os.listdir(outside), [])
+
+        make_artifact([('usr/lib/libfoo.so.1', None),
+                       ('usr/lib/libfoo.so', 'libfoo.so.1'),
+                       ('usr/lib64', 'lib')])
+        destdir = restore()
+        self.assertEqual(os.readlink(os.path.join(destdir, 'usr', 'lib64')), 'lib')
+
+        # such artifacts are not saved
+        os.symlink(outside, os.path.join(destdir, 'usr', 'outside'))
+        jhbuild.utils.artifactcache.save(self.config, 'foo', destdir)
+        self.assertEqual(jhbuild.utils.artifactcache.lookup(self.config, 'foo'), None)
+        os.unlink(os.path.join(destdir, 'usr', 'outside'))
+        jhbuild.utils.artifactcache.save(self.config, 'foo', destdir)
+        self.assertNotEqual(jhbuild.utils.artifactcache.lookup(self.config, 'foo'), None)
+
+
+class FileServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        byte_range = self.headers.get('Range')
+        self.server.requests.append((self.path, byte_range))
+        if self.path in self.server.redirects:
+            self.send_response(302)
+            self.send_header('Location', self.server.redirects[self.path])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        start = 0
+        if byte_range and self.server.ranges:
+            start = int(byte_range[len('bytes='):].rstrip('-'))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % len(data))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                    start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+        if not self.server.keep_alive:
+            # without telling the client
+            self.close_connection = 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FileServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''An HTTP server of the contents of files, keyed by path, which
+    records the requests and the connections it receives.'''
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           FileServerHandler)
+        self.files = {}
+        self.redirects = {}
+        self.ranges = True
+        self.keep_alive = True
+        self.requests = []
+        self.connections = 0
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+
+
+class DownloadTestCase(JhbuildConfigTestCase):
+
+    def setUp(self):
+        super(DownloadTestCase, self).setUp()
+        self.server = FileServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.temp_dir = self.make_temp_dir()
+        self.data = os.urandom(300000)
+        self.server.files['/foo.tar.gz'] = self.data
+        self.digest = hashlib.sha256(self.data).hexdigest()
+
+    def tearDown(self):
+        jhbuild.utils.download.close_connections()
+        self.server.shutdown()
+        self.server.server_close()
+        super(DownloadTestCase, self).tearDown()
+
+    def test_download(self):
+        filename = os.path.join(self.temp_dir, 'foo.tar.gz')
+        self.server.files['/bar.tar.gz'] = 'bar'
+        self.assertEqual(jhbuild.utils.download.download(
+                self.server.url + '/foo.tar.gz', filename, 'sha256'), self.digest)
+        self.assertEqual(open(filename, 'rb').read(), self.data)
+        self.assertEqual(os.listdir(self.temp_dir), ['foo.tar.gz'])
+        # the connection is reused
+        self.assertEqual(jhbuild.utils.download.download(
+                self.server.url + '/bar.tar.gz', filename), None)
+        self.assertEqual(open(filename, 'rb').read(), 'bar')
+        self.assertEqual(self.server.connections, 1)
+
+        # connections closed by the server are opened again
+        self.server.keep_alive = False
+        for i in range(2):
+            jhbuild.utils.download.download(self.server.url + '/bar.tar.gz', filename)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_resume(self):
+        filename = os.path.join(self.temp_dir, 'foo.tar.gz')
+        open(filename + '.part', 'wb').write(self.data[:100000])
+        self.assertEqual(jhbuild.utils.download.download(
+                self.server.url + '/foo.tar.gz', filename, 'sha256'), self.digest)
+        self.assertEqual(self.server.requests, [('/foo.tar.gz', 'bytes=100000-')])
+        self.assertEqual(open(filename, 'rb').read(), self.data)
+
+        # servers without ranges send the whole file
+        self.server.ranges = False
+        open(filename + '.part', 'wb').write(self.data[:100000])
+        self.assertEqual(jhbuild.utils.download.download(
+                self.server.url + '/foo.tar.gz', filename, 'sha256'), self.digest)
+
+        # partial files larger than the file are dropped
+        self.server.ranges = True
+        open(filename + '.part', 'wb').write(self.data + 'garbage')
+        self.assertEqual(jhbuild.utils.download.download(
+                self.server.url + '/foo.tar.gz', filename, 'sha256'), self.digest)
+
+    def test_errors(self):
+        filename = os.path.join(self.temp_dir, 'foo.tar.gz')
+        self.server.redirects['/latest.tar.gz'] = '/foo.tar.gz'
+        self.assertEqual(jhbuild.utils.download.download(
+                self.server.url + '/latest.tar.gz', filename, 'sha256'), self.digest)
+        self.assertRaises(CommandError, jhbuild.utils.download.download,
+                          self.server.url + '/missing.tar.gz', filename)
+        self.assertFalse(os.path.exists(filename + '.part'))
+
+    def test_tarball_checkout(self):
+        source_dir = os.path.join(self.temp_dir, 'foo-1.0')
+        os.makedirs(source_dir)
+        open(os.path.join(source_dir, 'configure'), 'w').write('true\n')
+        tarball = os.path.join(self.temp_dir, 'foo-1.0.tar.gz')
+        subprocess.check_call(['tar', 'czf', tarball, 'foo-1.0'], cwd=self.temp_dir)
+        data = open(tarball, 'rb').read()
+        self.server.files['/foo-1.0.tar.gz'] = data
+        self.config.checkoutroot = os.path.join(self.temp_dir, 'checkout')
+        self.config.tarballdir = os.path.join(self.temp_dir, 'tarballs')
+        os.makedirs(self.config.checkoutroot)
+        os.makedirs(self.config.tarballdir)
+        repository = jhbuild.versioncontrol.tarball.TarballRepository(
+                self.config, 'local', self.server.url + '/')
+        buildscript = mock.CommandBuildScript(
+                self.config, [], jhbuild.moduleset.ModuleSet(self.config, db=mock.PackageDB()))
+
+        branch = repository.branch('foo', '1.0', module='foo-${version}.tar.gz',
+                                   hash='sha256:' + hashlib.sha256('').hexdigest())
+        self.assertRaises(BuildStateError, branch.checkout, buildscript)
+        self.assertEqual(os.listdir(self.config.tarballdir), [])
+        self.assertEqual(os.listdir(self.config.checkoutroot), [])
+
+        branch = repository.branch('foo', '1.0', module='foo-${version}.tar.gz',
+                                   size=str(len(data)),
+                                   hash='sha256:' + hashlib.sha256(data).hexdigest())
+        branch.checkout(buildscript)
+        self.assertTrue(os.path.exists(os.path.join(branch.srcdir, 'configure')))
+        self.assertEqual(os.listdir(self.config.checkoutroot), ['foo-1.0'])
+
+
+class UnpackTestCase(JhbuildConfigTestCase):
+
+    def setUp(self):
+        super(UnpackTestCase, self).setUp()
+        self.temp_dir = self.make_temp_dir()
+
+    def make_archive(self, filename, names):
+        source_dir = os.path.join(self.temp_dir, 'source')
+        for name in names:
+            path = os.path.join(source_dir, name, 'README')
+            os.makedirs(os.path.dirname(path))
+            open(path, 'w').write(name)
+        archive = os.path.join(self.temp_dir, filename)
+        subprocess.check_call(['tar', 'caf', archive] + names, cwd=source_dir)
+        shutil.rmtree(source_dir)
+        return archive
+
+    def test_unpack_archive(self):
+        target = os.path.join(self.temp_dir, 'target')
+        os.makedirs(target)
+        for ext in ('.tar', '.tar.gz', '.tar.bz2', '.tar.xz'):
+            archive = self.make_archive('foo' + ext, ['foo-1.0'])
+            jhbuild.utils.unpack.unpack_archive(None, archive, target, 'foo')
+            self.assertEqual(os.listdir(target), ['foo'])
+            self.assertEqual(open(os.path.join(target, 'foo', 'README')).read(),
+                             'foo-1.0')
+            shutil.rmtree(os.path.join(target, 'foo'))
+
+        # several top-level directories, into checkoutdir or merged with the
+        # existing ones
+        archive = self.make_archive('bar.tar.gz', ['bar', 'baz'])
+        jhbuild.utils.unpack.unpack_archive(None, archive, target, 'foo')
+        self.assertEqual(sorted(os.listdir(os.path.join(target, 'foo'))),
+                         ['bar', 'baz'])
+        jhbuild.utils.unpack.unpack_archive(None, archive, target)
+        self.assertEqual(sorted(os.listdir(target)), ['bar', 'baz', 'foo'])
+
+        # a corrupt archive leaves nothing behind
+        archive = os.path.join(self.temp_dir, 'corrupt.tar.gz')
+        open(archive, 'wb').write('\x1f\x8b' + 'x' * 100)
+        self.assertRaises(CommandError, jhbuild.utils.unpack.unpack_archive,
+                          None, archive, target, 'corrupt')
+        self.assertEqual(sorted(os.listdir(target)), ['bar', 'baz', 'foo'])
+
+    def test_extraction_stream(self):
+        archive = self.make_archive('foo-1.0.tar.xz', ['foo-1.0'])
+        data = open(archive, 'rb').read()
+        target = os.path.join(self.temp_dir, 'target')
+        os.makedirs(target)
+
+        extraction = jhbuild.utils.unpack.Extraction(archive, target)
+        for i in range(0, len(data), 100):
+            extraction.write(data[i:i + 100])
+        extraction.finish()
+        self.assertEqual(os.listdir(target), ['foo-1.0'])
+
+        extraction = jhbuild.utils.unpack.Extraction(archive, target, 'bar')
+        extraction.write(data[:len(data) / 2])
+        extraction.abort()
+        self.assertEqual(os.listdir(target), ['foo-1.0'])
+
+
+class PkgConfigTestCase(JhbuildConfigTestCase):
+
+    def setUp(self):
+        super(PkgConfigTestCase, self).setUp()
+        self.temp_dir = self.make_temp_dir()
+
+    def write_pc(self, directory, name, content):
+        directory = os.path.join(self.temp_dir, directory)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        filename = os.path.join(directory, name + '.pc')
+        open(filename, 'w').write(content)
+        return filename
+
+    def test_parse(self):
+        filename = self.write_pc('lib', 'foo', '# a comment\n'
+                                 'prefix=/opt/foo\n'
+                                 'libdir=${prefix}/lib # trailing comment\n'
+                                 'price=$$5 \\# not a comment\n'
+                                 'version=1.2\n'
+                                 'here=${pcfiledir}\n'
+                                 '\n'
+                                 'Name: foo\n'
+                                 'Version: ${version}.3\n'
+                                 'Libs: -L${libdir} \\\n'
+                                 '  -lfoo\n')
+        pc = jhbuild.utils.pkgconfig.parse(filename)
+        self.assertEqual(pc.name, 'foo')
+        self.assertEqual(pc.version, '1.2.3')
+        self.assertEqual(pc.variables['libdir'], '/opt/foo/lib')
+        self.assertEqual(pc.variables['price'], '$5 # not a comment')
+        self.assertEqual(pc.variables['here'], os.path.dirname(filename))
+        self.assertEqual(pc.fields['Libs'], '-L/opt/foo/lib   -lfoo')
+        self.assertEqual(jhbuild.utils.pkgconfig.parse(filename + '.missing'),
+                         None)
+
+    def test_index(self):
+        first = os.path.join(self.temp_dir, 'first')
+        second = os.path.join(self.temp_dir, 'second')
+        self.write_pc('first', 'foo', 'Version: 1.0\n')
+        self.write_pc('second', 'foo', 'Version: 2.0\n')
+        self.write_pc('second', 'bar', 'Version: 3.0\n')
+        filename = os.path.join(self.temp_dir, 'index', 'pkgconfig.pickle')
+
+        index = jhbuild.utils.pkgconfig.PkgConfigIndex(filename)
+        packages = index.get_packages([first, second, first + '.missing'])
+        self.assertEqual(sorted((name, pc.version) for name, pc in packages.items()),
+                         [('bar', '3.0'), ('foo', '1.0')])
+        index.save()
+
+        # directories that did not change are not read again
+        parse = jhbuild.utils.pkgconfig.parse
+        parsed = []
+        def counting_parse(filename):
+            parsed.append(os.path.basename(filename))
+            return parse(filename)
+        jhbuild.utils.pkgconfig.parse = counting_parse
+        try:
+            index = jhbuild.utils.pkgconfig.PkgConfigIndex(filename)
+            packages = index.get_packages([first, second])
+            self.assertEqual(parsed, [])
+            self.assertEqual(packages['bar'].version, '3.0')
+
+            self.write_pc('second', 'baz', 'Version: 4.0\n')
+            os.utime(second, (0, 0))
+            index = jhbuild.utils.pkgconfig.PkgConfigIndex(filename)
+            packages = index.get_packages([first, second])
+            self.assertEqual(sorted(parsed), ['bar.pc', 'baz.pc', 'foo.pc'])
+            self.assertEqual(packages['baz'].version, '4.0')
+        finally:
+            jhbuild.utils.pkgconfig.parse = parse
+
+
+class DpkgIndexTestCase(JhbuildConfigTestCase):
+
+    def setUp(self):
+        super(DpkgIndexTestCase, self).setUp()
+        self.admindir = self.make_temp_dir()
+        os.makedirs(os.path.join(self.admindir, 'info'))
+        open(os.path.join(self.admindir, 'status'), 'w').write(
+                'Package: libfoo1\n'
+                'Status: install ok installed\n'
+                'Architecture: amd64\n'
+                'Multi-Arch: same\n'
+                'Version: 1.2-1\n'
+                'Description: foo library\n'
+                ' Version: not a field\n'
+                '\n'
+                'Package: foo-tools\n'
+                'Status: install ok installed\n'
+                'Architecture: amd64\n'
+                'Version: 1:1.2-1\n'
+                '\n'
+                'Package: bar\n'
+                'Status: deinstall ok config-files\n'
+                'Version: 3.0\n'
+                '\n'
+                'Package: baz\n'
+                'Status: hold ok installed\n'
+                'Version: 1.0\n')
+        self.write_list('libfoo1:amd64', ['/.', '/usr', '/usr/lib',
+                                          '/usr/lib/libfoo.so.1'])
+        self.write_list('foo-tools', ['/.', '/usr', '/usr/bin',
+                                      '/usr/bin/foo', '/usr/lib'])
+
+    def write_list(self, package, paths):
+        open(os.path.join(self.admindir, 'info', package + '.list'), 'w').write(
+                ''.join(x + '\n' for x in paths))
+
+    def test_search(self):
+        index = jhbuild.utils.dpkg.DpkgIndex(self.admindir)
+        self.assertEqual(index.get_owners('/usr/bin/foo'), ['foo-tools'])
+        self.assertEqual(index.get_owners('/usr/lib/'),
+                         ['foo-tools', 'libfoo1:amd64'])
+        self.assertEqual(index.get_owners('/usr/bin/bar'), [])
+        self.assertEqual(index.search(['/usr/lib/libfoo.so.1']),
+                         {'/usr/lib/libfoo.so.1': ['libfoo1:amd64']})
+        self.assertEqual(index.search(['/usr/lib/libfoo.so']), {})
+        self.assertEqual(sorted(index.search(['foo'])),
+                         ['/usr/bin/foo', '/usr/lib/libfoo.so.1'])
+        self.assertEqual(sorted(index.search(['*/lib*.so.[0-9]'])),
+                         ['/usr/lib/libfoo.so.1'])
+        self.assertEqual(index.search(['/usr/bin/foo', '/usr/lib/', 'bar']),
+                         {'/usr/bin/foo': ['foo-tools'],
+                          '/usr/lib': ['foo-tools', 'libfoo1:amd64']})
+        self.assertEqual(index.get_installed_packages(),
+                         {'libfoo1:amd64': '1.2-1', 'foo-tools': '1:1.2-1'})
+
+    def test_update(self):
+        filename = os.path.join(self.make_temp_dir(), 'dpkg.pickle')
+        index = jhbuild.utils.dpkg.DpkgIndex(self.admindir, filename)
+        index.get_installed_packages()
+        index.save()
+
+        # only the lists that changed are read again
+        read_list = jhbuild.utils.dpkg._read_list
+        read = []
+        def counting_read_list(filename):
+            read.append(os.path.basename(filename))
+            return read_list(filename)
+        jhbuild.utils.dpkg._read_list = counting_read_list
+        try:
+            index = jhbuild.utils.dpkg.DpkgIndex(self.admindir, filename)
+            self.assertEqual(read, [])
+            self.assertEqual(index.get_owners('/usr/bin/foo'), ['foo-tools'])
+
+            self.write_list('foo-tools', ['/.', '/usr', '/usr/bin',
+                                          '/usr/bin/foo2'])
+            os.utime(os.path.join(self.admindir, 'info', 'foo-tools.list'),
+                     (0, 0))
+            os.remove(os.path.join(self.admindir, 'info', 'libfoo1:amd64.list'))
+            index = jhbuild.utils.dpkg.DpkgIndex(self.admindir, filename)
+            self.assertEqual(read, ['foo-tools.list'])
+            self.assertEqual(index.get_owners('/usr/bin/foo'), [])
+            self.assertEqual(index.get_owners('/usr/bin/foo2'), ['foo-tools'])
+            self.assertEqual(index.get_owners('/usr/lib/libfoo.so.1'), [])
+
+            # the index of the owners follows updates
+            self.write_list('bar', ['/.', '/usr', '/usr/bin', '/usr/bin/foo'])
+            index.update()
+            self.assertEqual(index.get_owners('/usr/bin/foo'), ['bar'])
+            self.assertEqual(index.search(['/usr/bin/foo', 'foo2']),
+                             {'/usr/bin/foo': ['bar'],
+                              '/usr/bin/foo2': ['foo-tools']})
+        finally:
+            jhbuild.utils.dpkg._read_list = read_list
+
+
+class SystemDependencyTestCase(JhbuildConfigTestCase):
+
+    def setUp(self):
+        super(SystemDependencyTestCase, self).setUp()
+        self.temp_dir = self.make_temp_dir()
+        self.orig_environ = os.environ.copy()
+
+    def tearDown(self):
+        restore_environ(self.orig_environ)
+        super(SystemDependencyTestCase, self).tearDown()
+
+    def write_file(self, path, content='', mode=0644):
+        filename = os.path.join(self.temp_dir, path)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        open(filename, 'w').write(content)
+        os.chmod(filename, mode)
+        return filename
+
+    def test_dependencies_met(self):
+        self.write_file('bin/foo', mode=0755)
+        self.write_file('bin/notexec')
+        self.write_file('include/foo/foo.h')
+        os.environ['PATH'] = os.path.join(self.temp_dir, 'bin')
+        self.config.makeargs = '-I%s' % os.path.join(self.temp_dir, 'include')
+        self.config.module_makeargs = {
+                'bar': '-I %s' % os.path.join(self.temp_dir, 'include', 'foo')}
+        checker = real_systeminstall.SystemDependencyChecker(self.config)
+
+        self.assertTrue(checker.dependencies_met('foo', [('path', 'foo', [])]))
+        self.assertFalse(checker.dependencies_met('foo', [('path', 'notexec', [])]))
+        self.assertTrue(checker.dependencies_met('foo', [('c_include', 'foo/foo.h', [])]))
+        self.assertFalse(checker.dependencies_met('foo', [('c_include', 'foo.h', [])]))
+        self.assertTrue(checker.dependencies_met('bar', [('c_include', 'foo.h', [])]))
+        self.assertTrue(checker.dependencies_met('foo', [
+                ('path', 'missing', [('path', 'missing2', []),
+                                     ('c_include', 'foo/foo.h', [])])]))
+        self.assertFalse(checker.dependencies_met('foo', [
+                ('path', 'foo', []), ('path', 'missing', [])]))
+
+    def test_xml_catalog(self):
+        self.write_file('xml/docbook.xml',
+                '<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">'
+                '<group><public publicId="-//OASIS//DTD DocBook XML V4.5//EN" uri="x"/></group>'
+                '<rewriteSystem systemIdStartString="http://docbook.sourceforge.net/release/xsl/current/" rewritePrefix="y"/>'
+                '</catalog>')
+        self.write_file('xml/next.xml',
+                '<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">'
+                '<system systemId="http://example.org/foo.dtd" uri="z"/>'
+                '</catalog>')
+        catalog = self.write_file('xml/catalog',
+                '<?xml version="1.0"?>\n'
+                '<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">'
+                '<delegatePublic publicIdStartString="-//OASIS//DTD DocBook" catalog="docbook.xml"/>'
+                '<delegateSystem systemIdStartString="http://docbook.sourceforge.net/" catalog="file://%s"/>'
+                '<nextCatalog catalog="next.xml"/>'
+                '<nextCatalog catalog="missing.xml"/>'
+                '</catalog>' % os.path.join(self.temp_dir, 'xml', 'docbook.xml'))
+        catalog = real_systeminstall.XmlCatalog(catalog)
+        self.assertTrue(catalog.resolve('-//OASIS//DTD DocBook XML V4.5//EN'))
+        self.assertFalse(catalog.resolve('-//OASIS//DTD DocBook XML V4.3//EN'))
+        self.assertTrue(catalog.resolve(
+                'http://docbook.sourceforge.net/release/xsl/current/'))
+        self.assertFalse(catalog.resolve('http://docbook.sourceforge.net/other'))
+        self.assertTrue(catalog.resolve('http://example.org/foo.dtd'))
+        self.assertFalse(catalog.resolve('http://example.org/bar.dtd'))
+
+    def test_xml_catalog_uri(self):
+        self.write_file('xml/docbook-xsl-ns.xml',
+                '<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">'
+                '<rewriteURI uriStartString="http://docbook.sourceforge.net/release/xsl-ns/current/" rewritePrefix="y"/>'
+                '</catalog>')
+        catalog = self.write_file('xml/catalog',
+                '<?xml version="1.0"?>\n'
+                '<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">'
+                '<uri name="http://docbook.org/xml/5.0/rng/docbook.rng" uri="x"/>'
+                '<delegateURI uriStartString="http://docbook.sourceforge.net/" catalog="docbook-xsl-ns.xml"/>'
+                '</catalog>')
+        catalog = real_systeminstall.XmlCatalog(catalog)
+        self.assertTrue(catalog.resolve(
+                'http://docbook.org/xml/5.0/rng/docbook.rng'))
+        self.assertFalse(catalog.resolve(
+                'http://docbook.org/xml/5.0/rng/docbookxi.rng'))
+        self.assertTrue(catalog.resolve(
+                'http://docbook.sourceforge.net/release/xsl-ns/current/'))
+        self.assertFalse(catalog.resolve(
+                'http://docbook.sourceforge.net/release/xsl/current/'))
+
+    def test_xml_catalog_fallback(self):
+        # identifiers not found in the catalog are looked up by xmlcatalog
+        self.write_file('bin/xmlcatalog',
+                '#!/bin/sh\n'
+                'case "$2" in */docbookx.dtd) exit 0;; esac\n'
+                'exit 4\n', mode=0755)
+        os.environ['PATH'] = os.path.join(self.temp_dir, 'bin')
+        catalog = self.write_file('xml/catalog',
+                '<?xml version="1.0"?>\n'
+                '<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">'
+                '<systemSuffix systemIdSuffix="/docbookx.dtd" uri="z"/>'
+                '<uri name="http://docbook.org/xml/5.0/rng/docbook.rng" uri="x"/>'
+                '</catalog>')
+        checker = real_systeminstall.SystemDependencyChecker(self.config)
+        checker._xml_catalog = real_systeminstall.XmlCatalog(catalog)
+        self.assertTrue(checker.dependencies_met('foo', [
+                ('xml', 'http://docbook.org/xml/5.0/rng/docbook.rng', [])]))
+        self.assertTrue(checker.dependencies_met('foo', [
+                ('xml', 'http://www.oasis-open.org/docbook/xml/4.5/docbookx.dtd', [])]))
+        self.assertFalse(checker.dependencies_met('foo', [
+                ('xml', 'http://www.oasis-open.org/docbook/xml/4.5/other.dtd', [])]))
+
 
 class SimpleBranch(object):
 
@@ -658,6 +1893,15 @@ class EndToEndTest(JhbuildConfigTestCase):
 
 class UtilsTest(JhbuildConfigTestCase):
 
+    def setUp(self):
+        super(UtilsTest, self).setUp()
+        # the tests running git set UNMANGLED_PATH
+        self.orig_environ = os.environ.copy()
+
+    def tearDown(self):
+        restore_environ(self.orig_environ)
+        super(UtilsTest, self).tearDown()
+
     def test_compare_version(self):
         self.assertTrue(jhbuild.utils.cmds.compare_version('3.13.1.with.ckbi.1.88', '3'))
         self.assertTrue(jhbuild.utils.cmds.compare_version('3.13.1.with.ckbi.1.88', '3.12'))
@@ -678,6 +1922,473 @@ class UtilsTest(JhbuildConfigTestCase):
         self.assertTrue(jhbuild.utils.cmds.compare_version('2', '1.2.3.4'))
         self.assertFalse(jhbuild.utils.cmds.compare_version('1.2.3.4', '2'))
 
+    def test_elf(self):
+        self.assertEqual(jhbuild.utils.elf.read(__file__), None)
+        executable = os.path.realpath(sys.executable)
+        info = jhbuild.utils.elf.read(executable)
+        if info is None or not info.dynamic:
+            raise unittest.SkipTest('the Python executable is not a dynamically linked ELF file')
+        resolver = jhbuild.utils.elf.LibraryResolver()
+        found, notfound = resolver.dependencies(executable)
+        self.assertEqual(notfound, [])
+        self.assertTrue(found)
+        try:
+            lines = subprocess.check_output(['ldd', executable]).splitlines()
+        except OSError:
+            return
+        # same libraries as ldd
+        ldd_found = []
+        for line in lines:
+            if '=>' in line:
+                ldd_found.append(line.split('=>')[1].split()[0])
+        self.assertEqual(sorted(found), sorted(ldd_found))
+
+    def make_executables(self, dirname, names):
+        '''Compile executables with debug symbols'''
+        if not inpath('objcopy', os.environ['PATH'].split(os.pathsep)):
+            raise unittest.SkipTest('objcopy is not available')
+        source = os.path.join(self.make_temp_dir(), 'hello.c')
+        open(source, 'w').write('int main() { return 0; }\n')
+        executables = []
+        for name in names:
+            executable = os.path.join(dirname, name)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            try:
+                subprocess.check_call(['cc', '-g', '-o', executable, source],
+                                      cwd=os.path.dirname(source))
+            except (OSError, subprocess.CalledProcessError):
+                raise unittest.SkipTest('no C compiler')
+            os.chmod(executable, 0751)
+            executables.append(executable)
+        return executables
+
+    def test_strip_debug_symbols(self):
+        destdir_prefix = self.make_temp_dir()
+        executables = self.make_executables(os.path.join(destdir_prefix, 'bin'),
+                                            ['hello', 'hello2', 'hello3'])
+        module = Package('hello')
+        module.config = self.config
+        module._strip_debug_symbols(destdir_prefix, '/opt')
+        for executable in executables:
+            name = os.path.basename(executable)
+            self.assertTrue(jhbuild.utils.elf.read(executable).stripped)
+            self.assertEqual(stat.S_IMODE(os.stat(executable).st_mode), 0751)
+            debug = os.path.join(destdir_prefix, 'debug', 'bin', name + '.debug')
+            self.assertEqual(os.readlink(executable + '.debug'),
+                             '../debug/bin/%s.debug' % name)
+            self.assertEqual(os.path.realpath(executable + '.debug'),
+                             os.path.realpath(debug))
+            self.assertFalse(jhbuild.utils.elf.read(debug).stripped)
+            self.assertEqual(subprocess.call([executable]), 0)
+        self.assertEqual(sorted(os.listdir(os.path.join(destdir_prefix, 'debug', 'bin'))),
+                         ['hello.debug', 'hello2.debug', 'hello3.debug'])
+
+    def test_strip_debug_symbols_failure(self):
+        destdir_prefix = self.make_temp_dir()
+        executables = self.make_executables(os.path.join(destdir_prefix, 'bin'),
+                                            ['hello', 'hello2', 'hello3'])
+        module = Package('hello')
+        module.config = self.config
+        self.config.jobs = 1
+        mkstemp = tempfile.mkstemp
+        def failing_mkstemp(prefix='', **kwargs):
+            if prefix == '.hello2':
+                raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+            return mkstemp(prefix=prefix, **kwargs)
+        jhbuild.modtypes.tempfile.mkstemp = failing_mkstemp
+        try:
+            module._strip_debug_symbols(destdir_prefix, '/opt')
+        finally:
+            jhbuild.modtypes.tempfile.mkstemp = mkstemp
+        # the other files are stripped
+        self.assertEqual([jhbuild.utils.elf.read(x).stripped for x in executables],
+                         [True, False, True])
+        self.assertEqual(sorted(os.listdir(os.path.join(destdir_prefix, 'debug', 'bin'))),
+                         ['hello.debug', 'hello3.debug'])
+
+    def test_inventory(self):
+        temp_dir = self.make_temp_dir()
+        prefix = os.path.join(temp_dir, 'prefix')
+        destdir = os.path.join(temp_dir, 'root-foo')
+        destdir_prefix = os.path.join(destdir, prefix.lstrip(os.sep))
+        for dirname in ('bin', 'lib/pkgconfig', 'share/empty'):
+            os.makedirs(os.path.join(destdir_prefix, dirname))
+        for filename in ('bin/foo', 'lib/libfoo.la', 'lib/pkgconfig/foo.pc'):
+            open(os.path.join(destdir_prefix, filename), 'w').write(filename)
+        os.symlink('lib', os.path.join(destdir_prefix, 'lib64'))
+        os.chmod(os.path.join(destdir_prefix, 'bin/foo'), 0755)
+
+        inventory = jhbuild.utils.inventory.Inventory(destdir_prefix)
+        self.assertEqual(sorted(inventory.contents()),
+                         sorted(jhbuild.utils.fileutils.accumulate_dirtree_contents(
+                                 destdir_prefix)))
+        self.assertTrue(inventory.entries['lib64'].islink)
+        self.assertTrue(inventory.entries['share/empty'].isdir)
+        self.assertEqual(inventory.entries['bin/foo'].size, 7)
+        # not an ELF file
+        self.assertEqual(inventory.entries['bin/foo'].elf, None)
+
+        self.config.prefix = prefix
+        buildscript = mock.BuildScript(self.config, [], jhbuild.moduleset.ModuleSet(
+                self.config, db=mock.PackageDB()))
+        module = Package('foo')
+        module.config = self.config
+        module._clean_la_files(buildscript, destdir, inventory)
+        open(os.path.join(destdir_prefix, 'share/empty/new'), 'w').write('new')
+        inventory.add('share/empty/new')
+        self.assertEqual(sorted(inventory.contents()),
+                         ['bin/foo', 'lib/pkgconfig/foo.pc', 'lib64',
+                          'share/empty/new'])
+
+        # moving the files into the prefix, where they replace a file and a
+        # directory
+        os.makedirs(os.path.join(prefix, 'lib64'))
+        open(os.path.join(prefix, 'share'), 'w').write('')
+        errors = []
+        self.assertEqual(module._process_install_files(destdir, destdir_prefix,
+                                                       prefix, errors, inventory),
+                         3)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(os.listdir(destdir_prefix), ['lib64'])
+        self.assertEqual(sorted(jhbuild.utils.fileutils.accumulate_dirtree_contents(prefix)),
+                         ['bin/foo', 'lib/pkgconfig/foo.pc', 'lib64/', 'share/empty/new'])
+
+    def test_incremental_install(self):
+        temp_dir = self.make_temp_dir()
+        prefix = os.path.join(temp_dir, 'prefix')
+        destdir = os.path.join(temp_dir, 'root-foo')
+        destdir_prefix = os.path.join(destdir, prefix.lstrip(os.sep))
+        self.config.incremental_install = True
+        module = Package('foo')
+        module.config = self.config
+        os.makedirs(prefix)
+        stats = {}
+        for version in ('1', '2'):
+            os.makedirs(os.path.join(destdir_prefix, 'include'))
+            for name in ('foo.h', 'bar.h', 'version.h'):
+                content = name == 'version.h' and version or name
+                open(os.path.join(destdir_prefix, 'include', name), 'w').write(content)
+            os.symlink('foo.h', os.path.join(destdir_prefix, 'include', 'foo-link.h'))
+            os.symlink('version.h', os.path.join(destdir_prefix, 'include',
+                                                 'version-%s.h' % version))
+            unchanged = []
+            num_copied = module._process_install_files(destdir, destdir_prefix,
+                                                       prefix, [], None, unchanged)
+            self.assertEqual(os.listdir(destdir_prefix), [])
+            os.rmdir(destdir_prefix)
+            stats[version] = dict(
+                    (name, os.lstat(os.path.join(prefix, 'include', name)))
+                    for name in os.listdir(os.path.join(prefix, 'include')))
+        self.assertEqual(num_copied, 2)
+        self.assertEqual(sorted(unchanged), ['include/bar.h', 'include/foo-link.h',
+                                             'include/foo.h'])
+        for name in ('foo.h', 'bar.h', 'foo-link.h'):
+            self.assertEqual(stats['1'][name].st_ino, stats['2'][name].st_ino)
+        self.assertNotEqual(stats['1']['version.h'].st_ino,
+                            stats['2']['version.h'].st_ino)
+        self.assertEqual(open(os.path.join(prefix, 'include', 'version.h')).read(), '2')
+
+    def test_debug_store(self):
+        temp_dir = self.make_temp_dir()
+        self.config.prefix = os.path.join(temp_dir, 'prefix')
+        self.config.debug_store = 'build-id'
+        module = Package('hello')
+        module.config = self.config
+        # two modules installing the same binary
+        destdirs = []
+        for name in ('foo', 'bar'):
+            destdir_prefix = os.path.join(temp_dir, 'root-' + name)
+            executable, = self.make_executables(os.path.join(destdir_prefix, 'bin'),
+                                                [name])
+            build_id = jhbuild.utils.elf.read(executable).build_id
+            if build_id is None:
+                raise unittest.SkipTest('the C compiler does not add build IDs')
+            module._strip_debug_symbols(destdir_prefix, self.config.prefix)
+            self.assertTrue(jhbuild.utils.elf.read(executable).stripped)
+            self.assertFalse(os.path.exists(executable + '.debug'))
+            link = jhbuild.utils.debugstore.get_link_name(build_id)
+            self.assertEqual(os.path.realpath(os.path.join(destdir_prefix, link)),
+                             os.path.realpath(executable))
+            # the debug file is installed with the module
+            debug = jhbuild.utils.debugstore.get_debug_filename(destdir_prefix,
+                                                                build_id)
+            self.assertFalse(jhbuild.utils.elf.read(debug).stripped)
+            self.assertEqual(sorted(os.listdir(os.path.dirname(debug))),
+                             sorted([os.path.basename(debug), build_id[2:]]))
+        debug = jhbuild.utils.debugstore.get_debug_filename(self.config.prefix,
+                                                            build_id)
+        self.assertFalse(os.path.exists(debug))
+
+        # and removed with the last module using it
+        os.makedirs(os.path.dirname(debug))
+        shutil.copy(jhbuild.utils.debugstore.get_debug_filename(destdir_prefix,
+                                                                build_id), debug)
+        os.symlink(os.path.join(self.config.prefix, 'bin', 'bar'),
+                   os.path.join(self.config.prefix, link))
+        db = jhbuild.utils.packagedb.PackageDB(
+                os.path.join(temp_dir, '_jhbuild', 'packagedb.xml'), self.config)
+        for name in ('foo', 'bar'):
+            db.add(name, '1.0', [os.path.join('bin', name), link, link + '.debug'])
+        db.uninstall('foo')
+        self.assertTrue(os.path.exists(debug))
+        db.uninstall('bar')
+        self.assertFalse(os.path.exists(debug))
+
+    def test_sync_git_mirrors(self):
+        if not inpath('git', os.environ['PATH'].split(os.pathsep)):
+            raise unittest.SkipTest('git is not installed')
+        temp_dir = self.make_temp_dir()
+        self.config.dvcs_mirror_dir = os.path.join(temp_dir, 'mirrors')
+        os.makedirs(self.config.dvcs_mirror_dir)
+        self.config.dvcs_mirror_max_age = 600
+        git = ['git', '-c', 'user.name=jhbuild', '-c', 'user.email=jhbuild@localhost']
+        def commit(origin, message):
+            jhbuild.utils.cmds.get_output(git + ['commit', '-q', '--allow-empty',
+                                                 '-m', message], cwd=origin)
+        mirrors = []
+        for name in ('foo', 'bar', 'baz'):
+            origin = os.path.join(temp_dir, name)
+            jhbuild.utils.cmds.get_output(['git', 'init', '-q', origin])
+            commit(origin, 'first')
+            mirrors.append((os.path.join(self.config.dvcs_mirror_dir, name + '.git'),
+                            origin))
+        mirrors.append((os.path.join(self.config.dvcs_mirror_dir, 'missing.git'),
+                        os.path.join(temp_dir, 'missing')))
+
+        failures = jhbuild.versioncontrol.git.sync_git_mirrors(self.config, mirrors)
+        self.assertEqual([x[0] for x in failures], [mirrors[-1][0]])
+        self.assertEqual(sorted(os.listdir(self.config.dvcs_mirror_dir)),
+                         ['bar.git', 'baz.git', 'foo.git'])
+        # existing mirrors are found without their origin
+        found = jhbuild.versioncontrol.git.find_git_mirrors(self.config)
+        self.assertEqual(found, [(x[0], None) for x in sorted(mirrors[:3])])
+
+        def log(mirror_dir):
+            return jhbuild.utils.cmds.get_output(['git', 'log', '--format=%s',
+                                                  'HEAD'], cwd=mirror_dir).split()
+        commit(mirrors[0][1], 'second')
+        # fresh mirrors are not fetched again
+        self.assertEqual(jhbuild.versioncontrol.git.sync_git_mirrors(self.config, found), [])
+        self.assertEqual(log(mirrors[0][0]), ['first'])
+        self.config.dvcs_mirror_max_age = 0
+        self.assertEqual(jhbuild.versioncontrol.git.sync_git_mirrors(self.config, found), [])
+        self.assertEqual(log(mirrors[0][0]), ['second', 'first'])
+
+    def test_git_mirror_checkout(self):
+        if not inpath('git', os.environ['PATH'].split(os.pathsep)):
+            raise unittest.SkipTest('git is not installed')
+        temp_dir = self.make_temp_dir()
+        config = self.config
+        config.checkoutroot = os.path.join(temp_dir, 'checkout')
+        os.makedirs(config.checkoutroot)
+        config.quiet_mode = True
+        config.dvcs_mirror_dir = os.path.join(temp_dir, 'mirrors')
+        os.environ['UNMANGLED_PATH'] = os.environ['PATH']
+        os.environ['UNMANGLED_LD_LIBRARY_PATH'] = os.environ.get('LD_LIBRARY_PATH', '')
+        config.copy_dir = os.path.join(temp_dir, 'copy')
+        os.makedirs(config.copy_dir)
+        for name in ('foo', 'bar'):
+            origin = os.path.join(temp_dir, name)
+            jhbuild.utils.cmds.get_output(['git', 'init', '-q', origin])
+            open(os.path.join(origin, 'README'), 'w').write(name)
+            jhbuild.utils.cmds.get_output(['git', 'add', 'README'], cwd=origin)
+            jhbuild.utils.cmds.get_output(
+                    ['git', '-c', 'user.name=jhbuild', '-c', 'user.email=jhbuild@localhost',
+                     'commit', '-q', '-m', 'first'], cwd=origin)
+        repository = jhbuild.versioncontrol.git.GitRepository(config, 'local',
+                                                              temp_dir + '/')
+        buildscript = mock.CommandBuildScript(
+                config, [], jhbuild.moduleset.ModuleSet(config, db=mock.PackageDB()))
+
+        def alternates(checkout):
+            return open(os.path.join(checkout, '.git', 'objects', 'info',
+                                     'alternates')).read().strip()
+        # checkouts borrow the objects of the mirrors
+        branch = repository.branch('foo')
+        branch.checkout(buildscript)
+        self.assertEqual(open(os.path.join(branch.srcdir, 'README')).read(), 'foo')
+        self.assertEqual(alternates(branch.srcdir),
+                         os.path.join(config.dvcs_mirror_dir, 'foo.git', 'objects'))
+        self.assertEqual(os.listdir(os.path.join(branch.srcdir, '.git', 'objects', 'pack')), [])
+
+        # and copies the objects of the checkouts they are copied from
+        config.checkout_mode = 'copy'
+        branch = repository.branch('bar')
+        branch.checkout(buildscript)
+        self.assertEqual(open(os.path.join(branch.srcdir, 'README')).read(), 'bar')
+        self.assertEqual(alternates(branch.srcdir),
+                         os.path.join(config.copy_dir, 'bar', '.git', 'objects'))
+        self.assertEqual(jhbuild.utils.cmds.get_output(['git', 'log', '--format=%s'],
+                                                       cwd=branch.srcdir), 'first\n')
+
+        # without a mirror, the module is used directly
+        shutil.rmtree(os.path.join(config.dvcs_mirror_dir, 'foo.git'))
+        self.assertEqual(repository.branch('foo').get_origin(),
+                         os.path.join(temp_dir, 'foo'))
+        config.nonetwork = True
+        self.assertEqual(repository.branch('foo').get_origin(),
+                         os.path.join(config.dvcs_mirror_dir, 'foo.git'))
+
+    def test_git_mirror_update(self):
+        if not inpath('git', os.environ['PATH'].split(os.pathsep)):
+            raise unittest.SkipTest('git is not installed')
+        temp_dir = self.make_temp_dir()
+        config = self.config
+        config.checkoutroot = temp_dir
+        config.quiet_mode = True
+        config.dvcs_mirror_dir = os.path.join(temp_dir, 'mirrors')
+        config.dvcs_mirror_max_age = 600
+        os.environ['UNMANGLED_PATH'] = os.environ['PATH']
+        os.environ['UNMANGLED_LD_LIBRARY_PATH'] = os.environ.get('LD_LIBRARY_PATH', '')
+        origin = os.path.join(temp_dir, 'foo')
+        jhbuild.utils.cmds.get_output(['git', 'init', '-q', origin])
+        def commit(message):
+            jhbuild.utils.cmds.get_output(
+                    ['git', '-c', 'user.name=jhbuild', '-c', 'user.email=jhbuild@localhost',
+                     'commit', '-q', '--allow-empty', '-m', message], cwd=origin)
+        def log():
+            return jhbuild.utils.cmds.get_output(['git', 'log', '--format=%s', 'HEAD'],
+                                                 cwd=mirror_dir).split()
+        commit('first')
+        repository = jhbuild.versioncontrol.git.GitRepository(config, 'local',
+                                                              temp_dir + '/')
+        buildscript = mock.CommandBuildScript(
+                config, [], jhbuild.moduleset.ModuleSet(config, db=mock.PackageDB()))
+        branch = repository.branch('foo')
+        mirror_dir = os.path.join(config.dvcs_mirror_dir, 'foo.git')
+
+        # mirrors refreshed by checkouts are fetched again
+        branch.update_dvcs_mirror(buildscript)
+        commit('second')
+        branch.update_dvcs_mirror(buildscript)
+        self.assertEqual(log(), ['second', 'first'])
+
+        # but not the ones refreshed by mirror-sync, in this run or another
+        stamp = os.path.join(mirror_dir, jhbuild.versioncontrol.git.MIRROR_STAMP)
+        os.utime(stamp, (time.time() - 3600, time.time() - 3600))
+        commit('third')
+        jhbuild.versioncontrol.git.sync_git_mirrors(config, [(mirror_dir, None)])
+        self.assertEqual(log(), ['third', 'second', 'first'])
+        commit('fourth')
+        branch.update_dvcs_mirror(buildscript)
+        self.assertEqual(log(), ['third', 'second', 'first'])
+
+        # unless the mirror changed since
+        jhbuild.utils.cmds.get_output(['git', 'update-ref', 'refs/heads/other',
+                                       'HEAD'], cwd=mirror_dir)
+        branch.update_dvcs_mirror(buildscript)
+        self.assertEqual(log(), ['fourth', 'third', 'second', 'first'])
+
+        # or the sync is too old
+        os.utime(stamp, (time.time() - 3600, time.time() - 3600))
+        jhbuild.versioncontrol.git.sync_git_mirrors(config, [(mirror_dir, None)])
+        commit('fifth')
+        branch.update_dvcs_mirror(buildscript)
+        self.assertEqual(log(), ['fourth', 'third', 'second', 'first'])
+        os.utime(stamp, (time.time() - 3600, time.time() - 3600))
+        branch.update_dvcs_mirror(buildscript)
+        self.assertEqual(log(), ['fifth', 'fourth', 'third', 'second', 'first'])
+
+    def test_git_tree_id(self):
+        if not inpath('git', os.environ['PATH'].split(os.pathsep)):
+            raise unittest.SkipTest('git is not installed')
+        temp_dir = self.make_temp_dir()
+        self.config.checkoutroot = temp_dir
+        os.environ['UNMANGLED_PATH'] = os.environ['PATH']
+        os.environ['UNMANGLED_LD_LIBRARY_PATH'] = os.environ.get('LD_LIBRARY_PATH', '')
+        git = ['git', '-c', 'user.name=jhbuild', '-c', 'user.email=jhbuild@localhost']
+        repository = jhbuild.versioncontrol.git.GitRepository(self.config, 'local',
+                                                              'http://example.org/')
+        branches = []
+        for name in ('foo', 'bar'):
+            checkout = os.path.join(temp_dir, name)
+            jhbuild.utils.cmds.get_output(['git', 'init', '-q', checkout])
+            open(os.path.join(checkout, 'README'), 'w').write(name)
+            jhbuild.utils.cmds.get_output(['git', 'add', 'README'], cwd=checkout)
+            jhbuild.utils.cmds.get_output(git + ['commit', '-q', '-m', 'first'],
+                                          cwd=checkout)
+            branches.append(repository.branch(name))
+        branch = branches[0]
+        def head():
+            return jhbuild.utils.cmds.get_output(['git', 'rev-parse', 'HEAD'],
+                                                 cwd=branch.srcdir).strip()
+
+        commands = []
+        old_get_output = jhbuild.versioncontrol.git.get_output
+        def get_output(cmd, *args, **kwargs):
+            commands.append(cmd)
+            return old_get_output(cmd, *args, **kwargs)
+        jhbuild.versioncontrol.git.get_output = get_output
+        try:
+            # the build script only queries the revisions ahead
+            jhbuild.versioncontrol.git.query_revisions(branches, 2)
+            self.assertEqual([x for x in commands if 'diff' in x], [])
+            self.assertEqual(len([x for x in commands if 'rev-parse' in x]), 2)
+            tree_ids = jhbuild.versioncontrol.get_tree_ids(branches, 2)
+            self.assertEqual(tree_ids[branch], head())
+            self.assertEqual(len(tree_ids), 2)
+            # the revision is kept while the repository is not changed
+            del commands[:]
+            self.assertEqual(branch.tree_id(), head())
+            self.assertFalse(branch.is_dirty())
+            self.assertEqual([x for x in commands if 'rev-parse' in x], [])
+
+            # but changes of the working tree are always seen
+            open(os.path.join(branch.srcdir, 'README'), 'w').write('changed')
+            self.assertEqual(branch.tree_id(), head() + '-dirty')
+            self.assertTrue(branch.is_dirty())
+            jhbuild.utils.cmds.get_output(['git', 'add', 'README'], cwd=branch.srcdir)
+            self.assertEqual(branch.tree_id(), head() + '-dirty')
+            jhbuild.utils.cmds.get_output(git + ['commit', '-q', '-m', 'second'],
+                                          cwd=branch.srcdir)
+            self.assertEqual(branch.tree_id(), head())
+            self.assertNotEqual(branch.tree_id(), tree_ids[branch])
+        finally:
+            jhbuild.versioncontrol.git.get_output = old_get_output
+
+    def test_get_output_timeout(self):
+        self.assertRaises(CommandError, jhbuild.utils.cmds.get_output,
+                          ['sh', '-c', 'sleep 10 & wait'], timeout=0.5)
+        self.assertEqual(jhbuild.utils.cmds.get_output(['echo', 'foo'], timeout=10),
+                         'foo\n')
+
+    def test_pprint_output(self):
+        lines = []
+        def format_line(line, error_output):
+            lines.append((line, error_output))
+        length = 2 * jhbuild.utils.cmds.MAX_LINE_LENGTH + 10
+        script = ('import sys; sys.stdout.write("a\\n\\nb" + "c" * 100000 + "\\n");'
+                  'sys.stdout.flush(); sys.stderr.write("error\\n");'
+                  'sys.stderr.flush(); sys.stdout.write("x" * %d + "\\nend")'
+                  % length)
+        p = subprocess.Popen([sys.executable, '-c', script],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(jhbuild.utils.cmds.pprint_output(p, format_line), 0)
+        self.assertEqual(lines[:4], [('a\n', False), ('\n', False),
+                                     ('b' + 'c' * 100000 + '\n', False),
+                                     ('error\n', True)])
+        # a line longer than MAX_LINE_LENGTH comes in pieces
+        self.assertEqual(''.join(line for line, error_output in lines[4:-1]),
+                         'x' * length + '\n')
+        for line, error_output in lines:
+            self.assertTrue(len(line) <= jhbuild.utils.cmds.MAX_LINE_LENGTH +
+                            jhbuild.utils.cmds.READ_SIZE)
+        self.assertEqual(lines[-1], ('end', False))
+
+    def test_output_tail(self):
+        spill = StringIO.StringIO()
+        output = jhbuild.utils.cmds.OutputTail(2, spill)
+        for i in range(5):
+            output.append('%d\n' % i)
+        self.assertEqual(str(output), '3\n4\n')
+        self.assertEqual(output.dropped, 3)
+        self.assertEqual(spill.getvalue(), '0\n1\n2\n3\n4\n')
+        output = jhbuild.utils.cmds.OutputTail()
+        output.append('0\n')
+        self.assertEqual(str(output), '0\n')
+        self.assertEqual(output.dropped, 0)
+
 def get_installed_pkgconfigs(config):
     ''' overload jhbuild.utils.get_installed_pkgconfigs'''
     return {'syspkgalpha'   : '2',